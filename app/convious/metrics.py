@@ -0,0 +1,157 @@
+"""
+In-process request metrics exposed in the Prometheus text format.
+
+Histograms are cumulative since the process started, as Prometheus expects, rates and quantiles over a rolling window
+are computed on the Prometheus side, e.g. with `histogram_quantile(0.99, rate(...[5m]))`.
+"""
+import threading
+from bisect import bisect_left
+from ipaddress import ip_address, ip_network
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpRequest, HttpResponse
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """
+    Thread safe histogram with fixed buckets.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self) -> Iterable[Tuple[str, float]]:
+        """
+        Yield the cumulative (le, count) buckets including +Inf.
+        """
+        with self.lock:
+            counts = list(self.counts)
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield f"{bound:g}", cumulative
+        yield "+Inf", cumulative + counts[-1]
+
+
+class Registry:
+    """
+    Histograms of every metric per view, plus collectors other apps register to expose their own counters.
+    """
+
+    histograms = {
+        "http_request_duration_seconds": (
+            "Wall time of the request.",
+            DURATION_BUCKETS,
+        ),
+        "db_duration_seconds": ("Time spent executing SQL.", DURATION_BUCKETS),
+        "db_queries": ("Number of SQL queries.", QUERY_COUNT_BUCKETS),
+        "render_duration_seconds": (
+            "Time spent rendering the response body, the serializers run in the view.",
+            DURATION_BUCKETS,
+        ),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Dict[str, Histogram]] = {
+            name: {} for name in self.histograms
+        }
+        self.requests: Dict[Tuple[str, int], int] = {}
+        self.collectors: List[Callable[[], Dict[str, float]]] = []
+
+    def observe(self, name: str, view: str, value: float) -> None:
+        histograms = self.metrics[name]
+        if view not in histograms:
+            with self.lock:
+                histograms.setdefault(view, Histogram(self.histograms[name][1]))
+        histograms[view].observe(value)
+
+    def count_request(self, view: str, status: int) -> None:
+        with self.lock:
+            self.requests[(view, status)] = self.requests.get((view, status), 0) + 1
+
+    def register_collector(self, collector: Callable[[], Dict[str, float]]) -> None:
+        """
+        Register a callable returning {metric name: value} pairs exported as gauges.
+        """
+        self.collectors.append(collector)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.metrics = {name: {} for name in self.histograms}
+            self.requests = {}
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_total Number of requests per view and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (view, status), count in sorted(self.requests.items()):
+            lines.append(
+                f'http_requests_total{{view="{view}",status="{status}"}} {count}'
+            )
+
+        for name, (description, _) in self.histograms.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for view, histogram in sorted(self.metrics[name].items()):
+                for bound, count in histogram.samples():
+                    lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {count}')
+                lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum:g}')
+                lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+
+        for collector in self.collectors:
+            for name, value in collector().items():
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def can_read_metrics(request: HttpRequest) -> bool:
+    """
+    Check if a request may read the metrics, sent by a staff user or from one of `settings.METRICS_ALLOWED_NETWORKS`.
+
+    The client address is the REMOTE_ADDR of the request, behind a proxy scrape the workers directly.
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_staff:
+        return True
+    try:
+        address = ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(
+        address in ip_network(network, strict=False)
+        for network in settings.METRICS_ALLOWED_NETWORKS
+    )
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Expose the metrics of this process in the Prometheus text format, to the clients allowed by `can_read_metrics`.
+    """
+    if not can_read_metrics(request):
+        raise PermissionDenied
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import logging
+import time
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpRequest, HttpResponse
+
+from .metrics import registry
+from .routers import PrimaryPin, current_pin
+
+logger = logging.getLogger("convious.metrics")
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper collecting the SQL and duration of every query of a request.
+    """
+
+    def __init__(self):
+        self.queries: List[Tuple[str, float]] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+
+# The recorder of the request being handled. Context variables follow the request into the threads of
+# sync_to_async, so the queries of async views are recorded as well.
+current_recorder: ContextVar[Optional[QueryRecorder]] = ContextVar(
+    "current_recorder", default=None
+)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper feeding the recorder of the current request, if any.
+    """
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    """
+    Install `record_query` on the connection, it stays installed for the lifetime of the connection's thread.
+    """
+    if record_query not in connection.execute_wrappers:
+        # First in the list, execute_wrapper() context managers pop the last wrapper when they exit
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+class MetricsMiddleware:
+    """
+    Record the wall time, DB time, query count and response rendering time of every view.
+
+    The metrics are kept per view, e.g. `RestaurantViewSet.order_by_ratings`, and exposed at `/metrics`. Requests
+    slower than `settings.METRICS_SLOW_REQUEST_MS` are logged along with their SQL.
+
+    The middleware supports both WSGI and ASGI, under ASGI it keeps the middleware chain async so that the async
+    views are not run in the thread Django shares between sync code.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Tell Django that calling the middleware returns a coroutine
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        for connection in connections.all():
+            install_query_recorder(connection)
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.record(request, response, recorder, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.record(request, response, recorder, time.perf_counter() - start)
+        return response
+
+    def record(
+        self,
+        request: HttpRequest,
+        response: HttpResponse,
+        recorder: QueryRecorder,
+        duration: float,
+    ):
+        """
+        Observe the metrics of the request and log it if it was slow.
+        """
+        view = None
+        if request.resolver_match:
+            view = get_view_name(request.resolver_match.func, request.method)
+        if view:
+            db_duration = sum(elapsed for _, elapsed in recorder.queries)
+            registry.observe("http_request_duration_seconds", view, duration)
+            registry.observe("db_duration_seconds", view, db_duration)
+            registry.observe("db_queries", view, len(recorder.queries))
+            registry.observe(
+                "render_duration_seconds",
+                view,
+                getattr(request, "metrics_render", 0.0),
+            )
+            registry.count_request(view, response.status_code)
+
+        if duration * 1000 > settings.METRICS_SLOW_REQUEST_MS:
+            logger.warning(
+                "Slow request %s %s (%s) took %.1f ms with %d queries:\n%s",
+                request.method,
+                request.path,
+                view,
+                duration * 1000,
+                len(recorder.queries),
+                "\n".join(
+                    f"  [{elapsed * 1000:.1f} ms] {sql}"
+                    for sql, elapsed in recorder.queries
+                ),
+            )
+
+    def process_template_response(self, request: HttpRequest, response):
+        # Render here to time it, Django skips rendering responses that are already rendered
+        start = time.perf_counter()
+        response.render()
+        request.metrics_render = time.perf_counter() - start
+        return response
+
+
+def get_view_name(view_func, method: str) -> Optional[str]:
+    """
+    Name a view after its class and action, e.g. `VoteViewSet.post`, or after its function.
+    """
+    cls = getattr(view_func, "cls", None)
+    if cls is None:
+        return f"{view_func.__module__}.{view_func.__name__}"
+    actions = getattr(view_func, "actions", None) or {}
+    return f"{cls.__name__}.{actions.get(method.lower(), method.lower())}"
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pin the reads of a request to the primary database when it writes, or when its client wrote in the last
+    `settings.REPLICA_PIN_SECONDS`, see `PrimaryReplicaRouter`.
+
+    Requests with unsafe methods are pinned from the start and count as writes. Clients are told apart by their
+    Authorization header or their session cookie, and the ones that wrote are remembered in
+    `settings.REPLICA_PIN_CACHE`, so a vote followed by a leaderboard request does not read a replica that has not
+    replayed the vote yet.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+
+        key = get_pin_key(request)
+        pin = self.get_pin(request, key)
+        token = current_pin.set(pin)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_pin.reset(token)
+        self.remember(pin, key)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        if not settings.REPLICA_DATABASES:
+            return await self.get_response(request)
+
+        key = get_pin_key(request)
+        pin = self.get_pin(request, key)
+        token = current_pin.set(pin)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_pin.reset(token)
+        self.remember(pin, key)
+        return response
+
+    def get_pin(self, request: HttpRequest, key: Optional[str]) -> PrimaryPin:
+        if request.method not in ("GET", "HEAD", "OPTIONS"):
+            # Count as a write even when it only ran raw SQL, which does not go through the router
+            pin = PrimaryPin(pinned=True)
+            pin.written = True
+            return pin
+        return PrimaryPin(
+            pinned=key is not None
+            and caches[settings.REPLICA_PIN_CACHE].get(key) is not None
+        )
+
+    def remember(self, pin: PrimaryPin, key: Optional[str]) -> None:
+        if pin.written and key is not None:
+            caches[settings.REPLICA_PIN_CACHE].set(key, 1, settings.REPLICA_PIN_SECONDS)
+
+
+def get_pin_key(request: HttpRequest) -> Optional[str]:
+    """
+    Get the cache key pinning the client of a request to the primary, or None for anonymous clients.
+    """
+    credentials = request.headers.get("Authorization") or request.COOKIES.get(
+        settings.SESSION_COOKIE_NAME
+    )
+    if not credentials:
+        return None
+    return "replica-pin:" + hashlib.sha256(credentials.encode()).hexdigest()
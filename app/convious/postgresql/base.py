@@ -0,0 +1,100 @@
+"""
+The PostgreSQL backend of Django with health checks of persistent connections and an optional connection pool.
+
+Configured by these keys of the database settings on top of the ones of `django.db.backends.postgresql`:
+
+    CONN_HEALTH_CHECKS: Check a persistent connection before its first query of a request and reconnect if it died,
+        as Django 4.1 does.
+    POOL: None, or a dict of MIN_SIZE, MAX_SIZE, TIMEOUT and MAX_IDLE to check connections out of a pool of the worker
+        process instead of opening them, see `ConnectionPool`.
+"""
+from typing import Optional
+
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+
+from .creation import DatabaseCreation
+from .pool import ConnectionPool, get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_enabled = self.settings_dict.get("CONN_HEALTH_CHECKS", False)
+        self.health_check_done = False
+
+    @property
+    def pool(self) -> Optional[ConnectionPool]:
+        options = self.settings_dict.get("POOL")
+        # The connections to the postgres database used to create databases are not worth keeping
+        if not options or self.alias == NO_DB_ALIAS:
+            return None
+        key = (
+            self.alias,
+            self.settings_dict["NAME"],
+            self.settings_dict["USER"],
+            self.settings_dict["HOST"],
+            self.settings_dict["PORT"],
+        )
+        return get_pool(
+            key,
+            lambda: ConnectionPool(
+                self._connect_for_pool(self.get_connection_params()),
+                min_size=options.get("MIN_SIZE", 0),
+                max_size=options.get("MAX_SIZE", 10),
+                timeout=options.get("TIMEOUT", 10),
+                max_idle=options.get("MAX_IDLE", 300),
+                health_checks=self.health_check_enabled,
+            ),
+        )
+
+    def _connect_for_pool(self, conn_params):
+        return lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        pool.fill()
+        connection = pool.getconn()
+        self.isolation_level = connection.isolation_level
+        return connection
+
+    def connect(self):
+        super().connect()
+        # A new, or pooled, connection was just checked
+        self.health_check_done = True
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        # Connections with errors go back to the pool only if they still work
+        discard = self.errors_occurred and not self.is_usable()
+        with self.wrap_database_errors:
+            pool.putconn(self.connection, discard=discard)
+
+    def close_if_health_check_failed(self) -> None:
+        """
+        Close a persistent connection that does not answer, once per request, so the next query reconnects.
+        """
+        if (
+            self.connection is None
+            or not self.health_check_enabled
+            or self.health_check_done
+        ):
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        # Called at the start and end of every request
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
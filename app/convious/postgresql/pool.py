@@ -0,0 +1,244 @@
+"""
+A small thread safe pool of PostgreSQL connections, shared by the threads of a worker process.
+
+Django 3.2 only keeps one persistent connection per thread, the pool lets a worker reuse connections across threads
+while capping how many it opens, e.g. the threads an ASGI worker runs sync views in.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Tuple
+
+from django.db import OperationalError
+
+# psycopg2.extensions.TRANSACTION_STATUS_IDLE, the pool itself does not need psycopg2
+TRANSACTION_STATUS_IDLE = 0
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Keeps between `min_size` and `max_size` connections opened by `connect`.
+
+    Checked in connections are handed out last in, first out, so the busiest ones stay warm and the ones left idle
+    for more than `max_idle` seconds are closed, down to `min_size`. When `max_size` connections are checked out,
+    `getconn` waits up to `timeout` seconds for one to be checked in.
+    """
+
+    def __init__(
+        self,
+        connect: Callable,
+        min_size: int = 0,
+        max_size: int = 10,
+        timeout: float = 10,
+        max_idle: float = 300,
+        health_checks: bool = False,
+    ):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_checks = health_checks
+        # The idle connections with the time they were checked in
+        self.idle: Deque[Tuple[object, float]] = deque()
+        # The number of opened connections, idle, checked out or being opened
+        self.size = 0
+        self.waiting = 0
+        self.timeouts = 0
+        self.condition = threading.Condition()
+
+    def getconn(self):
+        """
+        Check out an idle connection, or open a new one if the pool is not full.
+
+        With health checks, an idle connection is checked with a `SELECT 1` before being handed out, and replaced if
+        it does not answer, e.g. after a database restart.
+
+        Raises:
+            PoolTimeout: If no connection was checked in within `timeout` seconds.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            while True:
+                connection = self._pop_idle()
+                if connection is not None:
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection was available within {self.timeout} seconds, "
+                        f"all {self.max_size} connections of the pool are in use."
+                    )
+                self.waiting += 1
+                try:
+                    self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+        if connection is not None and (not self.health_checks or is_usable(connection)):
+            return connection
+        if connection is not None:
+            # Replace the dead connection, its slot is already counted
+            close_quietly(connection)
+        try:
+            return self.connect()
+        except BaseException:
+            self._release_slot()
+            raise
+
+    def putconn(self, connection, discard: bool = False) -> None:
+        """
+        Check in a connection, rolling back its open transaction if any.
+
+        Args:
+            connection: A connection checked out of this pool.
+            discard: Close the connection instead, e.g. when it is no longer usable.
+        """
+        if not discard and not connection.closed:
+            if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except Exception:
+                    discard = True
+        if discard or connection.closed:
+            close_quietly(connection)
+            self._release_slot()
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self._close_expired()
+            self.condition.notify()
+
+    def fill(self) -> None:
+        """
+        Open connections until the pool holds `min_size`.
+        """
+        while True:
+            with self.condition:
+                if self.size >= self.min_size:
+                    return
+                self.size += 1
+            try:
+                connection = self.connect()
+            except BaseException:
+                self._release_slot()
+                raise
+            with self.condition:
+                self.idle.appendleft((connection, time.monotonic()))
+                self.condition.notify()
+
+    def close(self) -> None:
+        """
+        Close the idle connections, checked out ones are closed when checked in.
+        """
+        with self.condition:
+            while self.idle:
+                connection, _ = self.idle.pop()
+                close_quietly(connection)
+                self.size -= 1
+            self.condition.notify_all()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.condition:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.size - len(self.idle),
+                "waiting": self.waiting,
+                "timeouts": self.timeouts,
+            }
+
+    def _pop_idle(self):
+        # Called with the condition held
+        while self.idle:
+            connection, _ = self.idle.pop()
+            if not connection.closed:
+                return connection
+            self.size -= 1
+        return None
+
+    def _close_expired(self) -> None:
+        # Called with the condition held, the oldest idle connections are at the left
+        expired_at = time.monotonic() - self.max_idle
+        while self.size > self.min_size and self.idle and self.idle[0][1] < expired_at:
+            connection, _ = self.idle.popleft()
+            close_quietly(connection)
+            self.size -= 1
+
+    def _release_slot(self) -> None:
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+
+def is_usable(connection) -> bool:
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        # Connections that are not in autocommit mode, e.g. fresh ones, started a transaction
+        if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+    except Exception:
+        return False
+    return True
+
+
+def close_quietly(connection) -> None:
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+_pools: Dict[tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key: tuple, create: Callable[[], ConnectionPool]) -> ConnectionPool:
+    """
+    Get the pool of this process for a key, e.g. the alias and the connection parameters, creating it on first use.
+
+    Pools are per process, a worker forked from a parent holding a pool creates its own one instead of sharing the
+    parent's sockets.
+    """
+    key = (os.getpid(), *key)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = create()
+    return pool
+
+
+def close_pools() -> None:
+    """
+    Close the idle connections of every pool of this process and forget the pools.
+    """
+    with _pools_lock:
+        pools = [pool for key, pool in _pools.items() if key[0] == os.getpid()]
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def get_pool_stats() -> Dict[str, int]:
+    """
+    Get the number of opened, idle and checked out connections and of waiting threads and timeouts, summed over the
+    pools of this process.
+    """
+    stats = {"size": 0, "idle": 0, "in_use": 0, "waiting": 0, "timeouts": 0}
+    for key, pool in list(_pools.items()):
+        if key[0] == os.getpid():
+            for name, value in pool.get_stats().items():
+                stats[name] += value
+    return stats
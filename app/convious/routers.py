@@ -0,0 +1,67 @@
+"""
+Routing of reads to the read replicas of the default database.
+"""
+import random
+from contextvars import ContextVar
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class PrimaryPin:
+    """
+    Whether the reads of the current request go to the primary, because the request writes or the client wrote
+    within `settings.REPLICA_PIN_SECONDS`, and whether the request wrote.
+    """
+
+    def __init__(self, pinned: bool = False):
+        self.pinned = pinned
+        self.written = False
+
+
+# The pin of the request being handled, see ReplicaPinningMiddleware. Like the query recorder it follows the
+# request into the threads of sync_to_async.
+current_pin: ContextVar[Optional[PrimaryPin]] = ContextVar("current_pin", default=None)
+
+
+def pin_to_primary() -> None:
+    """
+    Send the remaining reads of the current request to the primary, without counting as a write.
+    """
+    pin = current_pin.get()
+    if pin is not None:
+        pin.pinned = True
+
+
+class PrimaryReplicaRouter:
+    """
+    Send reads to a random alias of `settings.REPLICA_DATABASES` and writes to the default database, the primary.
+
+    Reads stay on the primary when there is no replica, inside a transaction of the primary, so a transaction
+    reads its own writes and locks, and when the current request is pinned to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not settings.REPLICA_DATABASES:
+            return DEFAULT_DB_ALIAS
+        pin = current_pin.get()
+        if pin is not None and pin.pinned:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.REPLICA_DATABASES)
+
+    def db_for_write(self, model, **hints):
+        pin = current_pin.get()
+        if pin is not None:
+            # The rest of the request, and the client's next requests, read what was written
+            pin.pinned = pin.written = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -28,6 +28,86 @@ DEBUG = True
 ALLOWED_HOSTS = ["*"]
 
 MAX_VOTES_PER_DAY = int(os.environ.get("MAX_VOTES_PER_DAY", 3))
+MAX_BULK_VOTES = int(os.environ.get("MAX_BULK_VOTES", 500))
+
+# Weights of the 1st, 2nd, ... vote of a user for a restaurant on a day, later votes weigh like the last one, see
+# restaurant/weights.py. Bump VOTE_WEIGHT_VERSION along with the weights and run reweight_votes to apply them to past
+# votes.
+VOTE_WEIGHT_POLICY = os.environ.get(
+    "VOTE_WEIGHT_POLICY", "restaurant.weights.StepWeightPolicy"
+)
+VOTE_WEIGHTS = os.environ.get("VOTE_WEIGHTS", "1,0.5,0.25").split(",")
+VOTE_WEIGHT_VERSION = os.environ.get("VOTE_WEIGHT_VERSION", "1")
+
+# "sync" writes every vote before responding, "async" queues it in the write-behind buffer of restaurant/buffer.py,
+# which is flushed every VOTE_BUFFER_FLUSH_INTERVAL_MS or VOTE_BUFFER_BATCH_SIZE votes.
+VOTE_WRITE_MODE = os.environ.get("VOTE_WRITE_MODE", "sync")
+VOTE_BUFFER_BATCH_SIZE = int(os.environ.get("VOTE_BUFFER_BATCH_SIZE", 500))
+VOTE_BUFFER_FLUSH_INTERVAL_MS = int(
+    os.environ.get("VOTE_BUFFER_FLUSH_INTERVAL_MS", 200)
+)
+VOTE_BUFFER_SPOOL_PATH = os.environ.get("VOTE_BUFFER_SPOOL_PATH", "")
+# Votes failing this many times are dropped, appended to VOTE_BUFFER_DEAD_LETTER_PATH if set
+VOTE_BUFFER_MAX_ATTEMPTS = int(os.environ.get("VOTE_BUFFER_MAX_ATTEMPTS", 5))
+VOTE_BUFFER_DEAD_LETTER_PATH = os.environ.get("VOTE_BUFFER_DEAD_LETTER_PATH", "")
+
+# Serve the vote and order_by_ratings endpoints with the async views of restaurant/async_views.py. This is the
+# default under ASGI (see convious/asgi.py), under WSGI the sync views are cheaper.
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS", "0") == "1"
+# The worker threads of the async views, every thread keeps its own database connection.
+ASYNC_VIEWS_DB_THREADS = int(os.environ.get("ASYNC_VIEWS_DB_THREADS", 8))
+
+# Per-user daily vote counters, see restaurant/counters.py. With more than one worker process the cache has to be
+# shared between them (e.g. memcached), otherwise every process enforces the limit on its own. The restaurant.W001
+# system check warns about caches kept in process memory.
+VOTE_COUNTER_BACKEND = os.environ.get(
+    "VOTE_COUNTER_BACKEND", "restaurant.counters.CacheVoteCounter"
+)
+VOTE_COUNTER_CACHE = os.environ.get("VOTE_COUNTER_CACHE", "default")
+
+# Sliding window limits of the vote requests per user and per API token, as "<requests>/<s|m|h|d>", empty disables
+# them, see restaurant/throttling.py. Like the vote counters they need a cache shared by the worker processes.
+VOTE_THROTTLE_USER_RATE = os.environ.get("VOTE_THROTTLE_USER_RATE", "30/m")
+VOTE_THROTTLE_TOKEN_RATE = os.environ.get("VOTE_THROTTLE_TOKEN_RATE", "120/m")
+VOTE_THROTTLE_CACHE = os.environ.get("VOTE_THROTTLE_CACHE", "default")
+
+# Cached order_by_ratings responses, see restaurant/caching.py. Ranges that include today are invalidated by votes and
+# expire after LEADERBOARD_CACHE_TIMEOUT seconds, past-only ranges never expire. The restaurant registries follow the
+# restaurants version kept in this cache, the restaurant.W003 system check warns about caches kept in process memory.
+LEADERBOARD_CACHE_ENABLED = os.environ.get("LEADERBOARD_CACHE_ENABLED", "1") == "1"
+LEADERBOARD_CACHE = os.environ.get("LEADERBOARD_CACHE", "default")
+LEADERBOARD_CACHE_TIMEOUT = int(os.environ.get("LEADERBOARD_CACHE_TIMEOUT", 300))
+
+# Incremental leaderboard index serving order_by_ratings pages without aggregating the rollup, see
+# restaurant/leaderboard.py. Empty disables it, "restaurant.leaderboard.InMemoryLeaderboardIndex" keeps it in the
+# process (single process deployments) and "restaurant.leaderboard.RedisLeaderboardIndex" in the Redis server at
+# LEADERBOARD_INDEX_URL, or in an in-process stand-in with "local://".
+LEADERBOARD_INDEX_BACKEND = os.environ.get("LEADERBOARD_INDEX_BACKEND", "")
+LEADERBOARD_INDEX_URL = os.environ.get(
+    "LEADERBOARD_INDEX_URL", "redis://localhost:6379/0"
+)
+
+# Ranked snapshots of the today, last 7 days, last 30 days and all time leaderboards, see restaurant/snapshots.py.
+# `manage.py refresh_leaderboards`, or a thread of the workers every LEADERBOARD_SNAPSHOT_REFRESH_INTERVAL seconds
+# (0 disables it), stores them in the LEADERBOARD_CACHE, order_by_ratings serves the matching requests from them while
+# they are younger than LEADERBOARD_SNAPSHOT_MAX_AGE seconds.
+LEADERBOARD_SNAPSHOTS_ENABLED = (
+    os.environ.get("LEADERBOARD_SNAPSHOTS_ENABLED", "1") == "1"
+)
+LEADERBOARD_SNAPSHOT_MAX_AGE = int(os.environ.get("LEADERBOARD_SNAPSHOT_MAX_AGE", 60))
+LEADERBOARD_SNAPSHOT_REFRESH_INTERVAL = int(
+    os.environ.get("LEADERBOARD_SNAPSHOT_REFRESH_INTERVAL", 0)
+)
+
+# Verified tokens and Basic credentials are cached by the restaurant views' authentication classes, see
+# restaurant/authentication.py. Deleting a token or saving a user invalidates them.
+AUTH_CACHE = os.environ.get("AUTH_CACHE", "default")
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.environ.get("AUTH_TOKEN_CACHE_TIMEOUT", 300))
+AUTH_BASIC_CACHE_TIMEOUT = int(os.environ.get("AUTH_BASIC_CACHE_TIMEOUT", 60))
+
+# Rows fetched per server-side cursor round trip and written per chunk by the streaming exports, see
+# restaurant/export.py.
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 2000))
 
 # Application definition
 
@@ -45,6 +125,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "convious.middleware.MetricsMiddleware",
+    "convious.middleware.ReplicaPinningMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -56,6 +138,14 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "convious.urls"
 
+# Per-view request metrics exposed at /metrics, requests slower than METRICS_SLOW_REQUEST_MS are logged with their SQL.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_SLOW_REQUEST_MS = int(os.environ.get("METRICS_SLOW_REQUEST_MS", 500))
+# Comma separated addresses or networks allowed to read /metrics, e.g. the Prometheus servers, staff users always can.
+METRICS_ALLOWED_NETWORKS = list(
+    filter(None, os.environ.get("METRICS_ALLOWED_NETWORKS", "127.0.0.1,::1").split(","))
+)
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -78,14 +168,74 @@ WSGI_APPLICATION = "convious.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Check connections out of a pool shared by the threads of the worker process, of at most POSTGRES_POOL_MAX_SIZE
+# connections per worker, instead of opening one per thread
+POSTGRES_POOL = os.environ.get("POSTGRES_POOL", "0") == "1"
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "convious.postgresql",
         "NAME": os.environ.get("POSTGRES_DB"),
         "USER": os.environ.get("POSTGRES_USER"),
         "PASSWORD": os.environ.get("POSTGRES_PASSWORD"),
         "HOST": os.environ.get("POSTGRES_HOST"),
         "PORT": int(os.environ.get("POSTGRES_PORT")),
+        # Seconds a thread keeps its connection between requests, 0 closes it, or checks it back in the pool, at
+        # the end of every request
+        "CONN_MAX_AGE": int(
+            os.environ.get("POSTGRES_CONN_MAX_AGE", 0 if POSTGRES_POOL else 60)
+        ),
+        # Check a reused connection before its first query of a request and reconnect if it died
+        "CONN_HEALTH_CHECKS": os.environ.get("POSTGRES_CONN_HEALTH_CHECKS", "1") == "1",
+        "POOL": {
+            "MIN_SIZE": int(os.environ.get("POSTGRES_POOL_MIN_SIZE", 0)),
+            "MAX_SIZE": int(os.environ.get("POSTGRES_POOL_MAX_SIZE", 10)),
+            # Seconds a request waits for a connection when MAX_SIZE are in use
+            "TIMEOUT": float(os.environ.get("POSTGRES_POOL_TIMEOUT", 10)),
+            # Seconds after which idle connections above MIN_SIZE are closed
+            "MAX_IDLE": float(os.environ.get("POSTGRES_POOL_MAX_IDLE", 300)),
+        }
+        if POSTGRES_POOL
+        else None,
+        "OPTIONS": {
+            "connect_timeout": int(os.environ.get("POSTGRES_CONNECT_TIMEOUT", 5)),
+        },
+    }
+}
+
+# Read replicas of the default database as comma separated HOST[:PORT], safe reads are spread over them while the
+# requests that write, and their client for REPLICA_PIN_SECONDS after, read from the primary
+REPLICA_DATABASES = []
+for index, address in enumerate(
+    filter(None, os.environ.get("POSTGRES_REPLICA_HOSTS", "").split(","))
+):
+    host, _, port = address.strip().partition(":")
+    DATABASES[f"replica_{index}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": int(port) if port else DATABASES["default"]["PORT"],
+        # Tests read the replicas through the test database of the primary
+        "TEST": {"MIRROR": "default"},
+    }
+    REPLICA_DATABASES.append(f"replica_{index}")
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", 5))
+# The clients that wrote are remembered in this cache, which has to be shared by the worker processes, otherwise a
+# client's next request may be handled by a process that does not know it wrote. The restaurant.W002 system check
+# warns about caches kept in process memory.
+REPLICA_PIN_CACHE = os.environ.get("REPLICA_PIN_CACHE", "default")
+
+DATABASE_ROUTERS = ["convious.routers.PrimaryReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
     }
 }
 
@@ -5,6 +5,8 @@ from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from .metrics import metrics_view
+
 schema_view = get_schema_view(
     openapi.Info(
         title="Convious Restaurant Rating API",
@@ -19,6 +21,7 @@ schema_view = get_schema_view(
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/restaurant/", include("restaurant.urls")),
+    path("metrics", metrics_view, name="metrics"),
     url(
         r"^swagger(?P<format>\.json|\.yaml)$",
         schema_view.without_ui(cache_timeout=0),
@@ -4,3 +4,22 @@ from django.apps import AppConfig
 class RestaurantConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "restaurant"
+
+    def ready(self):
+        from convious.metrics import registry
+        from convious.postgresql.pool import get_pool_stats
+
+        from . import checks, signals  # noqa: F401
+        from .caching import get_leaderboard_cache_stats
+
+        registry.register_collector(
+            lambda: {
+                f"leaderboard_cache_{name}": value
+                for name, value in get_leaderboard_cache_stats().items()
+            }
+        )
+        registry.register_collector(
+            lambda: {
+                f"db_pool_{name}": value for name, value in get_pool_stats().items()
+            }
+        )
@@ -0,0 +1,144 @@
+"""
+Async versions of the vote and order_by_ratings endpoints, served under ASGI when `settings.ASYNC_VIEWS` is on.
+
+Django 3.2 has no async ORM, so the views handle the request on the event loop and hand every step that needs the
+database or the cache to a worker thread with `database_sync_to_async`. Unlike the sync views, which Django runs one
+at a time in the single thread it shares between sync code, the worker threads run side by side. The views reuse the
+authentication, permissions, serializers and exception handling of the DRF viewsets, so both answer the same.
+
+Every worker thread keeps its own database connection, persistent with `CONN_MAX_AGE`, so the threads are capped by
+`settings.ASYNC_VIEWS_DB_THREADS` to bound the connections of a worker process.
+"""
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Type
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpRequest, HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet
+
+from .serializers import LeaderboardQueryParamSerializer
+from .views import RestaurantViewSet, VoteViewSet
+
+
+@functools.lru_cache(maxsize=None)
+def get_database_executor() -> ThreadPoolExecutor:
+    """
+    Get the pool of the worker threads running the database work of the async views.
+    """
+    return ThreadPoolExecutor(
+        max_workers=settings.ASYNC_VIEWS_DB_THREADS, thread_name_prefix="async-views"
+    )
+
+
+def database_sync_to_async(func: Callable) -> Callable:
+    """
+    Run `func` in one of the worker threads of `get_database_executor`, closing the thread's expired database
+    connections before and after, the way Django does at the start and end of a sync request.
+
+    Args:
+        func: The sync function to run.
+
+    Returns:
+        An async function returning the result of `func`.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(
+        wrapper, thread_sensitive=False, executor=get_database_executor()
+    )
+
+
+def async_action(viewset_class: Type[GenericViewSet], method: str, action: str):
+    """
+    Turn an async handler of a viewset action into an async Django view.
+
+    The returned view does what `APIView.dispatch` does for the sync views: it initializes the DRF request, runs the
+    authentication, permission and throttle checks in a worker thread, calls the handler and turns exceptions into
+    error responses. Responses are rendered as JSON on the event loop.
+
+    Args:
+        viewset_class: The viewset the action belongs to.
+        method: The HTTP method of the action.
+        action: The name of the action, e.g. `post`.
+
+    Returns:
+        A decorator taking `handler(view, request)`.
+    """
+
+    def decorator(handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        async def view(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+            self = viewset_class(
+                action=action, args=args, kwargs=kwargs, format_kwarg=None
+            )
+            # What `ViewSetMixin.as_view` does for the sync views
+            self.action_map = {method: action}
+            setattr(self, method, getattr(self, action))
+            self.renderer_classes = [JSONRenderer]
+            self.headers = self.default_response_headers
+            request = self.initialize_request(request, *args, **kwargs)
+            self.request = request
+
+            try:
+                if request.method.lower() != method:
+                    self.http_method_not_allowed(request)
+                await database_sync_to_async(self.initial)(request, *args, **kwargs)
+                response = await handler(self, request)
+            except Exception as exc:
+                response = self.handle_exception(exc)
+
+            response = self.finalize_response(request, response, *args, **kwargs)
+            response.render()
+            return HttpResponse(
+                response.content,
+                status=response.status_code,
+                headers=dict(response.items()),
+            )
+
+        # DRF checks the CSRF token of session authenticated requests itself
+        view.csrf_exempt = True
+        # Name the view like its sync version in the metrics
+        view.cls = viewset_class
+        view.actions = {method: action}
+        return view
+
+    return decorator
+
+
+@async_action(VoteViewSet, "post", "post")
+async def vote(view: VoteViewSet, request: Request) -> Response:
+    """
+    Create or update a vote for a restaurant, see `VoteViewSet.post`.
+
+    Validating the restaurant, reserving the daily vote and writing it all need the database or the vote counter, so
+    they run in one worker thread.
+    """
+    return await database_sync_to_async(view.post)(request)
+
+
+@async_action(RestaurantViewSet, "get", "order_by_ratings")
+async def order_by_ratings(view: RestaurantViewSet, request: Request) -> Response:
+    """
+    Order restaurants by their ratings with a date range if specified, see `RestaurantViewSet.order_by_ratings`.
+
+    The query parameters are validated on the event loop, the conditional request check, the cache lookup and the
+    leaderboard query run in a worker thread.
+    """
+    query_param_serializer = LeaderboardQueryParamSerializer(data=request.query_params)
+    query_param_serializer.is_valid(raise_exception=True)
+    return await database_sync_to_async(view.get_leaderboard_response)(
+        query_param_serializer.validated_data
+    )
@@ -0,0 +1,121 @@
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+
+from .caching import (
+    get_cached_credentials,
+    get_credentials_cache_key,
+    set_cached_credentials,
+)
+
+# The fields of the users kept in the cache, the password hash is left out
+CACHED_USER_FIELDS = (
+    "id",
+    "username",
+    "email",
+    "first_name",
+    "last_name",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+)
+
+
+def pack_user(user: User) -> Dict[str, Any]:
+    """
+    Get the fields of a user that are cached with its credentials.
+    """
+    return {field: getattr(user, field) for field in CACHED_USER_FIELDS}
+
+
+def unpack_user(fields: Dict[str, Any]) -> User:
+    """
+    Rebuild a user from its cached fields. The other fields, e.g. the password, are deferred: they are read from the
+    database if accessed, and left untouched if the user is saved.
+    """
+    # from_db takes the values in the order of the model's fields
+    names = [
+        field.attname
+        for field in User._meta.concrete_fields
+        if field.attname in CACHED_USER_FIELDS
+    ]
+    return User.from_db(DEFAULT_DB_ALIAS, names, [fields[name] for name in names])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication remembering the user of every token for `settings.AUTH_TOKEN_CACHE_TIMEOUT` seconds.
+
+    Warm requests are authenticated without any query. Deleting the token or saving or deleting its user invalidates
+    the cached entry, see restaurant/signals.py. Only the token key and the `CACHED_USER_FIELDS` of its user are
+    cached.
+    """
+
+    def authenticate_credentials(self, key: str) -> Tuple[User, Token]:
+        """
+        Get the user and token of a token key, from the cache if possible.
+
+        Args:
+            key: The token key sent by the client.
+
+        Returns:
+            The authenticated user and its token.
+        """
+        cache_key = get_credentials_cache_key("token", key)
+        fields = get_cached_credentials(cache_key)
+        if fields is None:
+            user, token = super().authenticate_credentials(key)
+            set_cached_credentials(
+                cache_key,
+                pack_user(user),
+                user.pk,
+                settings.AUTH_TOKEN_CACHE_TIMEOUT,
+            )
+            return user, token
+
+        user = unpack_user(fields)
+        if not user.is_active:
+            raise AuthenticationFailed("User inactive or deleted.")
+        token = Token.from_db(DEFAULT_DB_ALIAS, ["key", "user_id"], [key, user.pk])
+        token.user = user
+        return user, token
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Basic authentication remembering successfully verified credentials for `settings.AUTH_BASIC_CACHE_TIMEOUT` seconds.
+
+    Checking a password runs the deliberately slow password hasher, so warm requests skip it as well as the user
+    query. Failed attempts are never cached and saving or deleting the user invalidates its cached credentials. Only
+    the `CACHED_USER_FIELDS` of the user are cached.
+    """
+
+    def authenticate_credentials(
+        self, userid: str, password: str, request: Optional[Request] = None
+    ) -> Tuple[User, None]:
+        """
+        Get the user of a username and password, from the cache if possible.
+
+        Args:
+            userid: The username sent by the client.
+            password: The password sent by the client.
+            request: The request being authenticated.
+
+        Returns:
+            The authenticated user and no token.
+        """
+        cache_key = get_credentials_cache_key("basic", f"{userid}:{password}")
+        fields = get_cached_credentials(cache_key)
+        if fields is None:
+            user, _ = super().authenticate_credentials(userid, password, request)
+            set_cached_credentials(
+                cache_key, pack_user(user), user.pk, settings.AUTH_BASIC_CACHE_TIMEOUT
+            )
+            return user, None
+        return unpack_user(fields), None
@@ -0,0 +1,301 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import date as Date
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections
+from django.utils import timezone
+
+from .counters import get_vote_counter
+from .utils import calculate_bulk_vote_weights
+
+logger = logging.getLogger(__name__)
+
+BufferedVote = Tuple[int, UUID, Date]
+# Errors of a database that can not be reached or is busy, they are not the votes' fault
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+
+class VoteBuffer:
+    """
+    Write-behind buffer of votes, used when `settings.VOTE_WRITE_MODE` is "async".
+
+    Votes are put on an in-process queue and a background thread writes them in batches, every `flush_interval_ms`
+    milliseconds or as soon as `batch_size` votes are waiting. Repeated votes of the same user for the same restaurant
+    on the same day are folded into a single upsert carrying the accumulated weight.
+
+    The queue is drained when the process exits. Votes that can not be written at that point are appended to the
+    spool file, if one is configured, and put back on the queue by the next process.
+
+    Votes that keep failing, e.g. for a restaurant deleted since they were queued, are dropped after `max_attempts`
+    attempts. They are appended to the dead letter file, if one is configured, and their reserved slots are released.
+    """
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        flush_interval_ms: Optional[int] = None,
+        spool_path: Optional[str] = None,
+        dead_letter_path: Optional[str] = None,
+        max_attempts: Optional[int] = None,
+        autostart: bool = True,
+    ):
+        self.batch_size = batch_size or settings.VOTE_BUFFER_BATCH_SIZE
+        self.flush_interval = (
+            flush_interval_ms or settings.VOTE_BUFFER_FLUSH_INTERVAL_MS
+        ) / 1000
+        self.spool_path = (
+            spool_path if spool_path is not None else settings.VOTE_BUFFER_SPOOL_PATH
+        )
+        self.dead_letter_path = (
+            dead_letter_path
+            if dead_letter_path is not None
+            else settings.VOTE_BUFFER_DEAD_LETTER_PATH
+        )
+        self.max_attempts = max_attempts or settings.VOTE_BUFFER_MAX_ATTEMPTS
+        self.autostart = autostart
+        # Failed attempts of the folded votes waiting to be retried
+        self.attempts: Counter = Counter()
+        self.queue: "queue.Queue[BufferedVote]" = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.thread_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.restore()
+
+    def put(self, user_id: int, restaurant_id) -> None:
+        """
+        Queue a vote of today, the user's daily slot must have been reserved already.
+        """
+        self.queue.put((user_id, restaurant_id, timezone.now().date()))
+        if self.autostart:
+            self.start()
+
+    def start(self) -> None:
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopped.clear()
+                self.thread = threading.Thread(
+                    target=self.run, name="vote-buffer", daemon=True
+                )
+                self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background thread and write the votes still waiting in the queue.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.drain()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            votes = self.collect()
+            if votes:
+                if not self.flush(votes):
+                    # Give the database some time before retrying
+                    self.stopped.wait(self.flush_interval)
+                close_old_connections()
+
+    def collect(self) -> List[BufferedVote]:
+        """
+        Wait for a batch, which is complete after `batch_size` votes or `flush_interval` after its first vote.
+        """
+        try:
+            votes = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(votes) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                votes.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return votes
+
+    def flush(self, votes: List[BufferedVote]) -> bool:
+        """
+        Fold the votes per (user, restaurant, date) and write every day with a single bulk upsert.
+
+        When the upsert of a day fails, its folded votes are written one by one, so a vote that can not be written does
+        not hold back the others. Failed votes are put back on the queue to be retried or, after `max_attempts`
+        attempts, dropped. Failures to reach the database do not count as attempts, the votes wait until it is back.
+
+        Returns:
+            True: If all the votes were written or dropped.
+            False: If some votes were put back on the queue to be retried.
+        """
+        vote_counts_per_date: dict = {}
+        for user_id, restaurant_id, date in votes:
+            vote_counts_per_date.setdefault(date, Counter())[
+                (user_id, restaurant_id)
+            ] += 1
+
+        retrying = False
+        with self.flush_lock:
+            for date, vote_counts in sorted(vote_counts_per_date.items()):
+                try:
+                    calculate_bulk_vote_weights(vote_counts, date=date)
+                except Exception as error:
+                    logger.exception(
+                        "Could not write %d buffered votes of %s",
+                        sum(vote_counts.values()),
+                        date,
+                    )
+                    if len(vote_counts) == 1 or isinstance(error, TRANSIENT_ERRORS):
+                        errors = {key: error for key in vote_counts}
+                    else:
+                        errors = self.write_one_by_one(vote_counts, date)
+                else:
+                    errors = {}
+
+                for (user_id, restaurant_id), count in vote_counts.items():
+                    vote = (user_id, restaurant_id, date)
+                    error = errors.get((user_id, restaurant_id))
+                    if error is None:
+                        self.attempts.pop(vote, None)
+                    elif self.retry(vote, count, error):
+                        retrying = True
+                    else:
+                        self.drop(vote, count)
+        return not retrying
+
+    def write_one_by_one(self, vote_counts: Counter, date: Date) -> dict:
+        """
+        Write the folded votes of a day separately.
+
+        Returns:
+            The error of every (user_id, restaurant_id) pair whose votes could not be written.
+        """
+        errors = {}
+        for key, count in vote_counts.items():
+            try:
+                calculate_bulk_vote_weights({key: count}, date=date)
+            except Exception as error:
+                errors[key] = error
+        return errors
+
+    def retry(self, vote: BufferedVote, count: int, error: Exception) -> bool:
+        """
+        Put failed votes back on the queue, unless they used their `max_attempts` attempts.
+
+        Returns:
+            True: If the votes were put back on the queue.
+            False: If they should be dropped.
+        """
+        if not isinstance(error, TRANSIENT_ERRORS):
+            self.attempts[vote] += 1
+        if self.attempts[vote] >= self.max_attempts:
+            return False
+        for _ in range(count):
+            self.queue.put(vote)
+        return True
+
+    def drop(self, vote: BufferedVote, count: int) -> None:
+        """
+        Give up on votes, appending them to the dead letter file and releasing their reserved slots.
+        """
+        user_id, restaurant_id, date = vote
+        del self.attempts[vote]
+        logger.error(
+            "Dropping %d buffered votes of user %s for restaurant %s on %s after %d attempts",
+            count,
+            user_id,
+            restaurant_id,
+            date,
+            self.max_attempts,
+        )
+        if self.dead_letter_path:
+            self.write_votes(self.dead_letter_path, [vote] * count)
+        # Slots are only reserved for today, the counters of past days are gone
+        if date == timezone.now().date():
+            vote_counter = get_vote_counter()
+            for _ in range(count):
+                vote_counter.release(user_id)
+
+    def drain(self) -> None:
+        """
+        Write every queued vote now, spooling them to disk if that fails.
+        """
+        votes = []
+        while True:
+            try:
+                votes.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if votes and not self.flush(votes):
+            self.spool()
+
+    def spool(self) -> None:
+        votes = []
+        while True:
+            try:
+                votes.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not votes:
+            return
+        if not self.spool_path:
+            logger.error("Dropping %d buffered votes, no spool file set", len(votes))
+            return
+
+        self.write_votes(self.spool_path, votes)
+        logger.warning("Spooled %d buffered votes to %s", len(votes), self.spool_path)
+
+    @staticmethod
+    def write_votes(path: str, votes: List[BufferedVote]) -> None:
+        """
+        Append votes to a spool or dead letter file, one JSON list per line.
+        """
+        with open(path, "a") as file:
+            for user_id, restaurant_id, date in votes:
+                file.write(json.dumps([user_id, str(restaurant_id), date.isoformat()]))
+                file.write("\n")
+
+    def restore(self) -> None:
+        """
+        Queue the votes a previous process spooled to disk.
+
+        Processes starting together race for the spool, the first one to move it to its own path restores it.
+        """
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+
+        restoring_path = f"{self.spool_path}.{os.getpid()}"
+        try:
+            os.replace(self.spool_path, restoring_path)
+        except FileNotFoundError:
+            return
+        with open(restoring_path) as spool:
+            for line in spool:
+                user_id, restaurant_id, date = json.loads(line)
+                self.queue.put((user_id, UUID(restaurant_id), Date.fromisoformat(date)))
+        os.remove(restoring_path)
+
+        if self.autostart:
+            self.start()
+
+
+@lru_cache(maxsize=None)
+def get_vote_buffer() -> VoteBuffer:
+    """
+    Get the vote buffer of this process, drained when the process exits.
+    """
+    vote_buffer = VoteBuffer()
+    atexit.register(vote_buffer.stop)
+    return vote_buffer
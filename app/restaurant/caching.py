@@ -0,0 +1,294 @@
+import time
+from datetime import date as Date
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+LEADERBOARD_KEY_PREFIX = "leaderboard"
+AUTH_KEY_PREFIX = "auth"
+RESTAURANT_KEY_PREFIX = "restaurant"
+
+
+def _get_cache(alias: Optional[str] = None):
+    return caches[alias or settings.LEADERBOARD_CACHE]
+
+
+def is_shared_cache(alias: str) -> bool:
+    """
+    Check if a cache is shared by the processes of a deployment, i.e. it is not kept in the memory of each process.
+    """
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+def _get_version(key: str, alias: Optional[str] = None) -> int:
+    """
+    Get a version counter, initialising missing ones with the current time.
+
+    Seeding with the time instead of 1 makes sure a counter that got evicted never goes back to a version that cached
+    responses were already stored under.
+    """
+    cache = _get_cache(alias)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key: str, alias: Optional[str] = None) -> None:
+    cache = _get_cache(alias)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def _touch(key: str) -> None:
+    """
+    Record when a version counter was last bumped, which leaderboards send as their Last-Modified date.
+    """
+    _get_cache().set(f"{key}:modified", int(time.time()), None)
+
+
+def _incr_counter(key: str) -> None:
+    cache = _get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_leaderboard_version() -> int:
+    """
+    Get the version of every leaderboard, bumped when restaurants change or the rating rollup is rebuilt.
+    """
+    return _get_version(f"{LEADERBOARD_KEY_PREFIX}:version")
+
+
+def bump_leaderboard_version() -> None:
+    """
+    Invalidate every cached leaderboard.
+    """
+    _bump_version(f"{LEADERBOARD_KEY_PREFIX}:version")
+    _touch(f"{LEADERBOARD_KEY_PREFIX}:version")
+
+
+def get_votes_version(date: Date) -> int:
+    """
+    Get the version of the votes of a day, bumped whenever somebody votes on that day.
+    """
+    return _get_version(f"{LEADERBOARD_KEY_PREFIX}:votes:{date.isoformat()}")
+
+
+def bump_votes_version(date: Date) -> None:
+    """
+    Invalidate the cached leaderboards whose date range includes the given day.
+    """
+    _bump_version(f"{LEADERBOARD_KEY_PREFIX}:votes:{date.isoformat()}")
+    _touch(f"{LEADERBOARD_KEY_PREFIX}:votes:{date.isoformat()}")
+
+
+def is_past_range(params: Dict[str, Any]) -> bool:
+    """
+    Check if a leaderboard date range ended before today, meaning no new vote can change it.
+    """
+    date_to = params.get("date_to")
+    return bool(date_to and date_to < timezone.now().date())
+
+
+def get_leaderboard_validators(params: Dict[str, Any]) -> Tuple[str, int]:
+    """
+    Get the ETag and Last-Modified date of the leaderboards of a date range.
+
+    Like their cache keys, they follow the leaderboard version and, unless the range ended before today, today's votes
+    version. Versions whose modification date is unknown, e.g. never bumped or evicted, count as modified now.
+
+    Args:
+        params: The validated query parameters of the leaderboard, i.e. date_from and date_to.
+
+    Returns:
+        The ETag, without quotes, and the Last-Modified date as a timestamp.
+    """
+    keys = [f"{LEADERBOARD_KEY_PREFIX}:version"]
+    if not is_past_range(params):
+        keys.append(
+            f"{LEADERBOARD_KEY_PREFIX}:votes:{timezone.now().date().isoformat()}"
+        )
+
+    versions = [_get_version(key) for key in keys]
+    cache = _get_cache()
+    modified = cache.get_many([f"{key}:modified" for key in keys])
+    last_modified = 0
+    for key in keys:
+        timestamp = modified.get(f"{key}:modified")
+        if timestamp is None:
+            cache.add(f"{key}:modified", int(time.time()), None)
+            timestamp = cache.get(f"{key}:modified", int(time.time()))
+        last_modified = max(last_modified, timestamp)
+    return (
+        "leaderboard-" + "-".join(str(version) for version in versions),
+        last_modified,
+    )
+
+
+def get_leaderboard_cache_key(
+    params: Dict[str, Any], pagination: Optional[Dict[str, Any]]
+) -> Optional[str]:
+    """
+    Build the cache key of a leaderboard response.
+
+    Votes are always cast today, so only ranges that include today can change with new votes and their key embeds
+    today's votes version. Ranges that ended before today are frozen and keyed without it.
+
+    Args:
+        params: The validated query parameters of the leaderboard, i.e. date_from and date_to.
+        pagination: The resolved parameters selecting the page, e.g. page and page_size, None if they are invalid.
+
+    Returns:
+        key (Optional[str]): The cache key, or None if the response should not be cached.
+    """
+    if not settings.LEADERBOARD_CACHE_ENABLED or pagination is None:
+        return None
+
+    today = timezone.now().date()
+    date_from = params.get("date_from")
+
+    if date_from and date_from > today:
+        # Future ranges start changing once their first day comes, there is no point in caching them
+        return None
+
+    if is_past_range(params):
+        votes_version = "past"
+    else:
+        votes_version = get_votes_version(today)
+
+    parts = [
+        LEADERBOARD_KEY_PREFIX,
+        get_leaderboard_version(),
+        votes_version,
+        *(f"{name}={value}" for name, value in sorted(params.items())),
+        *(f"{name}={value}" for name, value in sorted(pagination.items())),
+    ]
+    return ":".join(str(part) for part in parts)
+
+
+def get_cached_leaderboard(key: str) -> Optional[Any]:
+    """
+    Get a cached leaderboard response and record the cache hit or miss.
+    """
+    data = _get_cache().get(key)
+    _incr_counter(f"{LEADERBOARD_KEY_PREFIX}:{'misses' if data is None else 'hits'}")
+    return data
+
+
+def set_cached_leaderboard(key: str, data: Any, params: Dict[str, Any]) -> None:
+    """
+    Cache a leaderboard response. Past-only ranges can not change anymore, so they are cached without expiry.
+    """
+    timeout = None if is_past_range(params) else settings.LEADERBOARD_CACHE_TIMEOUT
+    _get_cache().set(key, data, timeout)
+
+
+def get_leaderboard_snapshot(window: str) -> Optional[Tuple]:
+    """
+    Get the stored snapshot of a leaderboard window, see restaurant/snapshots.py.
+    """
+    return _get_cache().get(f"{LEADERBOARD_KEY_PREFIX}:snapshot:{window}")
+
+
+def set_leaderboard_snapshot(window: str, snapshot: Tuple) -> None:
+    # Snapshots are only served on the day they were computed
+    _get_cache().set(f"{LEADERBOARD_KEY_PREFIX}:snapshot:{window}", snapshot, 86400)
+
+
+def lock_leaderboard_snapshots(timeout: int) -> bool:
+    """
+    Take the lock of refreshing the snapshots for `timeout` seconds, so one worker refreshes them per interval.
+
+    Returns:
+        True if the lock was taken, False if another worker holds it.
+    """
+    return _get_cache().add(f"{LEADERBOARD_KEY_PREFIX}:snapshot:lock", 1, timeout)
+
+
+def get_restaurants_version() -> int:
+    """
+    Get the version of the set of restaurants, bumped whenever a restaurant is saved or deleted.
+    """
+    return _get_version(f"{RESTAURANT_KEY_PREFIX}:version")
+
+
+def bump_restaurants_version() -> None:
+    """
+    Invalidate the restaurant registries of every process, see restaurant/registry.py.
+    """
+    _bump_version(f"{RESTAURANT_KEY_PREFIX}:version")
+
+
+def get_leaderboard_cache_stats() -> Dict[str, int]:
+    """
+    Get the number of leaderboard cache hits and misses.
+    """
+    stats = _get_cache().get_many(
+        [f"{LEADERBOARD_KEY_PREFIX}:hits", f"{LEADERBOARD_KEY_PREFIX}:misses"]
+    )
+    return {
+        "hits": stats.get(f"{LEADERBOARD_KEY_PREFIX}:hits", 0),
+        "misses": stats.get(f"{LEADERBOARD_KEY_PREFIX}:misses", 0),
+    }
+
+
+def get_user_auth_version(user_id: int) -> int:
+    """
+    Get the version of a user's cached credentials, bumped whenever the user changes.
+    """
+    return _get_version(f"{AUTH_KEY_PREFIX}:user:{user_id}", settings.AUTH_CACHE)
+
+
+def bump_user_auth_version(user_id: int) -> None:
+    """
+    Invalidate every cached credential of a user, e.g. after a password change or deactivation.
+    """
+    _bump_version(f"{AUTH_KEY_PREFIX}:user:{user_id}", settings.AUTH_CACHE)
+
+
+def get_credentials_cache_key(scheme: str, credentials: str) -> str:
+    """
+    Build the cache key of verified credentials.
+
+    The credentials are hashed with a key derived from SECRET_KEY, so neither tokens nor passwords end up in the
+    cache and the keys can not be brute forced without the secret.
+    """
+    digest = salted_hmac(f"restaurant.authentication.{scheme}", credentials)
+    return f"{AUTH_KEY_PREFIX}:{scheme}:{digest.hexdigest()}"
+
+
+def get_cached_credentials(key: str) -> Optional[Any]:
+    """
+    Get what was cached for verified credentials, unless their user changed since.
+    """
+    entry = _get_cache(settings.AUTH_CACHE).get(key)
+    if entry is None:
+        return None
+    value, user_id, version = entry
+    if version != get_user_auth_version(user_id):
+        return None
+    return value
+
+
+def set_cached_credentials(key: str, value: Any, user_id: int, timeout: int) -> None:
+    """
+    Cache the outcome of verifying credentials for `timeout` seconds, tied to the current version of their user.
+    """
+    entry = (value, user_id, get_user_auth_version(user_id))
+    _get_cache(settings.AUTH_CACHE).set(key, entry, timeout)
+
+
+def delete_cached_credentials(key: str) -> None:
+    _get_cache(settings.AUTH_CACHE).delete(key)
@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from django.core.exceptions import ImproperlyConfigured
+
+from .caching import is_shared_cache
+from .throttling import parse_rate
+
+
+@register(Tags.caches)
+def check_vote_counter_cache(app_configs, **kwargs):
+    """
+    Warn when the vote counters are kept in the memory of each process, every worker would then enforce its own
+    daily limit and a user could cast `MAX_VOTES_PER_DAY` votes per worker.
+    """
+    if settings.VOTE_COUNTER_BACKEND != "restaurant.counters.CacheVoteCounter":
+        return []
+    if is_shared_cache(settings.VOTE_COUNTER_CACHE):
+        return []
+    return [
+        Warning(
+            f"The vote counters are stored in the {settings.VOTE_COUNTER_CACHE!r} cache, which is not shared by the "
+            "worker processes.",
+            hint="With more than one worker process, point VOTE_COUNTER_CACHE to a shared cache such as memcached, "
+            "otherwise every process enforces MAX_VOTES_PER_DAY on its own.",
+            id="restaurant.W001",
+        )
+    ]
+
+
+@register(Tags.caches)
+def check_replica_pin_cache(app_configs, **kwargs):
+    """
+    Warn when the clients pinned to the primary are kept in the memory of each process, a client's next request
+    could then be handled by a worker that does not know it wrote and read a lagging replica.
+    """
+    if not settings.REPLICA_DATABASES or is_shared_cache(settings.REPLICA_PIN_CACHE):
+        return []
+    return [
+        Warning(
+            f"The replica pins are stored in the {settings.REPLICA_PIN_CACHE!r} cache, which is not shared by the "
+            "worker processes.",
+            hint="With more than one worker process, point REPLICA_PIN_CACHE to a shared cache such as memcached, "
+            "otherwise clients may not read their own writes.",
+            id="restaurant.W002",
+        )
+    ]
+
+
+@register(Tags.caches)
+def check_restaurant_registry_cache(app_configs, **kwargs):
+    """
+    Warn when the restaurants version followed by the restaurant registries is kept in the memory of each process,
+    the registries of the other processes would then keep accepting votes for deleted restaurants.
+    """
+    if is_shared_cache(settings.LEADERBOARD_CACHE):
+        return []
+    return [
+        Warning(
+            f"The restaurant registries follow the {settings.LEADERBOARD_CACHE!r} cache, which is not shared by the "
+            "worker processes.",
+            hint="With more than one worker process, point LEADERBOARD_CACHE to a shared cache such as memcached, "
+            "otherwise the processes do not see the restaurants deleted by the others.",
+            id="restaurant.W003",
+        )
+    ]
+
+
+@register()
+def check_vote_throttle_rates(app_configs, **kwargs):
+    """
+    Report malformed vote throttle rates at startup rather than on the first vote.
+    """
+    errors = []
+    for name in ("VOTE_THROTTLE_USER_RATE", "VOTE_THROTTLE_TOKEN_RATE"):
+        try:
+            parse_rate(getattr(settings, name))
+        except ImproperlyConfigured as error:
+            errors.append(Error(f"{name}: {error}", id="restaurant.E001"))
+    return errors
@@ -0,0 +1,72 @@
+from typing import Dict, Optional, Tuple
+
+from django.db.models import Count, Max, QuerySet
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+
+def get_validator_headers(etag: str, last_modified: Optional[int]) -> Dict[str, str]:
+    """
+    Build the ETag and Last-Modified headers of a response.
+    """
+    headers = {"ETag": quote_etag(etag)}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def get_not_modified_response(
+    request: Request, etag: str, last_modified: Optional[int]
+) -> Optional[Response]:
+    """
+    Answer a conditional GET whose If-None-Match or If-Modified-Since header shows the client's copy is current.
+
+    Args:
+        request: The request, possibly conditional.
+        etag: The current ETag of the resource, without quotes.
+        last_modified: The current Last-Modified date of the resource as a timestamp.
+
+    Returns:
+        A 304 Not Modified response, or None if the resource has to be sent.
+    """
+    headers = get_validator_headers(etag, last_modified)
+    if get_conditional_response(
+        request, etag=headers["ETag"], last_modified=last_modified
+    ):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return None
+
+
+def get_restaurants_validators(queryset: QuerySet) -> Tuple[str, Optional[int]]:
+    """
+    Get the ETag and Last-Modified date of a list of restaurants from their count and latest `updated_at`.
+
+    The count changes when a restaurant is deleted, the latest `updated_at` when one is created or updated. Changes
+    to the nested users are not tracked.
+    """
+    state = queryset.order_by().aggregate(
+        count=Count("pk"), updated_at=Max("updated_at")
+    )
+    if state["updated_at"] is None:
+        return "restaurants-0", None
+    last_modified = int(state["updated_at"].timestamp())
+    return (
+        f"restaurants-{state['count']}-{state['updated_at'].timestamp()}",
+        last_modified,
+    )
+
+
+def get_restaurant_validators(queryset: QuerySet, pk) -> Optional[Tuple[str, int]]:
+    """
+    Get the ETag and Last-Modified date of a restaurant from its `updated_at`.
+
+    Returns:
+        The ETag and Last-Modified date, or None if the restaurant does not exist.
+    """
+    updated_at = queryset.filter(pk=pk).values_list("updated_at", flat=True).first()
+    if updated_at is None:
+        return None
+    return f"restaurant-{pk}-{updated_at.timestamp()}", int(updated_at.timestamp())
@@ -0,0 +1,141 @@
+from abc import ABC, abstractmethod
+from datetime import date as Date
+from datetime import timedelta
+from functools import lru_cache
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .utils import get_user_daily_vote_count
+
+
+def seconds_until_midnight() -> int:
+    """
+    Get the number of seconds left until the next midnight UTC, when the daily vote limits reset.
+
+    Returns:
+        seconds (int): The seconds until midnight, at least 1.
+    """
+    now = timezone.now()
+    midnight = (now + timedelta(days=1)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    return max(int((midnight - now).total_seconds()), 1)
+
+
+class VoteCounter(ABC):
+    """
+    Base class of the per-user daily vote counters used to enforce `settings.MAX_VOTES_PER_DAY`.
+
+    Counters are a cache of the votes stored in the database. Whenever a counter is missing it is rebuilt from the
+    `Vote` table, which stays the source of truth.
+    """
+
+    @abstractmethod
+    def count(self, user_id: int, date: Optional[Date] = None) -> int:
+        """
+        Get the number of votes the user has cast on the given day, today by default.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def reserve(self, user_id: int) -> bool:
+        """
+        Atomically reserve one of the user's daily vote slots.
+
+        Returns:
+            True: If a slot was reserved and the vote may be written.
+            False: If the user has reached the maximum amount of votes allowed per day.
+        """
+        raise NotImplementedError
+
+    def is_exhausted(self, user_id: int) -> bool:
+        """
+        Tell whether the user is known to have used all of today's votes, without reserving one.
+
+        It is a fast path to turn such users away early, it may answer False when the counter is not known without a
+        database query, `reserve` still enforces the limit.
+        """
+        return False
+
+    @abstractmethod
+    def release(self, user_id: int) -> None:
+        """
+        Give back a slot reserved by `reserve`, e.g. when the vote could not be written.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def rebuild(self, user_id: int, date: Optional[Date] = None) -> int:
+        """
+        Reset the user's counter of the given day to the number of votes stored in the database.
+        """
+        raise NotImplementedError
+
+
+class CacheVoteCounter(VoteCounter):
+    """
+    Vote counter stored in a Django cache, the local memory cache unless `settings.VOTE_COUNTER_CACHE` says otherwise.
+
+    Counters expire at midnight UTC and are incremented with the cache's atomic `incr`, so checking and reserving a
+    slot costs no SQL query once the counter is warm.
+    """
+
+    key_prefix = "vote_counter"
+
+    def __init__(self, cache_alias: Optional[str] = None):
+        self.cache = caches[cache_alias or settings.VOTE_COUNTER_CACHE]
+
+    def get_key(self, user_id: int, date: Optional[Date] = None) -> str:
+        date = date or timezone.now().date()
+        return f"{self.key_prefix}:{date.isoformat()}:{user_id}"
+
+    def count(self, user_id: int, date: Optional[Date] = None) -> int:
+        count = self.cache.get(self.get_key(user_id, date))
+        if count is None:
+            count = self.rebuild(user_id, date)
+        return count
+
+    def reserve(self, user_id: int) -> bool:
+        key = self.get_key(user_id)
+        try:
+            count = self.cache.incr(key)
+        except ValueError:
+            # The counter is missing, seed it from the database unless a concurrent request already did
+            self.cache.add(
+                key, get_user_daily_vote_count(user_id), seconds_until_midnight()
+            )
+            count = self.cache.incr(key)
+
+        if count > settings.MAX_VOTES_PER_DAY:
+            self.cache.decr(key)
+            return False
+        return True
+
+    def is_exhausted(self, user_id: int) -> bool:
+        # The counter expires at midnight UTC along with the limit
+        count = self.cache.get(self.get_key(user_id))
+        return count is not None and count >= settings.MAX_VOTES_PER_DAY
+
+    def release(self, user_id: int) -> None:
+        try:
+            self.cache.decr(self.get_key(user_id))
+        except ValueError:
+            pass
+
+    def rebuild(self, user_id: int, date: Optional[Date] = None) -> int:
+        date = date or timezone.now().date()
+        count = get_user_daily_vote_count(user_id, date)
+        self.cache.set(self.get_key(user_id, date), count, seconds_until_midnight())
+        return count
+
+
+@lru_cache(maxsize=None)
+def get_vote_counter() -> VoteCounter:
+    """
+    Get the vote counter configured by `settings.VOTE_COUNTER_BACKEND`.
+    """
+    return import_string(settings.VOTE_COUNTER_BACKEND)()
@@ -0,0 +1,115 @@
+import csv
+import json
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Sequence
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Vote
+from .utils import get_restaurants_ordered_by_rating
+
+EXPORT_CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+# Spreadsheets evaluate cells starting with these characters as formulas
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+VOTE_COLUMNS = ["date", "restaurant", "user", "total_votes", "total_weight"]
+RATING_COLUMNS = [
+    "rank",
+    "restaurant",
+    "name",
+    "total_rating",
+    "total_votes",
+    "voter_days",
+]
+
+
+def get_vote_rows(date_to=None, date_from=None, chunk_size=2000) -> Iterator[tuple]:
+    """
+    Get the raw votes within a date range as tuples of `VOTE_COLUMNS`, ordered by date.
+
+    The votes are read through a server-side cursor `chunk_size` rows at a time, so memory does not grow with the
+    date range.
+    """
+    queryset = Vote.objects.all()
+    if date_from:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date__lte=date_to)
+    return (
+        queryset.order_by("date", "id")
+        .values_list("date", "restaurant_id", "user_id", "total_votes", "total_weight")
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def get_rating_rows(date_to=None, date_from=None, chunk_size=2000) -> Iterator[tuple]:
+    """
+    Get the leaderboard of a date range as tuples of `RATING_COLUMNS`, ranked like `order_by_ratings`.
+
+    The ratings are aggregated from the daily rating rollup in one grouped query read through a server-side cursor.
+    """
+    rows = (
+        get_restaurants_ordered_by_rating(date_to=date_to, date_from=date_from)
+        .values_list("uuid", "name", "total_rating", "total_votes", "voter_days")
+        .iterator(chunk_size=chunk_size)
+    )
+    return ((rank, *row) for rank, row in enumerate(rows, start=1))
+
+
+class Echo:
+    """
+    A file-like object returning what is written to it, so csv.writer formats a row without buffering it.
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def escape_csv_value(value: Any) -> Any:
+    """
+    Prefix text that a spreadsheet would evaluate as a formula, like a restaurant named `=HYPERLINK(...)`, with a quote.
+    """
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def encode_csv(columns: List[str], rows: Iterable[Sequence[Any]]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([escape_csv_value(value) for value in row])
+
+
+def encode_ndjson(columns: List[str], rows: Iterable[Sequence[Any]]) -> Iterator[str]:
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, row))) + "\n"
+
+
+def stream_export(
+    columns: List[str], rows: Iterable[Sequence[Any]], output: str, chunk_size: int
+) -> Iterator[bytes]:
+    """
+    Encode rows as CSV, with a header line, or as NDJSON, one JSON object per line.
+
+    Lines are joined into chunks of `chunk_size` rows, so the response is not written, or gzipped, one row at a time.
+
+    Args:
+        columns: The names of the columns of the rows.
+        rows: The rows to export.
+        output: Either "csv" or "ndjson".
+        chunk_size: The number of rows per chunk.
+
+    Returns:
+        The encoded chunks.
+    """
+    encode = encode_csv if output == "csv" else encode_ndjson
+    lines = encode(columns, rows)
+    while True:
+        chunk = "".join(islice(lines, chunk_size))
+        if not chunk:
+            break
+        yield chunk.encode()
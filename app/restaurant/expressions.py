@@ -0,0 +1,35 @@
+from django.db.models import FloatField, Func
+
+
+class DaysBetween(Func):
+    """
+    The number of days between two date expressions, the second one subtracted from the first one, e.g. the age in
+    days of a date relative to a reference date with `DaysBetween(Value(reference), F("date"))`.
+    """
+
+    arity = 2
+    output_field = FloatField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # Subtracting dates gives the number of days between them on PostgreSQL
+        return super().as_sql(
+            compiler,
+            connection,
+            template="(%(expressions)s)",
+            arg_joiner=" - ",
+            **extra_context,
+        )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler,
+            connection,
+            template="(julianday(%(expressions)s))",
+            arg_joiner=") - julianday(",
+            **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, function="DATEDIFF", **extra_context
+        )
@@ -0,0 +1,679 @@
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from collections.abc import Sequence
+from datetime import date as Date
+from decimal import Decimal
+from functools import lru_cache
+from heapq import nlargest
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Restaurant, RestaurantDailyRating
+
+# A restaurant's score packs its rating in cents and its voter days into one number, so that sorting by score
+# orders by rating first and voter days second. Scores stay exact as floats (the type of Redis scores) below 2^53,
+# i.e. as long as the rating of a range stays below 900 million cents, a rating of about 9 million, and its voter days
+# below 10 million.
+VOTER_SCALE = 10**7
+
+# (restaurant_id, date, total_weight, total_votes, voter_count), the rows of the daily rating rollup
+DailyRatingRow = Tuple[Any, Date, Decimal, int, int]
+# (restaurant_id, total_rating, voter_days, total_votes)
+RankedRestaurant = Tuple[str, Decimal, int, int]
+
+
+def get_score(weight: Decimal, voters: int) -> int:
+    return int(weight * 100) * VOTER_SCALE + voters
+
+
+def split_score(score: float) -> Tuple[Decimal, int]:
+    cents, voters = divmod(int(score), VOTER_SCALE)
+    return Decimal(cents) / 100, voters
+
+
+def in_range(day: Date, date_from: Optional[Date], date_to: Optional[Date]) -> bool:
+    return (not date_from or day >= date_from) and (not date_to or day <= date_to)
+
+
+class LeaderboardIndex(ABC):
+    """
+    Base class of the leaderboard indexes, an incrementally maintained copy of the daily rating rollup.
+
+    Every day has a sorted structure of restaurant scores, see `get_score`. Ranking a date range merges the days of the
+    range and orders restaurants by score, then by descending id, the ordering of `get_restaurants_ordered_by_rating`.
+
+    The index receives the totals of the rollup rows written by every committed vote rather than increments, and keeps
+    the largest totals it received for every restaurant and day, which only grow with votes. Receiving a row twice, or
+    an older row after a newer one, leaves the index unchanged. Indexes start unloaded and are loaded from the rollup
+    on first use. A load accepts rows from its start, before it reads the rollup, so the votes committed around the
+    read are in the index once, whether they reach it through the read, their rows or both.
+    """
+
+    @abstractmethod
+    def is_loaded(self) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def start_load(self) -> Optional[str]:
+        """
+        Start accepting rows, before the rollup is read.
+
+        Returns:
+            The token of the load to pass to `load`, or None if the index was reset meanwhile.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load(self, token: str, rows: Iterable[DailyRatingRow]) -> None:
+        """
+        Merge the rows of the rollup into the index and mark it as loaded, unless it was reset since `start_load`.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def reset(self) -> None:
+        """
+        Drop the content of the index, it is loaded again on next use.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def add(self, rows: Iterable[DailyRatingRow]) -> None:
+        """
+        Merge rows of the daily rating rollup into an index that is loaded or loading.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove(self, restaurant_id: Any) -> None:
+        """
+        Remove a restaurant from every day.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self, date_from: Optional[Date], date_to: Optional[Date]) -> int:
+        """
+        Count the restaurants voted within the date range.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def rank(
+        self,
+        date_from: Optional[Date],
+        date_to: Optional[Date],
+        offset: int,
+        limit: int,
+    ) -> List[RankedRestaurant]:
+        """
+        Get a slice of the restaurants voted within the date range, ordered by rating, voter days and descending id.
+        """
+        raise NotImplementedError
+
+
+class InMemoryLeaderboardIndex(LeaderboardIndex):
+    """
+    Leaderboard index kept in the memory of the process.
+
+    Every process only sees its own votes, use it for tests and single process deployments.
+    """
+
+    def __init__(self, url: Optional[str] = None):
+        self.lock = threading.Lock()
+        self.days: Dict[Date, Dict[str, List]] = {}
+        self.token: Optional[str] = None
+        self.loaded = False
+
+    def is_loaded(self) -> bool:
+        return self.loaded
+
+    def start_load(self) -> Optional[str]:
+        with self.lock:
+            if self.token is None:
+                self.token = uuid.uuid4().hex
+            return self.token
+
+    def load(self, token: str, rows: Iterable[DailyRatingRow]) -> None:
+        rows = list(rows)
+        with self.lock:
+            if self.token != token:
+                return
+            self._merge(rows)
+            self.loaded = True
+
+    def reset(self) -> None:
+        with self.lock:
+            self.days = {}
+            self.token = None
+            self.loaded = False
+
+    def add(self, rows: Iterable[DailyRatingRow]) -> None:
+        with self.lock:
+            if self.token is not None:
+                self._merge(rows)
+
+    def _merge(self, rows: Iterable[DailyRatingRow]) -> None:
+        for restaurant_id, date, weight, votes, voters in rows:
+            # [score, votes] of the restaurant on that day
+            totals = self.days.setdefault(date, {}).setdefault(
+                str(restaurant_id), [0, 0]
+            )
+            totals[0] = max(totals[0], get_score(weight, voters))
+            totals[1] = max(totals[1], votes)
+
+    def remove(self, restaurant_id: Any) -> None:
+        with self.lock:
+            for scores in self.days.values():
+                scores.pop(str(restaurant_id), None)
+
+    def merge(
+        self, date_from: Optional[Date], date_to: Optional[Date]
+    ) -> Dict[str, List]:
+        totals: Dict[str, List] = defaultdict(lambda: [0, 0])
+        with self.lock:
+            for day, scores in self.days.items():
+                if in_range(day, date_from, date_to):
+                    for restaurant_id, (score, votes) in scores.items():
+                        totals[restaurant_id][0] += score
+                        totals[restaurant_id][1] += votes
+        return totals
+
+    def count(self, date_from: Optional[Date], date_to: Optional[Date]) -> int:
+        return len(self.merge(date_from, date_to))
+
+    def rank(
+        self,
+        date_from: Optional[Date],
+        date_to: Optional[Date],
+        offset: int,
+        limit: int,
+    ) -> List[RankedRestaurant]:
+        totals = self.merge(date_from, date_to)
+        top = nlargest(
+            offset + limit,
+            totals.items(),
+            key=lambda item: (item[1][0], item[0]),
+        )
+        return [
+            (restaurant_id, *split_score(score), votes)
+            for restaurant_id, (score, votes) in top[offset:]
+        ]
+
+
+class RedisLeaderboardIndex(LeaderboardIndex):
+    """
+    Leaderboard index kept in Redis sorted sets, shared by every process.
+
+    Every day has a sorted set of scores and one of vote counts, written with `ZADD GT` so they keep the largest
+    totals. It needs Redis 6.2 and the `redis` package, or the `local://` URL which uses the in-process `LocalRedis`
+    stand-in.
+
+    Ranges are merged with ZUNIONSTORE. The days before today no longer change with votes, so their union is kept for
+    `union_timeout` seconds under the version of the index, which loads, resets, removals and rows of past days bump.
+    Today's set is merged into it per request, so ranking any range costs the union of two sets rather than one of
+    every day of the range.
+    """
+
+    prefix = "leaderboard_index"
+    union_timeout = 3600
+
+    def __init__(self, url: Optional[str] = None):
+        url = url or settings.LEADERBOARD_INDEX_URL
+        if url.startswith("local://"):
+            self.client = LocalRedis()
+            self.watch_error = LocalWatchError
+            return
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured(
+                "RedisLeaderboardIndex requires the redis package, install it with `pip install redis`."
+            )
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.watch_error = redis.WatchError
+
+    def key(self, *parts: Any) -> str:
+        return ":".join([self.prefix, *(str(part) for part in parts)])
+
+    def is_loaded(self) -> bool:
+        return bool(self.client.exists(self.key("loaded")))
+
+    def start_load(self) -> Optional[str]:
+        self.client.set(self.key("token"), uuid.uuid4().hex, nx=True)
+        return self.client.get(self.key("token"))
+
+    def load(self, token: str, rows: Iterable[DailyRatingRow]) -> None:
+        rows = list(rows)
+        with self.client.pipeline() as pipeline:
+            try:
+                # Rows are only merged if the index was not reset since the load started
+                pipeline.watch(self.key("token"))
+                if pipeline.get(self.key("token")) != token:
+                    return
+                pipeline.multi()
+                self._merge(pipeline, rows)
+                pipeline.set(self.key("loaded"), 1)
+                pipeline.incr(self.key("version"))
+                pipeline.execute()
+            except self.watch_error:
+                pass
+
+    def reset(self) -> None:
+        days = self.client.smembers(self.key("days"))
+        keys = [self.key(kind, day) for day in days for kind in ("scores", "votes")]
+        pipeline = self.client.pipeline()
+        pipeline.delete(self.key("token"), self.key("loaded"), self.key("days"), *keys)
+        # The version is kept, unions of the reset index must not be found again
+        pipeline.incr(self.key("version"))
+        pipeline.execute()
+
+    def add(self, rows: Iterable[DailyRatingRow]) -> None:
+        if not self.client.exists(self.key("token")):
+            return
+        rows = list(rows)
+        pipeline = self.client.pipeline()
+        self._merge(pipeline, rows)
+        today = timezone.now().date()
+        if any(date != today for _, date, *_ in rows):
+            pipeline.incr(self.key("version"))
+        pipeline.execute()
+
+    def _merge(self, pipeline, rows: Iterable[DailyRatingRow]) -> None:
+        for restaurant_id, date, weight, votes, voters in rows:
+            day = date.isoformat()
+            pipeline.sadd(self.key("days"), day)
+            pipeline.zadd(
+                self.key("scores", day),
+                {str(restaurant_id): get_score(weight, voters)},
+                gt=True,
+            )
+            pipeline.zadd(self.key("votes", day), {str(restaurant_id): votes}, gt=True)
+
+    def remove(self, restaurant_id: Any) -> None:
+        pipeline = self.client.pipeline()
+        for day in self.client.smembers(self.key("days")):
+            pipeline.zrem(self.key("scores", day), str(restaurant_id))
+            pipeline.zrem(self.key("votes", day), str(restaurant_id))
+        pipeline.incr(self.key("version"))
+        pipeline.execute()
+
+    def get_days(self, date_from: Optional[Date], date_to: Optional[Date]) -> List[str]:
+        return [
+            day
+            for day in self.client.smembers(self.key("days"))
+            if in_range(Date.fromisoformat(day), date_from, date_to)
+        ]
+
+    def get_union(
+        self, kind: str, date_from: Optional[Date], date_to: Optional[Date]
+    ) -> Tuple[Optional[str], bool]:
+        """
+        Get a sorted set holding the sum of the `kind` sets, scores or votes, over the days of the range.
+
+        Returns:
+            The key of the set, None if the range has no votes, and whether it is a temporary set to delete after use.
+        """
+        today = timezone.now().date().isoformat()
+        days = self.get_days(date_from, date_to)
+        keys = []
+        past_days = [self.key(kind, day) for day in days if day != today]
+        if past_days:
+            version = self.client.get(self.key("version")) or 0
+            union = self.key(
+                "union", kind, date_from or "", date_to or "", today, version
+            )
+            if not self.client.exists(union):
+                pipeline = self.client.pipeline()
+                pipeline.zunionstore(union, past_days)
+                pipeline.expire(union, self.union_timeout)
+                pipeline.execute()
+            keys.append(union)
+        if today in days:
+            keys.append(self.key(kind, today))
+        if len(keys) < 2:
+            return (keys[0] if keys else None), False
+
+        destination = self.key("range", uuid.uuid4().hex)
+        self.client.zunionstore(destination, keys)
+        return destination, True
+
+    def count(self, date_from: Optional[Date], date_to: Optional[Date]) -> int:
+        scores, temporary = self.get_union("scores", date_from, date_to)
+        if scores is None:
+            return 0
+        pipeline = self.client.pipeline()
+        pipeline.zcard(scores)
+        if temporary:
+            pipeline.delete(scores)
+        return pipeline.execute()[0]
+
+    def rank(
+        self,
+        date_from: Optional[Date],
+        date_to: Optional[Date],
+        offset: int,
+        limit: int,
+    ) -> List[RankedRestaurant]:
+        if limit <= 0:
+            return []
+        scores, scores_temporary = self.get_union("scores", date_from, date_to)
+        if scores is None:
+            return []
+        votes, votes_temporary = self.get_union("votes", date_from, date_to)
+        page = self.client.zrevrange(
+            scores, offset, offset + limit - 1, withscores=True
+        )
+
+        pipeline = self.client.pipeline()
+        for restaurant_id, _ in page:
+            pipeline.zscore(votes, restaurant_id)
+        temporary = [
+            key
+            for key, is_temporary in [
+                (scores, scores_temporary),
+                (votes, votes_temporary),
+            ]
+            if is_temporary
+        ]
+        if temporary:
+            pipeline.delete(*temporary)
+        page_votes = pipeline.execute()[: len(page)]
+        return [
+            (restaurant_id, *split_score(score), int(restaurant_votes or 0))
+            for (restaurant_id, score), restaurant_votes in zip(page, page_votes)
+        ]
+
+
+class LocalWatchError(Exception):
+    """
+    Raised by `LocalPipeline.execute` when a watched key changed, like redis-py's `WatchError`.
+    """
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the subset of the redis-py client used by `RedisLeaderboardIndex`, for tests and local
+    development without a Redis server. Like Redis, it orders equal scores by member. Expiries are ignored.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data: Dict[str, Any] = {}
+
+    def pipeline(self) -> "LocalPipeline":
+        return LocalPipeline(self)
+
+    def exists(self, *names: str) -> int:
+        return sum(name in self.data for name in names)
+
+    def get(self, name: str) -> Optional[str]:
+        return self.data.get(name)
+
+    def set(self, name: str, value: Any, nx: bool = False) -> Optional[bool]:
+        with self.lock:
+            if nx and name in self.data:
+                return None
+            self.data[name] = str(value)
+            return True
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        with self.lock:
+            value = int(self.data.get(name, 0)) + amount
+            self.data[name] = str(value)
+            return value
+
+    def expire(self, name: str, time: int) -> bool:
+        return name in self.data
+
+    def delete(self, *names: str) -> int:
+        with self.lock:
+            return sum(self.data.pop(name, None) is not None for name in names)
+
+    def sadd(self, name: str, *values: str) -> int:
+        with self.lock:
+            members = self.data.setdefault(name, set())
+            added = set(values) - members
+            members.update(added)
+            return len(added)
+
+    def smembers(self, name: str) -> set:
+        with self.lock:
+            return set(self.data.get(name, ()))
+
+    def zadd(self, name: str, mapping: Dict[str, float], gt: bool = False) -> int:
+        with self.lock:
+            scores = self.data.setdefault(name, {})
+            added = 0
+            for value, score in mapping.items():
+                added += value not in scores
+                if not gt or value not in scores or float(score) > scores[value]:
+                    scores[value] = float(score)
+            return added
+
+    def zcard(self, name: str) -> int:
+        return len(self.data.get(name, {}))
+
+    def zrem(self, name: str, *values: str) -> int:
+        with self.lock:
+            scores = self.data.get(name, {})
+            return sum(scores.pop(value, None) is not None for value in values)
+
+    def zscore(self, name: str, value: str) -> Optional[float]:
+        return self.data.get(name, {}).get(value)
+
+    def zunionstore(self, dest: str, keys: List[str]) -> int:
+        with self.lock:
+            union: Dict[str, float] = defaultdict(float)
+            for key in keys:
+                for member, score in self.data.get(key, {}).items():
+                    union[member] += score
+            if union:
+                self.data[dest] = dict(union)
+            else:
+                # Like Redis, an empty union leaves no key behind
+                self.data.pop(dest, None)
+            return len(union)
+
+    def zrevrange(
+        self, name: str, start: int, end: int, withscores: bool = False
+    ) -> List:
+        with self.lock:
+            ordered = sorted(
+                self.data.get(name, {}).items(),
+                key=lambda item: (item[1], item[0]),
+                reverse=True,
+            )[start : end + 1]
+        if withscores:
+            return ordered
+        return [member for member, _ in ordered]
+
+
+class LocalPipeline:
+    """
+    Queue commands of a `LocalRedis` and run them atomically on `execute`.
+
+    Like redis-py pipelines, commands run immediately after `watch` until `multi`, and `execute` fails with
+    `LocalWatchError` if a watched key changed in between.
+    """
+
+    def __init__(self, client: LocalRedis):
+        self.client = client
+        self.commands: List[Tuple[str, tuple, dict]] = []
+        self.watched: Dict[str, Any] = {}
+        self.immediate = False
+
+    def __enter__(self) -> "LocalPipeline":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.commands = []
+        self.watched = {}
+        self.immediate = False
+
+    def watch(self, *names: str) -> None:
+        with self.client.lock:
+            self.watched.update({name: self.client.data.get(name) for name in names})
+        self.immediate = True
+
+    def multi(self) -> None:
+        self.immediate = False
+
+    def __getattr__(self, name: str):
+        if self.immediate:
+            return getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self) -> List:
+        with self.client.lock:
+            changed = any(
+                self.client.data.get(name) != value
+                for name, value in self.watched.items()
+            )
+            commands, self.commands, self.watched = self.commands, [], {}
+            if changed:
+                raise LocalWatchError()
+            return [
+                getattr(self.client, name)(*args, **kwargs)
+                for name, args, kwargs in commands
+            ]
+
+
+@lru_cache(maxsize=None)
+def _get_leaderboard_index(backend: str, url: str) -> LeaderboardIndex:
+    return import_string(backend)(url)
+
+
+def get_leaderboard_index() -> Optional[LeaderboardIndex]:
+    """
+    Get the leaderboard index configured by `settings.LEADERBOARD_INDEX_BACKEND`, or None if it is disabled.
+    """
+    if not settings.LEADERBOARD_INDEX_BACKEND:
+        return None
+    return _get_leaderboard_index(
+        settings.LEADERBOARD_INDEX_BACKEND, settings.LEADERBOARD_INDEX_URL
+    )
+
+
+def load_leaderboard_index(index: LeaderboardIndex) -> None:
+    """
+    Load the index from the daily rating rollup.
+
+    The index accepts the rows of committed votes before the rollup is read, so no vote committed meanwhile is missed.
+    The rollup is read from the primary, votes missing from a lagging replica would never be added to the index.
+    """
+    token = index.start_load()
+    if token is None:
+        return
+    rows = RestaurantDailyRating.objects.using(DEFAULT_DB_ALIAS).values_list(
+        "restaurant_id", "date", "total_weight", "total_votes", "voter_count"
+    )
+    index.load(token, rows.iterator())
+
+
+def index_daily_ratings(rows: List[DailyRatingRow]) -> None:
+    """
+    Merge the rollup rows written by a committed transaction into the leaderboard index, if it is enabled and loaded
+    or loading.
+    """
+    index = get_leaderboard_index()
+    if index:
+        index.add(rows)
+
+
+class RankedLeaderboard(Sequence):
+    """
+    Base class of the leaderboards ranked outside of the database, drop-in replacements of the queryset of
+    `get_restaurants_ordered_by_rating` for page number pagination.
+
+    Slicing ranks the restaurants of the slice with `get_ranked` and fetches their details with a single query,
+    annotated with the same total_rating, total_votes and voter_days.
+    """
+
+    @abstractmethod
+    def get_total(self) -> int:
+        """
+        Count the ranked restaurants.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_ranked(self, offset: int, limit: int) -> List[RankedRestaurant]:
+        """
+        Get a slice of the ranked restaurants.
+        """
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        return self.get_total()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, item):
+        if isinstance(item, int):
+            if item < 0:
+                item += len(self)
+            restaurants = self[item : item + 1] if item >= 0 else []
+            if not restaurants:
+                raise IndexError(item)
+            return restaurants[0]
+
+        start, stop, step = item.start or 0, item.stop, item.step
+        if start < 0 or stop is None or stop < 0:
+            # Only counted when needed, pages are sliced with absolute bounds
+            start, stop, step = item.indices(len(self))
+        if step not in (None, 1):
+            raise ValueError(f"{type(self).__name__} does not support slice steps.")
+        ranked = self.get_ranked(start, max(stop - start, 0))
+        restaurants = Restaurant.objects.select_related(
+            "created_by", "updated_by"
+        ).in_bulk([restaurant_id for restaurant_id, *_ in ranked])
+
+        page = []
+        for restaurant_id, total_rating, voter_days, total_votes in ranked:
+            restaurant = restaurants.get(uuid.UUID(restaurant_id))
+            if restaurant is None:
+                # Deleted after it was ranked
+                continue
+            restaurant.total_rating = total_rating
+            restaurant.total_votes = total_votes
+            restaurant.voter_days = voter_days
+            page.append(restaurant)
+        return page
+
+
+class IndexedLeaderboard(RankedLeaderboard):
+    """
+    The leaderboard of a date range served from the leaderboard index.
+    """
+
+    def __init__(
+        self,
+        index: LeaderboardIndex,
+        date_to: Optional[Date] = None,
+        date_from: Optional[Date] = None,
+    ):
+        if not index.is_loaded():
+            load_leaderboard_index(index)
+        self.index = index
+        self.date_to = date_to
+        self.date_from = date_from
+
+    def get_total(self) -> int:
+        return self.index.count(self.date_from, self.date_to)
+
+    def get_ranked(self, offset: int, limit: int) -> List[RankedRestaurant]:
+        return self.index.rank(self.date_from, self.date_to, offset, limit)
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import math
+import random
+import statistics
+import time
+from collections import Counter
+from datetime import timedelta
+from threading import Thread
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from restaurant.models import Restaurant, Vote
+from restaurant.pagination import RestaurantPagination
+
+ENDPOINTS = ["vote", "order_by_ratings", "list", "retrieve"]
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of the given values.
+    """
+    ordered = sorted(values)
+    index = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the voting API through the Django test client and report latency percentiles, "
+        "queries per request and throughput as JSON. Run it against a seeded database, see seed_votes. "
+        "With --interface asgi the requests go through the ASGI handler instead of the WSGI one, "
+        "with the same number of concurrent requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--endpoints",
+            nargs="+",
+            choices=ENDPOINTS,
+            default=ENDPOINTS,
+        )
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Requests per endpoint."
+        )
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument(
+            "--interface",
+            choices=["wsgi", "asgi"],
+            default="wsgi",
+            help="Send the requests from threads through the WSGI handler or "
+            "from asyncio tasks through the ASGI handler.",
+        )
+        parser.add_argument(
+            "--users", type=int, default=100, help="Number of users sending requests."
+        )
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--output", help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        user_ids = list(
+            Vote.objects.values_list("user_id", flat=True)
+            .distinct()
+            .order_by("user_id")[: options["users"]]
+        )
+        restaurant_ids = list(Restaurant.objects.values_list("uuid", flat=True))
+        if not user_ids or not restaurant_ids:
+            raise CommandError("The database is empty, run seed_votes first.")
+
+        self.tokens = [
+            Token.objects.get_or_create(user_id=user_id)[0].key for user_id in user_ids
+        ]
+        self.restaurant_ids = restaurant_ids
+        self.pages = min(
+            math.ceil(len(restaurant_ids) / RestaurantPagination.page_size), 3
+        )
+        self.rng = rng
+
+        report = {
+            "config": {
+                "requests": options["requests"],
+                "concurrency": options["concurrency"],
+                "interface": options["interface"],
+                "async_views": settings.ASYNC_VIEWS,
+                "users": len(user_ids),
+                "restaurants": len(restaurant_ids),
+                "max_votes_per_day": settings.MAX_VOTES_PER_DAY,
+            },
+            "endpoints": {},
+        }
+        # Rejected votes are expected once users reach their daily limit, keep them out of the output
+        request_logger = logging.getLogger("django.request")
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        run = self.run_asgi if options["interface"] == "asgi" else self.run
+        try:
+            for endpoint in options["endpoints"]:
+                requests = [
+                    self.build_request(endpoint) for _ in range(options["requests"])
+                ]
+                report["endpoints"][endpoint] = run(requests, options["concurrency"])
+        finally:
+            request_logger.setLevel(level)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def build_request(self, endpoint):
+        """
+        Build a random (token, method, url, data) request for the endpoint.
+        """
+        token = self.rng.choice(self.tokens)
+        if endpoint == "vote":
+            return (
+                token,
+                "post",
+                reverse("restaurant:vote-create"),
+                {"restaurant": str(self.rng.choice(self.restaurant_ids))},
+            )
+        if endpoint == "order_by_ratings":
+            today = timezone.now().date()
+            params = self.rng.choice(
+                [
+                    {},
+                    {"date_from": today},
+                    {"date_from": today - timedelta(days=7)},
+                    {"date_to": today - timedelta(days=1)},
+                ]
+            )
+            return token, "get", reverse("restaurant:order-restaurant-list"), params
+        if endpoint == "list":
+            return (
+                token,
+                "get",
+                reverse("restaurant:restaurant-list-create"),
+                {"page": self.rng.randint(1, self.pages)},
+            )
+        return (
+            token,
+            "get",
+            reverse(
+                "restaurant:restaurant-retrieve-update-destroy",
+                kwargs={"pk": self.rng.choice(self.restaurant_ids)},
+            ),
+            {},
+        )
+
+    def run(self, requests, concurrency):
+        """
+        Send the requests from `concurrency` threads and summarise the samples.
+        """
+        samples = []
+
+        def worker(chunk):
+            client = APIClient()
+            try:
+                for token, method, url, data in chunk:
+                    client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        response = getattr(client, method)(url, data)
+                        elapsed = time.perf_counter() - start
+                    samples.append((elapsed, len(queries), response.status_code))
+            finally:
+                if concurrency > 1:
+                    connection.close()
+
+        chunks = [requests[index::concurrency] for index in range(concurrency)]
+        start = time.perf_counter()
+        if concurrency > 1:
+            threads = [Thread(target=worker, args=(chunk,)) for chunk in chunks]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            worker(requests)
+        duration = time.perf_counter() - start
+        return self.summarise(samples, duration)
+
+    def run_asgi(self, requests, concurrency):
+        """
+        Send the requests from `concurrency` asyncio tasks and summarise the samples.
+
+        The queries of the async views run in worker threads, so they are not counted.
+        """
+        samples = []
+
+        async def worker(chunk):
+            client = AsyncClient()
+            for token, method, url, data in chunk:
+                kwargs = {"authorization": f"Token {token}"}
+                if method == "post":
+                    # The async client of Django 3.2 cannot read multipart bodies back
+                    data = json.dumps(data)
+                    kwargs["content_type"] = "application/json"
+                start = time.perf_counter()
+                response = await getattr(client, method)(url, data, **kwargs)
+                elapsed = time.perf_counter() - start
+                samples.append((elapsed, None, response.status_code))
+
+        async def main():
+            await asyncio.gather(
+                *(worker(requests[index::concurrency]) for index in range(concurrency))
+            )
+
+        start = time.perf_counter()
+        # Like a server, run sync code such as the sync views in the main thread
+        async_to_sync(main)()
+        duration = time.perf_counter() - start
+        return self.summarise(samples, duration)
+
+    def summarise(self, samples, duration):
+        """
+        Summarise the (elapsed, queries, status code) samples sent in `duration` seconds.
+        """
+        latencies = [elapsed * 1000 for elapsed, _, _ in samples]
+        query_counts = [count for _, count, _ in samples if count is not None]
+        summary = {
+            "requests": len(samples),
+            "status_codes": dict(Counter(str(code) for _, _, code in samples)),
+            "throughput_rps": round(len(samples) / duration, 2),
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 2),
+                "p95": round(percentile(latencies, 95), 2),
+                "p99": round(percentile(latencies, 99), 2),
+                "mean": round(statistics.mean(latencies), 2),
+                "max": round(max(latencies), 2),
+            },
+        }
+        if query_counts:
+            summary["queries_per_request"] = {
+                "mean": round(statistics.mean(query_counts), 2),
+                "max": max(query_counts),
+            }
+        return summary
@@ -0,0 +1,75 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the time the database connection handling adds to a request, simulated as the start and end of "
+        "request bookkeeping of Django around a `SELECT pg_backend_pid()`, with a new connection per request, "
+        "persistent connections with and without health checks, and the connection pool. "
+        "Only available on PostgreSQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Connection benchmarks need PostgreSQL.")
+        from convious.postgresql.base import DatabaseWrapper
+
+        modes = {
+            "new connection per request": {"CONN_MAX_AGE": 0, "POOL": None},
+            "persistent": {
+                "CONN_MAX_AGE": 60,
+                "CONN_HEALTH_CHECKS": False,
+                "POOL": None,
+            },
+            "persistent + health checks": {
+                "CONN_MAX_AGE": 60,
+                "CONN_HEALTH_CHECKS": True,
+                "POOL": None,
+            },
+            "pool": {
+                "CONN_MAX_AGE": 0,
+                "CONN_HEALTH_CHECKS": False,
+                "POOL": {"MIN_SIZE": 1, "MAX_SIZE": 1},
+            },
+            "pool + health checks": {
+                "CONN_MAX_AGE": 0,
+                "CONN_HEALTH_CHECKS": True,
+                "POOL": {"MIN_SIZE": 1, "MAX_SIZE": 1},
+            },
+        }
+        for name, overrides in modes.items():
+            wrapper = DatabaseWrapper(
+                {**connection.settings_dict, **overrides}, alias=f"bench-{name}"
+            )
+            try:
+                self.run_mode(name, wrapper, options["requests"])
+            finally:
+                wrapper.close()
+                if wrapper.pool is not None:
+                    wrapper.pool.close()
+
+    def run_mode(self, name, wrapper, requests):
+        timings = []
+        backends = set()
+        for _ in range(requests):
+            start = time.perf_counter()
+            # What django.db.close_old_connections does when a request starts and finishes
+            wrapper.close_if_unusable_or_obsolete()
+            with wrapper.cursor() as cursor:
+                cursor.execute("SELECT pg_backend_pid()")
+                backends.add(cursor.fetchone()[0])
+            wrapper.close_if_unusable_or_obsolete()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f"{name}: median {statistics.median(timings):.3f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:.3f} ms per request, "
+            f"{len(backends)} connections opened for {requests} requests"
+        )
@@ -0,0 +1,96 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from restaurant.models import Restaurant
+from restaurant.serializers import RestaurantSerializer, restaurant_projection
+
+DESCRIPTION = "Generated by bench_serialization"
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the time and queries of serializing pages of restaurants with RestaurantSerializer, without and with "
+        "select_related, and with the values() projection used by the list and retrieve views. The restaurants are "
+        "generated inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--restaurants", type=int, default=100)
+        parser.add_argument("--page-sizes", type=int, nargs="+", default=[30, 100])
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(
+                    User(
+                        username=f"bench-serialization-{i}",
+                        email=f"user{i}@example.com",
+                        first_name="First",
+                        last_name="Last",
+                    )
+                    for i in range(options["restaurants"])
+                )
+                # Not every database returns the primary keys of bulk created rows
+                users = User.objects.filter(username__startswith="bench-serialization-")
+                Restaurant.objects.bulk_create(
+                    Restaurant(
+                        name=f"Restaurant {i}",
+                        description=DESCRIPTION,
+                        created_by=user,
+                        updated_by=user,
+                    )
+                    for i, user in enumerate(users)
+                )
+                for page_size in options["page_sizes"]:
+                    self.run_page_size(page_size, options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run_page_size(self, page_size, repeat):
+        queryset = Restaurant.objects.filter(description=DESCRIPTION).order_by(
+            "created_at", "uuid"
+        )
+        paths = {
+            "serializer": lambda: RestaurantSerializer(
+                queryset[:page_size], many=True
+            ).data,
+            "serializer + select_related": lambda: RestaurantSerializer(
+                queryset.select_related("created_by", "updated_by")[:page_size],
+                many=True,
+            ).data,
+            "projection": lambda: restaurant_projection.serialize(
+                restaurant_projection.values(queryset)[:page_size]
+            ),
+        }
+        rendered = {name: JSONRenderer().render(path()) for name, path in paths.items()}
+
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(f"{page_size} restaurants per page")
+        )
+        for name, path in paths.items():
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                path()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                JSONRenderer().render(path())
+                timings.append((time.perf_counter() - start) * 1000)
+            identical = rendered[name] == rendered["serializer"]
+            self.stdout.write(
+                f"  {name}: median {statistics.median(timings):.2f} ms, "
+                f"min {min(timings):.2f} ms, {len(queries)} queries, "
+                f"{'identical' if identical else 'DIFFERENT'} JSON"
+            )
@@ -0,0 +1,121 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from restaurant.models import RestaurantDailyRating, Vote
+from restaurant.seed import generate_dataset
+from restaurant.utils import get_restaurants_ordered_by_rating, rebuild_daily_ratings
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a dataset and print the EXPLAIN plans and timings of the hot vote queries, "
+        "without and with the covering indexes. The dataset is rolled back unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=500)
+        parser.add_argument("--restaurants", type=int, default=100)
+        parser.add_argument("--days", type=int, default=90)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                stats = generate_dataset(
+                    users=options["users"],
+                    restaurants=options["restaurants"],
+                    days=options["days"],
+                    seed=options["seed"],
+                )
+                rebuild_daily_ratings()
+                self.stdout.write(f"Generated dataset: {stats}")
+                if connection.vendor == "postgresql":
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"ANALYZE {Vote._meta.db_table}")
+                        cursor.execute(
+                            f"ANALYZE {RestaurantDailyRating._meta.db_table}"
+                        )
+
+                queries = self.get_queries()
+
+                savepoint = transaction.savepoint()
+                self.drop_indexes()
+                self.run_queries("Before (without covering indexes)", queries, options)
+                transaction.savepoint_rollback(savepoint)
+
+                self.run_queries("After (with covering indexes)", queries, options)
+
+                if not options["keep"]:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write("Dataset rolled back")
+
+    def get_queries(self):
+        vote = Vote.objects.order_by("?").first()
+        today = timezone.now().date()
+        date_from = today - timedelta(days=29)
+        return {
+            "daily limit check (user, date)": Vote.objects.filter(
+                user_id=vote.user_id, date=vote.date
+            )
+            .values("user_id")
+            .annotate(total_votes=Sum("total_votes")),
+            "restaurant rating (restaurant, date range)": Vote.objects.filter(
+                restaurant_id=vote.restaurant_id, date__gte=date_from
+            )
+            .values("restaurant_id")
+            .annotate(
+                total_rating=Sum("total_weight"),
+                total_votes=Sum("total_votes"),
+                unique_voters=Count("user", distinct=True),
+            ),
+            "leaderboard from votes (date range)": Vote.objects.filter(
+                date__gte=date_from
+            )
+            .values("restaurant_id")
+            .annotate(
+                total_rating=Sum("total_weight"),
+                unique_voters=Count("user", distinct=True),
+            )
+            .order_by("-total_rating", "-unique_voters")[:30],
+            "leaderboard from rollup (date range)": get_restaurants_ordered_by_rating(
+                date_from=date_from
+            )[:30],
+        }
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for model in (Vote, RestaurantDailyRating):
+                for index in model._meta.indexes:
+                    cursor.execute(
+                        f"DROP INDEX {connection.ops.quote_name(index.name)}"
+                    )
+
+    def run_queries(self, title, queries, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for name, queryset in queries.items():
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+
+            self.stdout.write(self.style.MIGRATE_LABEL(f"  {name}"))
+            self.stdout.write(
+                f"    median {statistics.median(timings):.2f} ms, "
+                f"min {min(timings):.2f} ms, max {max(timings):.2f} ms"
+            )
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f"    {line}")
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from restaurant.utils import rebuild_daily_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily rating rollup from the raw votes. "
+        "Without a date range the whole rollup is recomputed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date-from", type=date.fromisoformat)
+        parser.add_argument("--date-to", type=date.fromisoformat)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_daily_ratings(
+            date_to=options["date_to"],
+            date_from=options["date_from"],
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} daily rating rows"))
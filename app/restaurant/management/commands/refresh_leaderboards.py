@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurant.caching import is_shared_cache
+from restaurant.snapshots import SNAPSHOT_WINDOWS, refresh_leaderboard_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the ranked snapshots of the today, last 7 days, last 30 days and all time leaderboards, which "
+        "order_by_ratings serves while they are younger than LEADERBOARD_SNAPSHOT_MAX_AGE seconds. Run it more often "
+        "than that, e.g. every minute from cron, or set LEADERBOARD_SNAPSHOT_REFRESH_INTERVAL instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--windows", nargs="+", choices=list(SNAPSHOT_WINDOWS), default=None
+        )
+
+    def handle(self, *args, **options):
+        if not is_shared_cache(settings.LEADERBOARD_CACHE):
+            raise CommandError(
+                f"The snapshots are stored in the {settings.LEADERBOARD_CACHE!r} cache, which is kept in the memory of "
+                "each process, so the web workers would never see them. Point LEADERBOARD_CACHE to a shared cache, "
+                "e.g. memcached, or set LEADERBOARD_SNAPSHOT_REFRESH_INTERVAL to refresh them in the workers."
+            )
+        start = time.perf_counter()
+        snapshots = refresh_leaderboard_snapshots(options["windows"])
+        for snapshot in snapshots:
+            self.stdout.write(f"{snapshot.window}: {len(snapshot.rows)} restaurants")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Refreshed {len(snapshots)} leaderboard snapshots in "
+                f"{(time.perf_counter() - start) * 1000:.0f} ms"
+            )
+        )
@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from restaurant.utils import reweight_votes
+from restaurant.weights import get_weight_policy
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the total weight of the votes with the current weight policy, see VOTE_WEIGHTS, and rebuild the "
+        "daily rating rollup. Without a date range every vote is reweighted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date-from", type=date.fromisoformat)
+        parser.add_argument("--date-to", type=date.fromisoformat)
+
+    def handle(self, *args, **options):
+        count = reweight_votes(
+            date_to=options["date_to"], date_from=options["date_from"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reweighted {count} votes with weight policy version {get_weight_policy().version}"
+            )
+        )
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from restaurant.models import ArchivedVoteMonth
+from restaurant.partitions import (
+    add_months,
+    archive_vote_partition,
+    create_vote_partition,
+    get_default_partition_months,
+    get_vote_partitions,
+    is_vote_table_partitioned,
+    month_start,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly vote partitions ahead of time and, with --keep-months, archive the months older than "
+        "that: their votes are folded into the daily rating rollup and their partition is detached. "
+        "Only available on PostgreSQL, run it daily or at least monthly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=3,
+            help="Number of months to create partitions for after the current one.",
+        )
+        parser.add_argument(
+            "--keep-months",
+            type=int,
+            help="Archive the months ending before this many months ago, the current month included.",
+        )
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Drop the archived partitions instead of keeping them as standalone tables.",
+        )
+
+    def handle(self, *args, **options):
+        if not is_vote_table_partitioned():
+            raise CommandError(
+                "The vote table is not partitioned, partitioning needs PostgreSQL."
+            )
+
+        current = month_start(timezone.now().date())
+        for months in range(options["ahead"] + 1):
+            name = create_vote_partition(add_months(current, months))
+            if name:
+                self.stdout.write(f"Created partition {name}")
+
+        if options["keep_months"] is None:
+            return
+        if options["keep_months"] < 1:
+            raise CommandError("--keep-months must keep at least the current month.")
+
+        archived = set(ArchivedVoteMonth.objects.values_list("month", flat=True))
+        oldest_kept = add_months(current, 1 - options["keep_months"])
+        months = set(get_vote_partitions()) | set(get_default_partition_months())
+        for month in sorted(months):
+            if month < oldest_kept and month not in archived:
+                count = archive_vote_partition(month, drop=options["drop"])
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Archived {month:%Y-%m} into {count} daily rating rows"
+                    )
+                )
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from restaurant.seed import generate_dataset
+from restaurant.utils import rebuild_daily_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate users, restaurants and days of skewed votes to reproduce production volume locally. "
+        "The daily rating rollup is rebuilt afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--restaurants", type=int, default=200)
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument(
+            "--activity",
+            type=float,
+            default=0.6,
+            help="Probability that a user votes on a given day.",
+        )
+        parser.add_argument(
+            "--skew",
+            type=float,
+            default=1.0,
+            help="Exponent of the restaurant popularity distribution.",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            stats = generate_dataset(
+                users=options["users"],
+                restaurants=options["restaurants"],
+                days=options["days"],
+                activity=options["activity"],
+                skew=options["skew"],
+                batch_size=options["batch_size"],
+                seed=options["seed"],
+            )
+            daily_ratings = rebuild_daily_ratings(batch_size=options["batch_size"])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {stats['users']} users, {stats['restaurants']} restaurants, "
+                f"{stats['votes']} votes and {daily_ratings} daily rating rows"
+            )
+        )
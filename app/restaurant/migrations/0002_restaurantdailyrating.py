@@ -0,0 +1,45 @@
+# Generated by Django 3.2.10 on 2026-10-16 23:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("restaurant", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RestaurantDailyRating",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                (
+                    "total_weight",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                ("total_votes", models.PositiveIntegerField(default=0)),
+                ("voter_count", models.PositiveIntegerField(default=0)),
+                (
+                    "restaurant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_ratings",
+                        to="restaurant.restaurant",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("restaurant", "date")},
+            },
+        ),
+    ]
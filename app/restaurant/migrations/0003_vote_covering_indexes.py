@@ -0,0 +1,44 @@
+# Generated by Django 3.2.10 on 2026-10-16 23:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("restaurant", "0002_restaurantdailyrating"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="restaurantdailyrating",
+            index=models.Index(
+                fields=["date"],
+                include=("restaurant", "total_weight", "total_votes", "voter_count"),
+                name="daily_rating_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="vote",
+            index=models.Index(
+                fields=["user", "date"],
+                include=("total_votes",),
+                name="vote_user_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="vote",
+            index=models.Index(
+                fields=["restaurant", "date"],
+                include=("user", "total_weight", "total_votes"),
+                name="vote_restaurant_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="vote",
+            index=models.Index(
+                fields=["date"],
+                include=("restaurant", "user", "total_weight", "total_votes"),
+                name="vote_date_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,122 @@
+# Generated by Django 3.2.10 on 2026-10-16 23:53
+
+from datetime import date
+
+from django.db import migrations, models
+from django.utils import timezone
+
+VOTE_TABLE = "restaurant_vote"
+# Months of partitions created ahead of the current one, rotate_vote_partitions keeps creating them
+MONTHS_AHEAD = 3
+
+
+def add_months(month, months):
+    year, index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return date(year, index + 1, 1)
+
+
+def rebuild_vote_table(schema_editor, partitioned):
+    """
+    Recreate the vote table as a table partitioned by month on `date`, or back as a plain table, keeping its rows,
+    sequence, constraints and indexes.
+
+    Partitioned tables need the partition key in their primary key, so the primary key becomes (id, date). The
+    unique (user, restaurant, date) constraint already includes it.
+    """
+    quote = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass",
+            [VOTE_TABLE],
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT indexdef FROM pg_indexes
+            WHERE schemaname = current_schema() AND tablename = %s
+            AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)
+            """,
+            [VOTE_TABLE, VOTE_TABLE],
+        )
+        indexes = [indexdef for (indexdef,) in cursor.fetchall()]
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [VOTE_TABLE])
+        (sequence,) = cursor.fetchone()
+        cursor.execute(f"SELECT min(date) FROM {quote(VOTE_TABLE)}")
+        (first_date,) = cursor.fetchone()
+
+        old_table = quote(f"{VOTE_TABLE}_old")
+        table = quote(VOTE_TABLE)
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {old_table}")
+        partition_by = " PARTITION BY RANGE (date)" if partitioned else ""
+        cursor.execute(
+            f"CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS){partition_by}"
+        )
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+
+        if partitioned:
+            cursor.execute(
+                f"CREATE TABLE {quote(VOTE_TABLE + '_default')} PARTITION OF {table} DEFAULT"
+            )
+            today = timezone.now().date().replace(day=1)
+            month = min(first_date.replace(day=1), today) if first_date else today
+            while month <= add_months(today, MONTHS_AHEAD):
+                name = quote(f"{VOTE_TABLE}_y{month.year}m{month.month:02d}")
+                cursor.execute(
+                    f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                    [month, add_months(month, 1)],
+                )
+                month = add_months(month, 1)
+
+        cursor.execute(f"INSERT INTO {table} SELECT * FROM {old_table}")
+        cursor.execute(f"DROP TABLE {old_table}")
+
+        for name, kind, definition in constraints:
+            if kind == "p":
+                definition = (
+                    "PRIMARY KEY (id, date)" if partitioned else "PRIMARY KEY (id)"
+                )
+            cursor.execute(
+                f"ALTER TABLE {table} ADD CONSTRAINT {quote(name)} {definition}"
+            )
+        for indexdef in indexes:
+            cursor.execute(indexdef)
+
+
+def partition_votes(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        rebuild_vote_table(schema_editor, partitioned=True)
+
+
+def unpartition_votes(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        rebuild_vote_table(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("restaurant", "0003_vote_covering_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedVoteMonth",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField(unique=True)),
+                ("table", models.CharField(blank=True, max_length=63)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["month"],
+            },
+        ),
+        migrations.RunPython(partition_votes, unpartition_votes),
+    ]
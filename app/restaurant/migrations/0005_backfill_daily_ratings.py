@@ -0,0 +1,66 @@
+from datetime import date
+
+from django.db import migrations
+from django.db.models import Count, Q, Sum
+
+BATCH_SIZE = 1000
+
+
+def add_months(month, months):
+    year, index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return date(year, index + 1, 1)
+
+
+def backfill_daily_ratings(apps, schema_editor):
+    """
+    Rebuild the daily rating rollup from the votes, like `rebuild_daily_ratings`, so leaderboards of upgraded databases
+    include the votes cast before the rollup existed. The rollup of archived months is left untouched.
+    """
+    Vote = apps.get_model("restaurant", "Vote")
+    RestaurantDailyRating = apps.get_model("restaurant", "RestaurantDailyRating")
+    ArchivedVoteMonth = apps.get_model("restaurant", "ArchivedVoteMonth")
+    db_alias = schema_editor.connection.alias
+
+    archived = Q(pk__in=[])
+    for month in ArchivedVoteMonth.objects.using(db_alias).values_list(
+        "month", flat=True
+    ):
+        archived |= Q(date__gte=month, date__lt=add_months(month, 1))
+
+    RestaurantDailyRating.objects.using(db_alias).exclude(archived).delete()
+    rows = (
+        Vote.objects.using(db_alias)
+        .exclude(archived)
+        .values("restaurant_id", "date")
+        .annotate(
+            sum_weight=Sum("total_weight"),
+            sum_votes=Sum("total_votes"),
+            voters=Count("user", distinct=True),
+        )
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator():
+        batch.append(
+            RestaurantDailyRating(
+                restaurant_id=row["restaurant_id"],
+                date=row["date"],
+                total_weight=row["sum_weight"],
+                total_votes=row["sum_votes"],
+                voter_count=row["voters"],
+            )
+        )
+        if len(batch) == BATCH_SIZE:
+            RestaurantDailyRating.objects.using(db_alias).bulk_create(batch)
+            batch = []
+    RestaurantDailyRating.objects.using(db_alias).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("restaurant", "0004_vote_partitions"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_ratings, migrations.RunPython.noop),
+    ]
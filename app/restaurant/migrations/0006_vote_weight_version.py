@@ -0,0 +1,17 @@
+# Generated by Django 3.2.10 on 2026-10-17 00:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("restaurant", "0005_backfill_daily_ratings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vote",
+            name="weight_version",
+            field=models.CharField(blank=True, default="", max_length=32),
+        ),
+    ]
@@ -45,6 +45,67 @@ class Vote(models.Model):
     date = models.DateField(auto_now_add=True)
     total_votes = models.PositiveIntegerField(default=0)
     total_weight = models.DecimalField(default=0, max_digits=10, decimal_places=2)
+    # The version of the weight policy the vote was last written or reweighted with, empty for older votes
+    weight_version = models.CharField(max_length=32, blank=True, default="")
 
     class Meta:
         unique_together = ("user", "restaurant", "date")
+        # Covering indexes for the hot query shapes, the INCLUDE columns are only used on PostgreSQL: the daily limit
+        # check by (user, date), restaurant ratings by (restaurant, date) and leaderboard ranges by date.
+        indexes = [
+            models.Index(
+                fields=["user", "date"],
+                include=["total_votes"],
+                name="vote_user_date_idx",
+            ),
+            models.Index(
+                fields=["restaurant", "date"],
+                include=["user", "total_weight", "total_votes"],
+                name="vote_restaurant_date_idx",
+            ),
+            models.Index(
+                fields=["date"],
+                include=["restaurant", "user", "total_weight", "total_votes"],
+                name="vote_date_idx",
+            ),
+        ]
+
+
+class RestaurantDailyRating(models.Model):
+    """
+    Daily rollup of the votes of a restaurant, maintained alongside `Vote` so leaderboards do not scan raw votes.
+    """
+
+    restaurant = models.ForeignKey(
+        Restaurant, on_delete=models.CASCADE, related_name="daily_ratings"
+    )
+    date = models.DateField()
+    total_weight = models.DecimalField(default=0, max_digits=12, decimal_places=2)
+    total_votes = models.PositiveIntegerField(default=0)
+    voter_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("restaurant", "date")
+        indexes = [
+            models.Index(
+                fields=["date"],
+                include=["restaurant", "total_weight", "total_votes", "voter_count"],
+                name="daily_rating_date_idx",
+            ),
+        ]
+
+
+class ArchivedVoteMonth(models.Model):
+    """
+    A month of votes folded into the daily rating rollup and detached from the partitioned `Vote` table.
+
+    Only the rollup is left for archived months, see `rotate_vote_partitions`. The detached partition is kept as a
+    standalone table unless it was dropped.
+    """
+
+    month = models.DateField(unique=True)
+    table = models.CharField(max_length=63, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["month"]
@@ -1,7 +1,209 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from decimal import InvalidOperation
+from typing import Any, Dict, List, Optional
+
+from django.core.exceptions import ValidationError
+from django.db.models import Field, Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class RestaurantPagination(PageNumberPagination):
     page_size = 30
     page_size_query_param = "page_size"
     max_page_size = 100
+
+    def get_page_params(self, request: Request) -> Optional[Dict[str, Any]]:
+        """
+        Get the parameters selecting the requested page, resolved like the paginator does so that every spelling of a
+        page, e.g. `page=1` and `page=01`, selects the same parameters.
+
+        Returns:
+            The page number and page size, or None if the page number is invalid.
+        """
+        page = request.query_params.get(self.page_query_param, 1)
+        if page in self.last_page_strings:
+            number = "last"
+        else:
+            try:
+                number = int(page)
+            except (TypeError, ValueError):
+                return None
+            if number < 1:
+                return None
+        return {"page": number, "page_size": self.get_page_size(request)}
+
+
+class RestaurantCursorPagination(BasePagination):
+    """
+    Keyset pagination following the ordering of the paginated queryset.
+
+    Instead of an OFFSET, every page filters on the ordering values of the last row of the previous page, which are
+    carried in an opaque cursor, so deep pages cost the same as the first one. The last ordering field has to be
+    unique, e.g. the primary key, to break ties. Pages can only be walked forward.
+    """
+
+    page_size = RestaurantPagination.page_size
+    page_size_query_param = RestaurantPagination.page_size_query_param
+    max_page_size = RestaurantPagination.max_page_size
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(
+        self, queryset: QuerySet, request: Request, view=None
+    ) -> List[Any]:
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = [
+            (field.lstrip("-"), field.startswith("-"))
+            for field in queryset.query.order_by
+        ]
+        self.ordering_fields = [
+            self.get_ordering_field(queryset, field) for field, _ in self.ordering
+        ]
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) != "false":
+            self.count = queryset.count()
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+
+        results = list(queryset[: self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[: self.page_size]
+        self.next_position = None
+        if self.has_next:
+            last = results[-1]
+            if isinstance(last, dict):
+                # A page of values() rows
+                self.next_position = [last[field] for field, _ in self.ordering]
+            else:
+                self.next_position = [
+                    getattr(last, field) for field, _ in self.ordering
+                ]
+        return results
+
+    @staticmethod
+    def get_ordering_field(queryset: QuerySet, name: str) -> Field:
+        """
+        Get the field of an ordering name, the output field of annotations such as the leaderboard ratings.
+        """
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    def get_position_filter(self, position: List[Any]) -> Q:
+        """
+        Build the filter of the rows coming after the given position in the ordering.
+
+        For an ordering (a, b, c) this is a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z), using < for the
+        descending fields.
+        """
+        position_filter = Q()
+        for index, (field, descending) in enumerate(self.ordering):
+            lookup = "lt" if descending else "gt"
+            condition = Q(**{f"{field}__{lookup}": position[index]})
+            for previous_index, (previous_field, _) in enumerate(self.ordering[:index]):
+                condition &= Q(**{previous_field: position[previous_index]})
+            position_filter |= condition
+        return position_filter
+
+    def get_page_size(self, request: Request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_page_params(self, request: Request) -> Optional[Dict[str, Any]]:
+        """
+        Get the parameters selecting the requested page, with a digest of the position of the cursor rather than its
+        encoding. The position is client input, hashing it keeps spaces and long values out of the cache keys.
+
+        Returns:
+            The position, page size and whether the results are counted, or None if the cursor does not decode.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        position = ""
+        if encoded:
+            try:
+                position = json.dumps(
+                    json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+                )
+                position = hashlib.sha256(position.encode()).hexdigest()
+            except (TypeError, ValueError):
+                return None
+        return {
+            "cursor": position,
+            "page_size": self.get_page_size(request),
+            "count": request.query_params.get(self.count_query_param) != "false",
+        }
+
+    def decode_cursor(self, request: Request) -> Optional[List[Any]]:
+        """
+        Decode the position carried by the cursor of the request, converted to the types of the ordering fields.
+
+        Raises:
+            NotFound: If the cursor was not issued by the paginator, e.g. it was tampered with.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = [
+                field.to_python(value)
+                for field, value in zip(self.ordering_fields, position)
+            ]
+        except (ValidationError, InvalidOperation, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position: List[Any]) -> str:
+        data = json.dumps([str(value) for value in position])
+        return urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.next_position)
+        )
+
+    def get_paginated_response(self, data: List[Any]) -> Response:
+        response_data = OrderedDict()
+        if self.count is not None:
+            response_data["count"] = self.count
+        response_data["next"] = self.get_next_link()
+        response_data["results"] = data
+        return Response(response_data)
+
+    def get_paginated_response_schema(self, schema: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "count": {"type": "integer", "example": 123},
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
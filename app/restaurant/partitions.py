@@ -0,0 +1,172 @@
+import re
+from datetime import date as Date
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedVoteMonth, Vote
+
+VOTE_TABLE = Vote._meta.db_table
+DEFAULT_PARTITION = f"{VOTE_TABLE}_default"
+PARTITION_BOUND = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})'\) TO")
+
+
+def month_start(day: Date) -> Date:
+    return day.replace(day=1)
+
+
+def add_months(month: Date, months: int) -> Date:
+    year, index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return Date(year, index + 1, 1)
+
+
+def get_partition_name(month: Date) -> str:
+    return f"{VOTE_TABLE}_y{month.year}m{month.month:02d}"
+
+
+def is_vote_table_partitioned() -> bool:
+    """
+    Check if the vote table is partitioned, which it is on PostgreSQL since migration 0004.
+    """
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [VOTE_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def get_vote_partitions() -> Dict[Date, str]:
+    """
+    Get the monthly partitions attached to the vote table.
+
+    Returns:
+        partitions: The name of the partition of every month, the default partition excluded.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            """,
+            [VOTE_TABLE],
+        )
+        partitions = {}
+        for name, bound in cursor.fetchall():
+            match = PARTITION_BOUND.search(bound)
+            if match:
+                partitions[Date.fromisoformat(match.group(1))] = name
+        return partitions
+
+
+def get_default_partition_months() -> List[Date]:
+    """
+    Get the months having votes in the default partition, which happens when partitions were not created in time.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', date)::date FROM {connection.ops.quote_name(DEFAULT_PARTITION)}"
+        )
+        return [month for (month,) in cursor.fetchall()]
+
+
+def create_vote_partition(month: Date) -> Optional[str]:
+    """
+    Create the partition of a month unless it exists.
+
+    Votes of the month that landed in the default partition are moved to the new one.
+
+    Args:
+        month (datetime.date): The first day of the month.
+
+    Returns:
+        name (Optional[str]): The name of the created partition, None if it already existed.
+    """
+    if month in get_vote_partitions():
+        return None
+
+    table = connection.ops.quote_name(VOTE_TABLE)
+    default = connection.ops.quote_name(DEFAULT_PARTITION)
+    name = get_partition_name(month)
+    bounds = [month, add_months(month, 1)]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT 1 FROM {default} WHERE date >= %s AND date < %s LIMIT 1", bounds
+        )
+        if cursor.fetchone() is None:
+            cursor.execute(
+                f"CREATE TABLE {connection.ops.quote_name(name)} PARTITION OF {table} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                bounds,
+            )
+            return name
+
+        # A partition overlapping rows of the default partition can not be created, attach a filled table instead
+        partition = connection.ops.quote_name(name)
+        cursor.execute(
+            f"CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {default} WHERE date >= %s AND date < %s RETURNING *) "
+            f"INSERT INTO {partition} SELECT * FROM moved",
+            bounds,
+        )
+        cursor.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM (%s) TO (%s)",
+            bounds,
+        )
+    return name
+
+
+def archive_vote_partition(month: Date, drop: bool = False) -> int:
+    """
+    Fold a closed month of votes into the daily rating rollup and detach its partition from the vote table.
+
+    The rollup rows of the month are recomputed from its votes, after which the votes are no longer needed: leaderboards
+    read the rollup and vote limits only look at today. The detached partition is kept as a standalone table unless
+    `drop` is set.
+
+    Args:
+        month (datetime.date): The first day of the month, it must have ended.
+        drop (bool): Whether to drop the detached partition.
+
+    Returns:
+        count (int): The number of rollup rows written for the month.
+    """
+    from .utils import rebuild_daily_ratings
+
+    if add_months(month, 1) > month_start(timezone.now().date()):
+        raise ValueError("Only months that ended can be archived.")
+
+    # Make sure all the votes of the month are in its partition
+    create_vote_partition(month)
+    name = get_partition_name(month)
+    partition = connection.ops.quote_name(name)
+    with transaction.atomic():
+        count = rebuild_daily_ratings(
+            date_from=month, date_to=add_months(month, 1) - timedelta(days=1)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"ALTER TABLE {connection.ops.quote_name(VOTE_TABLE)} DETACH PARTITION {partition}"
+            )
+            if drop:
+                cursor.execute(f"DROP TABLE {partition}")
+        ArchivedVoteMonth.objects.create(month=month, table="" if drop else name)
+    return count
+
+
+def get_archived_months_filter(field: str = "date") -> Q:
+    """
+    Build a filter matching the dates of the archived months, whose rollup can not be rebuilt from votes anymore.
+    """
+    archived = Q(pk__in=[])
+    for month in ArchivedVoteMonth.objects.values_list("month", flat=True):
+        archived |= Q(**{f"{field}__gte": month, f"{field}__lt": add_months(month, 1)})
+    return archived
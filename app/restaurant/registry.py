@@ -0,0 +1,80 @@
+import threading
+from functools import lru_cache
+from typing import FrozenSet, Iterable, Optional, Set
+from uuid import UUID
+
+from django.db import DEFAULT_DB_ALIAS
+
+from .caching import get_restaurants_version
+from .models import Restaurant
+
+
+class RestaurantRegistry:
+    """
+    The ids of all restaurants, held by the process so votes check their restaurant exists without a query.
+
+    The registry follows the restaurants version of the leaderboard cache, bumped by the signals whenever a restaurant
+    is created or deleted, and reloads the ids from the primary once it changed, so every process of a deployment
+    sharing the cache sees the change. Checking an id costs a cache read of the version.
+
+    The signals bump the version once the transaction commits, so a process reloading meanwhile may still see a
+    deleted restaurant, and it is bumped again once the deletion is visible. Ids missing from the registry, e.g. of
+    a restaurant created by a transaction that just committed, are looked up in the database before they are turned
+    away. A restaurant deleted between the check and the vote fails the vote with an IntegrityError, which the vote
+    views answer like an unknown restaurant.
+    """
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.ids: FrozenSet[UUID] = frozenset()
+        self.lock = threading.Lock()
+
+    def get_ids(self) -> FrozenSet[UUID]:
+        version = get_restaurants_version()
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.ids = frozenset(
+                        Restaurant.objects.using(DEFAULT_DB_ALIAS).values_list(
+                            "pk", flat=True
+                        )
+                    )
+                    self.version = version
+        return self.ids
+
+    def get_existing(self, restaurant_ids: Iterable[UUID]) -> Set[UUID]:
+        """
+        Get which of the given restaurants exist.
+
+        Args:
+            restaurant_ids: The ids of the restaurants.
+
+        Returns:
+            The ids of the restaurants that exist, the ones the registry does not know are read with one query.
+        """
+        ids = self.get_ids()
+        restaurant_ids = set(restaurant_ids)
+        existing = restaurant_ids & ids
+        missing = restaurant_ids - ids
+        if missing:
+            existing.update(self.lookup(missing))
+        return existing
+
+    def lookup(self, restaurant_ids: Iterable[UUID]) -> Set[UUID]:
+        """
+        Get which of the given restaurants exist in the primary, without the registry, e.g. for ids it does not know
+        yet or after a vote failed on a restaurant deleted since the registry checked it.
+        """
+        return set(
+            Restaurant.objects.using(DEFAULT_DB_ALIAS)
+            .filter(pk__in=restaurant_ids)
+            .values_list("pk", flat=True)
+        )
+
+    def exists(self, restaurant_id: UUID) -> bool:
+        return bool(self.get_existing([restaurant_id]))
+
+
+@lru_cache(maxsize=None)
+def get_restaurant_registry() -> RestaurantRegistry:
+    return RestaurantRegistry()
@@ -0,0 +1,125 @@
+import random
+from datetime import date as Date
+from datetime import timedelta
+from itertools import islice
+from typing import Dict, Iterator, List, Optional
+
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.sql import InsertQuery
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from .models import Restaurant, Vote
+from .utils import get_vote_weight
+from .weights import get_weight_policy
+
+
+def insert_votes(votes: List[Vote]) -> None:
+    """
+    Insert votes with a single query, keeping the dates they were given.
+
+    Like raw saves, the insert reads the values of the votes rather than calling `pre_save`, so `auto_now_add` of
+    `Vote.date` does not move them to today.
+    """
+    fields = [
+        field for field in Vote._meta.local_concrete_fields if not field.primary_key
+    ]
+    query = InsertQuery(Vote)
+    query.insert_values(fields, votes, raw=True)
+    query.get_compiler(using=DEFAULT_DB_ALIAS).execute_sql()
+
+
+def generate_dataset(
+    users: int,
+    restaurants: int,
+    days: int,
+    activity: float = 0.6,
+    skew: float = 1.0,
+    batch_size: int = 5000,
+    seed: Optional[int] = None,
+    end_date: Optional[Date] = None,
+) -> Dict[str, int]:
+    """
+    Generate users, restaurants and a realistic, skewed history of votes.
+
+    Every day each user votes with the probability `activity`, casting between 1 and `settings.MAX_VOTES_PER_DAY`
+    votes, fewer votes being more likely. Restaurants are picked following a Zipf-like distribution, so a handful of
+    popular restaurants collect most of the votes, the larger `skew` is the more so. Weights follow the same rules as
+    `calculate_vote_weight`. The daily rating rollup is not touched, rebuild it afterwards if needed.
+
+    Args:
+        users (int): The number of users to create.
+        restaurants (int): The number of restaurants to create.
+        days (int): The number of days of votes to generate, ending on `end_date`.
+        activity (float): The probability that a user votes on a given day.
+        skew (float): The exponent of the popularity distribution of the restaurants.
+        batch_size (int): The number of rows inserted per query.
+        seed (Optional[int]): Seed of the random generator to reproduce a dataset.
+        end_date (Optional[datetime.date]): The last day of votes, today by default.
+
+    Returns:
+        stats (Dict[str, int]): The number of users, restaurants and vote rows created.
+    """
+    rng = random.Random(seed)
+    end_date = end_date or timezone.now().date()
+    prefix = get_random_string(8).lower()
+
+    user_objects = User.objects.bulk_create(
+        (
+            User(username=f"seed_{prefix}_{index}", password=UNUSABLE_PASSWORD_PREFIX)
+            for index in range(users)
+        ),
+        batch_size=batch_size,
+    )
+    if not all(user.pk for user in user_objects):
+        # Backends that can not return the primary keys of bulk inserted rows
+        user_objects = list(User.objects.filter(username__startswith=f"seed_{prefix}_"))
+
+    restaurant_objects = Restaurant.objects.bulk_create(
+        (
+            Restaurant(name=f"Restaurant {prefix} {index}", description="")
+            for index in range(restaurants)
+        ),
+        batch_size=batch_size,
+    )
+    popularity = [1 / (rank + 1) ** skew for rank in range(restaurants)]
+    vote_counts = range(1, settings.MAX_VOTES_PER_DAY + 1)
+    vote_count_weights = [1 / count for count in vote_counts]
+    weight_version = get_weight_policy().version
+
+    def votes() -> Iterator[Vote]:
+        for day in range(days):
+            date = end_date - timedelta(days=day)
+            for user in user_objects:
+                if rng.random() >= activity:
+                    continue
+                count = rng.choices(vote_counts, vote_count_weights)[0]
+                picks: Dict[Restaurant, int] = {}
+                for restaurant in rng.choices(restaurant_objects, popularity, k=count):
+                    picks[restaurant] = picks.get(restaurant, 0) + 1
+                for restaurant, total_votes in picks.items():
+                    yield Vote(
+                        user=user,
+                        restaurant=restaurant,
+                        date=date,
+                        total_votes=total_votes,
+                        total_weight=sum(
+                            get_vote_weight(number)
+                            for number in range(1, total_votes + 1)
+                        ),
+                        weight_version=weight_version,
+                    )
+
+    vote_rows = 0
+    vote_iterator = votes()
+    while True:
+        batch = list(islice(vote_iterator, batch_size))
+        if not batch:
+            break
+        insert_votes(batch)
+        vote_rows += len(batch)
+
+    return {"users": users, "restaurants": restaurants, "votes": vote_rows}
@@ -1,19 +1,24 @@
-from decimal import Decimal
-from typing import Any, Dict
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from .models import Restaurant
-from .utils import calculate_restaurant_rating
+from .registry import get_restaurant_registry
 
 
 class DateQueryParamSerializer(serializers.Serializer):
     """
     Serializer to validate the query parameters that we get from the API.
 
-    Basically, this validates that we get datetime in correct format and makes sure date_from greater than date_to.
+    Basically, this validates that we get datetime in correct format and makes sure date_from is not after date_to.
     """
 
     date_to = serializers.DateField(format="%Y-%m-%d", required=False)
@@ -21,23 +26,71 @@ class DateQueryParamSerializer(serializers.Serializer):
 
     def validate(self, data: Dict[str, Any]) -> Dict:
         """
-        Validate the date_to and date_from to if both is provided make sure date_from is greater than date_to
+        Validate the date_to and date_from to if both is provided make sure date_from is not after date_to
 
         Args:
             data: data to be validated.
 
         Returns:
-            A newly created restaurant instance.
+            The validated date range.
         """
         date_to = data.get("date_to")
         date_from = data.get("date_from")
 
-        if date_to and date_from and date_from < date_to:
-            raise ValidationError("date_from must be greater than date_to")
+        if date_to and date_from and date_from > date_to:
+            raise ValidationError("date_from can not be after date_to")
 
         return data
 
 
+class LeaderboardQueryParamSerializer(DateQueryParamSerializer):
+    """
+    Serializer to validate the query parameters of the leaderboard, the date range and the rating mode.
+
+    - `sum`: The sum of the vote weights within the date range, the default.
+    - `decay`: Votes count half as much every `half_life` days before date_to, or today.
+    - `window`: The sum of the vote weights of the last `window` days up to date_to, or today.
+    """
+
+    mode = serializers.ChoiceField(choices=["sum", "decay", "window"], default="sum")
+    half_life = serializers.FloatField(min_value=0.1, max_value=3650, default=7)
+    window = serializers.IntegerField(min_value=1, max_value=3650, default=7)
+
+    def validate(self, data: Dict[str, Any]) -> Dict:
+        """
+        Validate the date range and resolve the window of the window mode into its start date.
+
+        Args:
+            data: data to be validated.
+
+        Returns:
+            The validated parameters, only the ones the mode uses are kept.
+        """
+        data = super().validate(data)
+        half_life = data.pop("half_life")
+        window = data.pop("window")
+
+        if data["mode"] == "decay":
+            data["half_life"] = half_life
+        elif data["mode"] == "window":
+            if data.get("date_from"):
+                raise ValidationError("date_from can not be used with the window mode.")
+            date_to = data.get("date_to") or timezone.now().date()
+            data["date_from"] = date_to - timedelta(days=window - 1)
+
+        return data
+
+
+class ExportQueryParamSerializer(DateQueryParamSerializer):
+    """
+    Serializer to validate the query parameters of the exports, the date range and the output format.
+
+    The format is read from `output` since DRF reserves `format` to pick a renderer.
+    """
+
+    output = serializers.ChoiceField(choices=["csv", "ndjson"], default="csv")
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -89,20 +142,191 @@ class RestaurantSerializer(serializers.ModelSerializer):
         return instance
 
 
+class RestaurantProjection:
+    """
+    Read-only serialization of restaurants returning the same data as `RestaurantSerializer`, from `values()` rows
+    instead of model instances.
+
+    The columns to select and the conversion of every field are compiled once from the serializer's fields, the
+    nested users included, so a page is read in one joined query and serialized without building model instances or
+    going through the serializer field by field.
+    """
+
+    # Fields whose representation is the database value itself
+    PASS_THROUGH_FIELDS = (
+        serializers.CharField,
+        serializers.IntegerField,
+        serializers.ReadOnlyField,
+    )
+
+    def __init__(self, serializer_class=RestaurantSerializer):
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def fields(self) -> List[Tuple[str, str, Optional[Callable], Optional[List]]]:
+        """
+        Compile the name, column and conversion of every field, and of the fields of nested serializers.
+        """
+        fields = []
+        for name, field in self.serializer_class().fields.items():
+            nested = convert = None
+            if isinstance(field, serializers.BaseSerializer):
+                nested = [
+                    (
+                        nested_name,
+                        f"{field.source}__{nested_field.source}",
+                        self.get_converter(nested_field),
+                    )
+                    for nested_name, nested_field in field.fields.items()
+                ]
+            else:
+                convert = self.get_converter(field)
+            fields.append((name, field.source, convert, nested))
+        return fields
+
+    @cached_property
+    def columns(self) -> List[str]:
+        columns = []
+        for _, column, _, nested in self.fields:
+            columns.append(column)
+            columns.extend(nested_column for _, nested_column, _ in nested or [])
+        return columns
+
+    def get_converter(self, field: serializers.Field) -> Optional[Callable]:
+        if isinstance(field, self.PASS_THROUGH_FIELDS):
+            return None
+        return field.to_representation
+
+    def values(self, queryset: QuerySet) -> QuerySet:
+        """
+        Select the columns of the projection, nested objects are joined in the same query.
+        """
+        return queryset.values(*self.columns)
+
+    def to_representation(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Serialize a row selected by `values()`.
+
+        Args:
+            row: The values of the columns of the projection.
+
+        Returns:
+            The same data as the serializer, nested objects that are null included.
+        """
+        data = {}
+        for name, column, convert, nested in self.fields:
+            value = row[column]
+            if value is None:
+                data[name] = None
+            elif nested is not None:
+                data[name] = {
+                    nested_name: convert_value(row[nested_column], nested_convert)
+                    for nested_name, nested_column, nested_convert in nested
+                }
+            else:
+                data[name] = convert(value) if convert else value
+        return data
+
+    def serialize(self, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [self.to_representation(row) for row in rows]
+
+
+def convert_value(value: Any, convert: Optional[Callable]) -> Any:
+    if value is None or convert is None:
+        return value
+    return convert(value)
+
+
+restaurant_projection = RestaurantProjection()
+
+
 class RestaurantRatingSerializer(RestaurantSerializer):
     rating = serializers.SerializerMethodField()
 
     class Meta(RestaurantSerializer.Meta):
         extra_fields = RestaurantSerializer.Meta.extra_fields + ["rating"]
 
-    def get_rating(self, obj: Restaurant) -> Decimal:
-        date_to = self.context.get("date_to")
-        date_from = self.context.get("date_from")
-        rating = calculate_restaurant_rating(obj, date_to=date_to, date_from=date_from)
-        return rating
+    def get_rating(self, obj: Restaurant) -> Dict[str, Any]:
+        """
+        Read the rating values annotated by `get_restaurants_ordered_by_rating`.
+
+        Args:
+            obj: The annotated restaurant instance.
+
+        Returns:
+            The total rating, total votes and voter days of the restaurant.
+        """
+        return {
+            "total_rating": obj.total_rating,
+            "total_votes": obj.total_votes,
+            "voter_days": obj.voter_days,
+        }
+
+
+class RestaurantIdField(serializers.UUIDField):
+    """
+    The UUID of an existing restaurant, checked against the restaurant registry instead of loading the restaurant.
+    """
+
+    default_error_messages = {
+        "does_not_exist": 'Invalid pk "{pk_value}" - object does not exist.',
+    }
+
+    def to_internal_value(self, data) -> UUID:
+        restaurant_id = super().to_internal_value(data)
+        if not get_restaurant_registry().exists(restaurant_id):
+            self.fail("does_not_exist", pk_value=data)
+        return restaurant_id
 
 
 class RestaurantVoteSerializer(serializers.Serializer):
-    restaurant = serializers.PrimaryKeyRelatedField(
-        queryset=Restaurant.objects.all(), required=True
+    restaurant = RestaurantIdField(required=True)
+
+
+class BulkVoteItemSerializer(serializers.Serializer):
+    """
+    Serializer of a single vote, or a batch of votes of the same user, within a bulk vote request.
+
+    The user defaults to the authenticated one, only staff users can vote on behalf of others.
+    """
+
+    user = serializers.IntegerField(required=False)
+    restaurant = serializers.UUIDField(required=False)
+    restaurants = serializers.ListField(
+        child=serializers.UUIDField(), required=False, allow_empty=False
     )
+
+    def validate(self, data: Dict[str, Any]) -> Dict:
+        """
+        Validate that either a single restaurant or a list of restaurants is provided.
+
+        Args:
+            data: data to be validated.
+
+        Returns:
+            The validated vote.
+        """
+        if ("restaurant" in data) == ("restaurants" in data):
+            raise ValidationError("Provide either restaurant or restaurants.")
+        return data
+
+
+class BulkVoteSerializer(serializers.Serializer):
+    votes = BulkVoteItemSerializer(many=True, allow_empty=False)
+
+    def validate_votes(self, votes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Validate that the request does not contain more votes than `settings.MAX_BULK_VOTES`.
+
+        Args:
+            votes: The validated votes and batches of votes.
+
+        Returns:
+            The validated votes.
+        """
+        count = sum(len(vote.get("restaurants", [None])) for vote in votes)
+        if count > settings.MAX_BULK_VOTES:
+            raise ValidationError(
+                f"A bulk request can contain at most {settings.MAX_BULK_VOTES} votes."
+            )
+        return votes
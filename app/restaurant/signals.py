@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .caching import (
+    bump_leaderboard_version,
+    bump_restaurants_version,
+    bump_user_auth_version,
+    delete_cached_credentials,
+    get_credentials_cache_key,
+)
+from .leaderboard import get_leaderboard_index
+from .models import Restaurant
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_leaderboards(sender, **kwargs):
+    """
+    Leaderboards embed the restaurant details, so any restaurant change invalidates all of them.
+    """
+    bump_leaderboard_version()
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_restaurant_registries(sender, created=True, **kwargs):
+    """
+    Only creating and deleting restaurants changes the ids of the restaurant registries. The version is bumped once the
+    change is committed, a registry reloading before would otherwise keep the ids it read under the new version.
+    """
+    if created:
+        transaction.on_commit(bump_restaurants_version)
+
+
+@receiver(post_delete, sender=Restaurant)
+def remove_from_leaderboard_index(sender, instance, **kwargs):
+    index = get_leaderboard_index()
+    if index:
+        index.remove(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_credentials(sender, instance, update_fields=None, **kwargs):
+    """
+    A saved user may have been deactivated or changed its password, forget the credentials it was authenticated with.
+    """
+    if update_fields and set(update_fields) == {"last_login"}:
+        # Logging in only updates the last login
+        return
+    bump_user_auth_version(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    delete_cached_credentials(get_credentials_cache_key("token", instance.key))
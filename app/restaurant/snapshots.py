@@ -0,0 +1,226 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import date as Date
+from datetime import timedelta
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .caching import (
+    get_leaderboard_snapshot,
+    lock_leaderboard_snapshots,
+    set_leaderboard_snapshot,
+)
+from .leaderboard import RankedLeaderboard, RankedRestaurant
+from .utils import get_restaurants_ordered_by_rating
+
+logger = logging.getLogger(__name__)
+
+# The snapshotted windows and their number of days up to today, None for all time
+SNAPSHOT_WINDOWS: Dict[str, Optional[int]] = {
+    "today": 1,
+    "7d": 7,
+    "30d": 30,
+    "all": None,
+}
+
+
+class LeaderboardSnapshot:
+    """
+    The ranked restaurants of a leaderboard window as computed on `day` at `computed_at`, a timestamp.
+
+    Only the ids and rating values of the restaurants are kept, ranked like `get_restaurants_ordered_by_rating`, their
+    details are read when a page is served so they are always current.
+    """
+
+    def __init__(
+        self,
+        window: str,
+        day: Date,
+        computed_at: float,
+        rows: Tuple[RankedRestaurant, ...],
+    ):
+        self.window = window
+        self.day = day
+        self.computed_at = computed_at
+        self.rows = rows
+
+    def get_age(self) -> float:
+        return time.time() - self.computed_at
+
+    def get_validators(self) -> Tuple[str, int]:
+        """
+        Get the ETag and Last-Modified date of the responses served from the snapshot.
+        """
+        return f"snapshot-{self.window}-{self.computed_at}", int(self.computed_at)
+
+    def dump(self) -> Tuple:
+        return self.day, self.computed_at, self.rows
+
+    @classmethod
+    def load(cls, window: str, dump: Tuple) -> "LeaderboardSnapshot":
+        return cls(window, *dump)
+
+
+class SnapshotLeaderboard(RankedLeaderboard):
+    """
+    The leaderboard of a window served from its snapshot.
+    """
+
+    def __init__(self, snapshot: LeaderboardSnapshot):
+        self.snapshot = snapshot
+
+    def get_total(self) -> int:
+        return len(self.snapshot.rows)
+
+    def get_ranked(self, offset: int, limit: int) -> List[RankedRestaurant]:
+        return list(self.snapshot.rows[offset : offset + limit])
+
+
+def get_window_start(window: str, today: Date) -> Optional[Date]:
+    days = SNAPSHOT_WINDOWS[window]
+    return None if days is None else today - timedelta(days=days - 1)
+
+
+def get_snapshot_window(params: Dict[str, Any], today: Date) -> Optional[str]:
+    """
+    Get the window whose snapshot answers a leaderboard request, e.g. "7d" for `mode=window&window=7`.
+
+    Args:
+        params: The validated leaderboard parameters.
+        today: The current date.
+
+    Returns:
+        The window, or None if the request has to be computed live.
+    """
+    if params.get("mode", "sum") not in ("sum", "window"):
+        return None
+    if params.get("date_to") not in (None, today):
+        return None
+    date_from = params.get("date_from")
+    for window in SNAPSHOT_WINDOWS:
+        if date_from == get_window_start(window, today):
+            return window
+    return None
+
+
+def compute_leaderboard_snapshot(
+    window: str, today: Optional[Date] = None
+) -> LeaderboardSnapshot:
+    """
+    Rank the restaurants of a window with the grouped query of `get_restaurants_ordered_by_rating`.
+    """
+    today = today or timezone.now().date()
+    computed_at = time.time()
+    rows = get_restaurants_ordered_by_rating(
+        date_from=get_window_start(window, today)
+    ).values_list("uuid", "total_rating", "voter_days", "total_votes")
+    return LeaderboardSnapshot(
+        window,
+        today,
+        computed_at,
+        tuple((str(restaurant_id), *values) for restaurant_id, *values in rows),
+    )
+
+
+def refresh_leaderboard_snapshots(
+    windows: Optional[Iterable[str]] = None,
+) -> List[LeaderboardSnapshot]:
+    """
+    Compute and store the snapshots of the given windows, all of them by default.
+    """
+    snapshots = []
+    for window in windows or SNAPSHOT_WINDOWS:
+        snapshot = compute_leaderboard_snapshot(window)
+        set_leaderboard_snapshot(window, snapshot.dump())
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def get_fresh_leaderboard_snapshot(
+    params: Dict[str, Any]
+) -> Optional[LeaderboardSnapshot]:
+    """
+    Get the snapshot answering a leaderboard request, if it was computed today and is younger than
+    `settings.LEADERBOARD_SNAPSHOT_MAX_AGE` seconds.
+    """
+    if not settings.LEADERBOARD_SNAPSHOTS_ENABLED:
+        return None
+    today = timezone.now().date()
+    window = get_snapshot_window(params, today)
+    if window is None:
+        return None
+    dump = get_leaderboard_snapshot(window)
+    if dump is None:
+        return None
+    snapshot = LeaderboardSnapshot.load(window, dump)
+    if (
+        snapshot.day != today
+        or snapshot.get_age() > settings.LEADERBOARD_SNAPSHOT_MAX_AGE
+    ):
+        return None
+    return snapshot
+
+
+class LeaderboardRefresher:
+    """
+    Background thread refreshing the snapshots every `interval` seconds.
+
+    Every worker runs one, the workers sharing the cache take turns through a lock held for the interval, so the
+    snapshots are computed once per interval.
+    """
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.thread_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopped.clear()
+                self.thread = threading.Thread(
+                    target=self.run, name="leaderboard-refresher", daemon=True
+                )
+                self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            if lock_leaderboard_snapshots(self.interval):
+                try:
+                    refresh_leaderboard_snapshots()
+                except Exception:
+                    logger.exception("Could not refresh the leaderboard snapshots")
+                close_old_connections()
+            self.stopped.wait(self.interval)
+
+
+@lru_cache(maxsize=None)
+def get_leaderboard_refresher(interval: int) -> LeaderboardRefresher:
+    refresher = LeaderboardRefresher(interval)
+    atexit.register(refresher.stop)
+    return refresher
+
+
+def start_leaderboard_refresher() -> None:
+    """
+    Start the refresher of this process if `settings.LEADERBOARD_SNAPSHOT_REFRESH_INTERVAL` is set.
+    """
+    if (
+        settings.LEADERBOARD_SNAPSHOTS_ENABLED
+        and settings.LEADERBOARD_SNAPSHOT_REFRESH_INTERVAL
+    ):
+        get_leaderboard_refresher(
+            settings.LEADERBOARD_SNAPSHOT_REFRESH_INTERVAL
+        ).start()
@@ -1,18 +1,48 @@
+import base64
+import csv
+import gzip
+import io
+import json
 import os
+import uuid
+import warnings
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
+from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.test import AsyncClient, AsyncRequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 
+from convious.metrics import registry
+from restaurant import async_views
+from restaurant.authentication import CachedTokenAuthentication
+from restaurant.buffer import VoteBuffer
+from restaurant.counters import get_vote_counter
+from restaurant.leaderboard import get_leaderboard_index
 from restaurant.models import Restaurant, Vote
+from restaurant.registry import get_restaurant_registry
+from restaurant.serializers import RestaurantSerializer
+from restaurant.throttling import SlidingWindowThrottle
+from restaurant.utils import calculate_bulk_vote_weights, calculate_vote_weight
 
 
 class RestaurantTestCase(APITestCase):
     def setUp(self):
         os.environ["MAX_VOTES_PER_DAY"] = "5"
+        cache.clear()
         self.user = User.objects.create_user(
             username="testuser", password="testpassword"
         )
@@ -71,6 +101,166 @@ class RestaurantTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(Vote.objects.count(), 1)
 
+    def test_vote_limit_short_circuit(self):
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        url = reverse("restaurant:vote-create")
+        data = {"restaurant": self.restaurant1.uuid}
+        for i in range(settings.MAX_VOTES_PER_DAY):
+            client.post(url, data)
+
+        # Neither the user nor the restaurant are read once the limit is reached
+        with self.assertNumQueries(0):
+            response = client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, "You have reached your daily voting limit.")
+
+    def test_vote_restaurant_registry(self):
+        url = reverse("restaurant:vote-create")
+        table = Restaurant._meta.db_table
+        get_restaurant_registry().get_ids()
+
+        # The restaurant is checked against the registry, only the vote tables are written
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {"restaurant": self.restaurant2.uuid})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(
+            [query for query in queries if f'FROM "{table}"' in query["sql"]]
+        )
+
+        # Created and deleted restaurants are picked up once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            restaurant = Restaurant.objects.create(name="Restaurant 3")
+        response = self.client.post(url, {"restaurant": restaurant.uuid})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        restaurant_id = self.restaurant2.uuid
+        with self.captureOnCommitCallbacks(execute=True):
+            self.restaurant2.delete()
+        response = self.client.post(url, {"restaurant": restaurant_id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["restaurant"],
+            [f'Invalid pk "{restaurant_id}" - object does not exist.'],
+        )
+
+    def test_vote_deleted_restaurant(self):
+        url = reverse("restaurant:vote-create")
+        get_restaurant_registry().get_ids()
+        restaurant_id = self.restaurant2.uuid
+        # The registry still holds the restaurant until the deletion commits
+        self.restaurant2.delete()
+
+        # Votes for it fail on the foreign key when they commit
+        with mock.patch(
+            "restaurant.views.calculate_vote_weight", side_effect=IntegrityError
+        ):
+            response = self.client.post(url, {"restaurant": restaurant_id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["restaurant"],
+            [f'Invalid pk "{restaurant_id}" - object does not exist.'],
+        )
+        self.assertEqual(get_vote_counter().count(self.user.pk), 0)
+
+        # Bulk votes for it are turned away and the others written again
+        with mock.patch(
+            "restaurant.views.calculate_bulk_vote_weights",
+            side_effect=[IntegrityError, {}],
+        ) as calculate:
+            response = self.client.post(
+                reverse("restaurant:vote-bulk-create"),
+                {
+                    "votes": [
+                        {
+                            "restaurants": [
+                                str(self.restaurant1.uuid),
+                                str(restaurant_id),
+                            ]
+                        }
+                    ]
+                },
+                format="json",
+            )
+        self.assertEqual(
+            [
+                (result["voted"], result["detail"])
+                for result in response.data["results"]
+            ],
+            [(True, "User has successfully voted."), (False, "Restaurant not found.")],
+        )
+        calculate.assert_called_with({(self.user.pk, self.restaurant1.uuid): 1})
+        self.assertEqual(get_vote_counter().count(self.user.pk), 1)
+
+    def test_vote_throttle(self):
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        url = reverse("restaurant:vote-create")
+        data = {"restaurant": self.restaurant1.uuid}
+
+        with self.settings(VOTE_THROTTLE_USER_RATE="2/m"), mock.patch.object(
+            SlidingWindowThrottle, "timer", return_value=6000030
+        ):
+            for _ in range(2):
+                self.assertEqual(client.post(url, data).status_code, status.HTTP_200_OK)
+            with self.assertNumQueries(0):
+                response = client.post(url, data)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            # The previous window is empty, both requests have to become the previous window and slide out of it
+            self.assertEqual(response["Retry-After"], "60")
+            # The session of the same user shares the user's limit
+            self.assertEqual(
+                self.client.post(url, data).status_code,
+                status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+
+        # Half a window later the previous window still counts for one request
+        with self.settings(VOTE_THROTTLE_USER_RATE="2/m"), mock.patch.object(
+            SlidingWindowThrottle, "timer", return_value=6000090
+        ):
+            self.assertEqual(client.post(url, data).status_code, status.HTTP_200_OK)
+            response = client.post(url, data)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response["Retry-After"], "30")
+
+            # A rate of 0 blocks voting until the rate changes
+            with self.settings(VOTE_THROTTLE_USER_RATE="0/m"):
+                response = client.post(url, data)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response["Retry-After"], "30")
+
+        # The token limit leaves the other sessions of its user alone
+        other_user = User.objects.create_user(username="other", password="password")
+        token = Token.objects.create(user=other_user)
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        session_client = APIClient()
+        session_client.login(username="other", password="password")
+        with self.settings(VOTE_THROTTLE_USER_RATE="", VOTE_THROTTLE_TOKEN_RATE="2/m"):
+            for _ in range(2):
+                self.assertEqual(client.post(url, data).status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                client.post(url, data).status_code,
+                status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+            self.assertEqual(
+                session_client.post(url, data).status_code, status.HTTP_200_OK
+            )
+
+    def test_vote_limit_across_restaurants(self):
+        url = reverse("restaurant:vote-create")
+        for i in range(settings.MAX_VOTES_PER_DAY):
+            restaurant = self.restaurant1 if i % 2 else self.restaurant2
+            response = self.client.post(url, {"restaurant": restaurant.uuid})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(url, {"restaurant": self.restaurant1.uuid})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            sum(Vote.objects.values_list("total_votes", flat=True)),
+            settings.MAX_VOTES_PER_DAY,
+        )
+
     def test_restaurant_order_by_rating(self):
         url = reverse("restaurant:order-restaurant-list")
         # Vote for restaurant1 once
@@ -93,6 +283,7 @@ class RestaurantTestCase(APITestCase):
         vote = Vote.objects.create(user=self.user, restaurant=self.restaurant2)
         vote.date = yesterday.date()
         vote.save()
+        call_command("rebuild_daily_ratings", stdout=StringIO())
 
         url = reverse("restaurant:order-restaurant-list")
         # Test with date_to set to yesterday
@@ -141,6 +332,27 @@ class RestaurantTestCase(APITestCase):
             response.data.get("results")[0]["uuid"], str(self.restaurant2.uuid)
         )
 
+        # Test with date_from set to yesterday and date_to set to today
+        response = self.client.get(
+            url,
+            {
+                "date_to": timezone.now().strftime("%Y-%m-%d"),
+                "date_from": yesterday.strftime("%Y-%m-%d"),
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data.get("results")), 2)
+
+        # Test with date_from after date_to
+        response = self.client.get(
+            url,
+            {
+                "date_to": yesterday.strftime("%Y-%m-%d"),
+                "date_from": timezone.now().strftime("%Y-%m-%d"),
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
         # Test with no date constraints
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -151,3 +363,800 @@ class RestaurantTestCase(APITestCase):
         self.assertEqual(
             response.data.get("results")[1]["uuid"], str(self.restaurant2.uuid)
         )
+
+    def test_restaurant_order_by_rating_modes(self):
+        # Restaurant 1 got three votes ten days ago, restaurant 2 one vote today
+        ten_days_ago = timezone.now().date() - timezone.timedelta(days=10)
+        calculate_bulk_vote_weights(
+            {(self.user.pk, self.restaurant1.pk): 3}, date=ten_days_ago
+        )
+        calculate_vote_weight(self.user, self.restaurant2.pk)
+        url = reverse("restaurant:order-restaurant-list")
+
+        def get_ratings(params):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [
+                (restaurant["name"], restaurant["rating"]["total_rating"])
+                for restaurant in response.data["results"]
+            ]
+
+        self.assertEqual(
+            get_ratings({}),
+            [("Restaurant 1", Decimal("1.75")), ("Restaurant 2", Decimal("1"))],
+        )
+        ratings = get_ratings({"mode": "decay", "half_life": 5})
+        self.assertEqual(
+            [name for name, _ in ratings], ["Restaurant 2", "Restaurant 1"]
+        )
+        self.assertAlmostEqual(ratings[0][1], 1)
+        self.assertAlmostEqual(ratings[1][1], 1.75 / 4)
+        self.assertEqual(
+            get_ratings({"mode": "window", "window": 7}),
+            [("Restaurant 2", Decimal("1"))],
+        )
+        self.assertEqual(
+            get_ratings({"mode": "window", "window": 2, "date_to": ten_days_ago}),
+            [("Restaurant 1", Decimal("1.75"))],
+        )
+
+        for params in (
+            {"mode": "window", "date_from": ten_days_ago},
+            {"mode": "decay", "half_life": 0},
+            {"mode": "hot"},
+        ):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_restaurant_order_by_rating_snapshots(self):
+        ten_days_ago = timezone.now().date() - timezone.timedelta(days=10)
+        calculate_bulk_vote_weights(
+            {(self.user.pk, self.restaurant1.pk): 3}, date=ten_days_ago
+        )
+        calculate_vote_weight(self.user, self.restaurant2.pk)
+        url = reverse("restaurant:order-restaurant-list")
+        requests = [
+            {},
+            {"date_from": timezone.now().date()},
+            {"mode": "window", "window": 7},
+            {"mode": "window", "window": 30, "page_size": 1},
+        ]
+        live = [self.client.get(url, params).data for params in requests]
+
+        # The snapshots of the process local cache are only served because the tests run in one process
+        with self.assertRaises(CommandError):
+            call_command("refresh_leaderboards", stdout=StringIO())
+        with mock.patch(
+            "restaurant.management.commands.refresh_leaderboards.is_shared_cache",
+            return_value=True,
+        ):
+            call_command("refresh_leaderboards", stdout=StringIO())
+        # Votes after the snapshot are not seen until it is refreshed
+        calculate_vote_weight(self.user, self.restaurant2.pk)
+        for params, data in zip(requests, live):
+            response = self.client.get(url, params)
+            self.assertEqual(response["X-Cache"], "SNAPSHOT")
+            self.assertEqual(response.data, data)
+
+        # Conditional requests are validated against the snapshot
+        response = self.client.get(
+            url, requests[-1], HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Other ranges and modes are computed live
+        for params in (
+            {"mode": "window", "window": 2},
+            {"mode": "decay"},
+            {"pagination": "cursor"},
+        ):
+            response = self.client.get(url, params)
+            self.assertNotEqual(response["X-Cache"], "SNAPSHOT")
+
+        with self.settings(LEADERBOARD_SNAPSHOT_MAX_AGE=-1):
+            response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"][1]["rating"]["total_votes"], 2)
+
+    def test_restaurant_order_by_rating_query_count(self):
+        for i in range(20):
+            restaurant = Restaurant.objects.create(
+                name=f"Restaurant {i}",
+                description=f"Description {i}",
+                created_by=self.user,
+                updated_by=self.user,
+            )
+            Vote.objects.create(
+                user=self.user, restaurant=restaurant, total_votes=2, total_weight=1.5
+            )
+        call_command("rebuild_daily_ratings", stdout=StringIO())
+
+        url = reverse("restaurant:order-restaurant-list")
+        # Session & user lookup, pagination count and the annotated page itself
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {"page_size": 20})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data.get("results")), 20)
+        self.assertEqual(
+            response.data.get("results")[0]["rating"],
+            {"total_rating": Decimal("1.5"), "total_votes": 2, "voter_days": 1},
+        )
+
+    def test_restaurant_order_by_rating_voter_days(self):
+        yesterday = timezone.now().date() - timezone.timedelta(days=1)
+        other_user = User.objects.create_user(username="other", password="password")
+        for user, date in [
+            (self.user, yesterday),
+            (self.user, timezone.now().date()),
+            (other_user, yesterday),
+        ]:
+            vote = Vote.objects.create(
+                user=user, restaurant=self.restaurant1, total_votes=1, total_weight=1
+            )
+            # The vote date is set on creation
+            Vote.objects.filter(pk=vote.pk).update(date=date)
+        call_command("rebuild_daily_ratings", stdout=StringIO())
+
+        # A user voting on two days counts twice over the range
+        response = self.client.get(reverse("restaurant:order-restaurant-list"))
+        self.assertEqual(response.data["results"][0]["rating"]["voter_days"], 3)
+
+    def test_restaurant_order_by_rating_cache(self):
+        vote_url = reverse("restaurant:vote-create")
+        url = reverse("restaurant:order-restaurant-list")
+        yesterday = (timezone.now() - timezone.timedelta(days=1)).strftime("%Y-%m-%d")
+        self.client.post(vote_url, {"restaurant": self.restaurant1.uuid})
+
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.client.get(url, {"date_to": yesterday})
+
+        # Served from the cache without touching the database, session lookup aside
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(len(response.data.get("results")), 1)
+
+        # A vote only invalidates the ranges that include today
+        self.client.post(vote_url, {"restaurant": self.restaurant2.uuid})
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(len(response.data.get("results")), 2)
+        response = self.client.get(url, {"date_to": yesterday})
+        self.assertEqual(response["X-Cache"], "HIT")
+
+        # Restaurant changes invalidate every range
+        self.restaurant1.name = "Restaurant 1 Updated"
+        self.restaurant1.save()
+        response = self.client.get(url, {"date_to": yesterday})
+        self.assertEqual(response["X-Cache"], "MISS")
+
+        # Every spelling of a page shares its entry, invalid pages are not cached
+        response = self.client.get(url, {"date_to": yesterday, "page": "01"})
+        self.assertEqual(response["X-Cache"], "HIT")
+        response = self.client.get(url, {"date_to": yesterday, "page_size": 500})
+        self.assertEqual(response["X-Cache"], "MISS")
+        response = self.client.get(url, {"date_to": yesterday, "page_size": 100})
+        self.assertEqual(response["X-Cache"], "HIT")
+        response = self.client.get(url, {"page": "1.0"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn("X-Cache", response)
+
+        response = self.client.get(
+            reverse("restaurant:order-restaurant-list-cache-stats")
+        )
+        self.assertEqual(response.data, {"hits": 4, "misses": 5})
+
+    def test_list_restaurants_cursor_pagination(self):
+        for i in range(3, 8):
+            Restaurant.objects.create(name=f"Restaurant {i}", description="")
+
+        url = reverse("restaurant:restaurant-list-create")
+        response = self.client.get(url, {"pagination": "cursor", "page_size": 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 7)
+        names = [restaurant["name"] for restaurant in response.data["results"]]
+
+        response = self.client.get(response.data["next"] + "&count=false")
+        self.assertNotIn("count", response.data)
+        names += [restaurant["name"] for restaurant in response.data["results"]]
+        response = self.client.get(response.data["next"])
+        names += [restaurant["name"] for restaurant in response.data["results"]]
+
+        self.assertIsNone(response.data["next"])
+        self.assertEqual(names, [f"Restaurant {i}" for i in range(1, 8)])
+
+        response = self.client.get(url, {"pagination": "cursor", "cursor": "invalid"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_and_retrieve_match_serializer(self):
+        self.user.first_name = "Test"
+        self.user.email = "test@example.com"
+        self.user.save()
+        self.client.post(
+            reverse("restaurant:restaurant-list-create"),
+            {"name": "Restaurant 3", "description": "Description 3"},
+        )
+        restaurants = Restaurant.objects.order_by("created_at", "uuid")
+        expected = RestaurantSerializer(restaurants, many=True).data
+
+        url = reverse("restaurant:restaurant-list-create")
+        with self.assertNumQueries(5):
+            # The session and its user, the ETag, then the count and the page, users included
+            response = self.client.get(url)
+        self.assertEqual(
+            response.content,
+            JSONRenderer().render(
+                {"count": 3, "next": None, "previous": None, "results": expected}
+            ),
+        )
+        response = self.client.get(url, {"pagination": "cursor", "page_size": 2})
+        next_page = self.client.get(response.data["next"])
+        self.assertEqual(
+            JSONRenderer().render(response.data["results"] + next_page.data["results"]),
+            JSONRenderer().render(expected),
+        )
+
+        for restaurant, data in zip(restaurants, expected):
+            response = self.client.get(
+                reverse(
+                    "restaurant:restaurant-retrieve-update-destroy",
+                    kwargs={"pk": restaurant.uuid},
+                )
+            )
+            self.assertEqual(response.content, JSONRenderer().render(data))
+        response = self.client.get(
+            reverse(
+                "restaurant:restaurant-retrieve-update-destroy",
+                kwargs={"pk": uuid.uuid4()},
+            )
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_conditional_get_restaurants(self):
+        url = reverse("restaurant:restaurant-list-create")
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+        self.restaurant1.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+        url = reverse(
+            "restaurant:restaurant-retrieve-update-destroy",
+            kwargs={"pk": self.restaurant2.uuid},
+        )
+        last_modified = self.client.get(url)["Last-Modified"]
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Restaurant.objects.filter(pk=self.restaurant2.pk).update(
+            updated_at=timezone.now() + timezone.timedelta(seconds=1)
+        )
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_conditional_get_order_by_ratings(self):
+        url = reverse("restaurant:order-restaurant-list")
+        calculate_vote_weight(self.user, self.restaurant1.pk)
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(2):
+            # Only the session and its user, the leaderboard is not computed
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn("Last-Modified", response)
+
+        calculate_vote_weight(self.user, self.restaurant2.pk)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 2)
+
+        # Past ranges do not change with today's votes
+        yesterday = timezone.now().date() - timezone.timedelta(days=1)
+        etag = self.client.get(url, {"date_to": yesterday})["ETag"]
+        calculate_vote_weight(self.user, self.restaurant2.pk)
+        response = self.client.get(url, {"date_to": yesterday}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.restaurant1.save()
+        response = self.client.get(url, {"date_to": yesterday}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_restaurant_order_by_rating_cursor_pagination(self):
+        restaurants = [self.restaurant1, self.restaurant2]
+        for i in range(3, 8):
+            restaurants.append(
+                Restaurant.objects.create(name=f"Restaurant {i}", description="")
+            )
+        # Restaurants 1-3 and 4-7 tie on their rating, the uuid breaks the ties
+        for i, restaurant in enumerate(restaurants):
+            Vote.objects.create(
+                user=self.user,
+                restaurant=restaurant,
+                total_votes=1,
+                total_weight=1 if i < 3 else 2,
+            )
+        call_command("rebuild_daily_ratings", stdout=StringIO())
+
+        url = reverse("restaurant:order-restaurant-list")
+        expected = [
+            restaurant["uuid"]
+            for restaurant in self.client.get(url).data.get("results")
+        ]
+        uuids = []
+        response = self.client.get(url, {"pagination": "cursor", "page_size": 2})
+        while True:
+            uuids += [restaurant["uuid"] for restaurant in response.data["results"]]
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+
+        self.assertEqual(len(uuids), 7)
+        self.assertEqual(uuids, expected)
+
+        # Tampered cursors are turned away like the ones that do not decode, without reaching the cache keys
+        for position in [
+            ["abc", "x", "y"],
+            [None, None, None],
+            ["1.00", "1", "not a uuid"],
+            [["1"], "1", str(self.restaurant1.uuid)],
+        ]:
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", CacheKeyWarning)
+                response = self.client.get(
+                    url, {"pagination": "cursor", "cursor": cursor}
+                )
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bench_api(self):
+        Vote.objects.create(
+            user=self.user, restaurant=self.restaurant1, total_votes=1, total_weight=1
+        )
+        stdout = StringIO()
+        call_command("bench_api", requests=5, concurrency=1, seed=1, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+
+        self.assertEqual(
+            set(report["endpoints"]), {"vote", "order_by_ratings", "list", "retrieve"}
+        )
+        for endpoint in report["endpoints"].values():
+            self.assertEqual(endpoint["requests"], 5)
+            self.assertIn("p99", endpoint["latency_ms"])
+            self.assertGreater(endpoint["queries_per_request"]["mean"], 0)
+
+    def test_bulk_vote(self):
+        other_user = User.objects.create_user(username="otheruser", password="password")
+        url = reverse("restaurant:vote-bulk-create")
+        data = {
+            "votes": [
+                {"restaurant": str(self.restaurant1.uuid)},
+                {
+                    "restaurants": [
+                        str(self.restaurant1.uuid),
+                        str(self.restaurant2.uuid),
+                    ]
+                },
+                {"restaurant": "00000000-0000-0000-0000-000000000000"},
+                {"user": other_user.pk, "restaurant": str(self.restaurant1.uuid)},
+                {"restaurant": str(self.restaurant2.uuid)},
+            ]
+        }
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result["voted"] for result in response.data["results"]],
+            [True, True, True, False, False, False],
+        )
+        self.assertEqual(
+            response.data["results"][-1]["detail"],
+            "You have reached your daily voting limit.",
+        )
+
+        vote1 = Vote.objects.get(user=self.user, restaurant=self.restaurant1)
+        self.assertEqual(vote1.total_votes, 2)
+        self.assertEqual(vote1.total_weight, Decimal("1.5"))
+        vote2 = Vote.objects.get(user=self.user, restaurant=self.restaurant2)
+        self.assertEqual(vote2.total_votes, 1)
+        self.assertFalse(Vote.objects.filter(user=other_user).exists())
+
+        response = self.client.get(reverse("restaurant:order-restaurant-list"))
+        self.assertEqual(
+            response.data.get("results")[0]["rating"],
+            {"total_rating": Decimal("1.5"), "total_votes": 2, "voter_days": 1},
+        )
+
+    def test_bulk_vote_on_behalf_of_users(self):
+        self.user.is_staff = True
+        self.user.save()
+        other_user = User.objects.create_user(username="otheruser", password="password")
+        calculate_vote_weight(other_user, self.restaurant2.pk)
+
+        url = reverse("restaurant:vote-bulk-create")
+        data = {
+            "votes": [
+                {
+                    "user": other_user.pk,
+                    "restaurants": [str(self.restaurant2.uuid)] * 2,
+                },
+                {"user": 0, "restaurant": str(self.restaurant1.uuid)},
+            ]
+        }
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(
+            [result["voted"] for result in response.data["results"]],
+            [True, True, False],
+        )
+
+        vote = Vote.objects.get(user=other_user, restaurant=self.restaurant2)
+        self.assertEqual(vote.total_votes, 3)
+        self.assertEqual(vote.total_weight, Decimal("1.75"))
+
+    def test_metrics(self):
+        registry.reset()
+        self.client.post(
+            reverse("restaurant:vote-create"), {"restaurant": self.restaurant1.uuid}
+        )
+        with self.settings(METRICS_SLOW_REQUEST_MS=0):
+            with self.assertLogs("convious.metrics", level="WARNING") as logs:
+                self.client.get(reverse("restaurant:order-restaurant-list"))
+        self.assertIn("RestaurantViewSet.order_by_ratings", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        metrics = response.content.decode()
+        self.assertIn(
+            'http_requests_total{view="VoteViewSet.post",status="200"} 1', metrics
+        )
+        self.assertIn(
+            'http_request_duration_seconds_count{view="RestaurantViewSet.order_by_ratings"} 1',
+            metrics,
+        )
+        self.assertIn('db_queries_bucket{view="VoteViewSet.post",le="+Inf"} 1', metrics)
+        self.assertIn(
+            'render_duration_seconds_count{view="VoteViewSet.post"} 1', metrics
+        )
+        self.assertIn("leaderboard_cache_misses 1", metrics)
+
+        # Only staff users and the allowed networks can read them
+        self.client.logout()
+        response = self.client.get(reverse("metrics"), REMOTE_ADDR="203.0.113.7")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        with self.settings(METRICS_ALLOWED_NETWORKS=["203.0.113.0/24"]):
+            response = self.client.get(reverse("metrics"), REMOTE_ADDR="203.0.113.7")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        User.objects.create_user(username="staff", password="password", is_staff=True)
+        self.client.login(username="staff", password="password")
+        response = self.client.get(reverse("metrics"), REMOTE_ADDR="203.0.113.7")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_token_authentication_cache(self):
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        url = reverse("restaurant:order-restaurant-list")
+        client.get(url)
+
+        # Both the user and the leaderboard come from the cache
+        with self.assertNumQueries(0):
+            response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # The password hash stays out of the cache, saving the cached user keeps it
+        with self.assertNumQueries(0):
+            user, cached_token = CachedTokenAuthentication().authenticate_credentials(
+                token.key
+            )
+        self.assertEqual((user.pk, user.username), (self.user.pk, "testuser"))
+        self.assertEqual(cached_token.key, token.key)
+        self.assertIn("password", user.get_deferred_fields())
+        user.save()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("testpassword"))
+
+        self.user.is_active = False
+        self.user.save()
+        response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_active = True
+        self.user.save()
+        client.get(url)
+        token.delete()
+        response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_basic_authentication_cache(self):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION="Basic "
+            + base64.b64encode(b"testuser:testpassword").decode()
+        )
+        url = reverse("restaurant:order-restaurant-list")
+        client.get(url)
+
+        with mock.patch.object(
+            User, "check_password", side_effect=AssertionError
+        ), self.assertNumQueries(0):
+            response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Wrong passwords are never cached
+        client.credentials(
+            HTTP_AUTHORIZATION="Basic " + base64.b64encode(b"testuser:wrong").decode()
+        )
+        self.assertEqual(client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.set_password("newpassword")
+        self.user.save()
+        client.credentials(
+            HTTP_AUTHORIZATION="Basic "
+            + base64.b64encode(b"testuser:testpassword").decode()
+        )
+        response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_order_by_ratings_from_index(self):
+        calculate_vote_weight(self.user, self.restaurant1.pk)
+        calculate_vote_weight(self.user, self.restaurant2.pk)
+        calculate_vote_weight(self.user, self.restaurant2.pk)
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        url = reverse("restaurant:order-restaurant-list")
+
+        with self.settings(LEADERBOARD_CACHE_ENABLED=False):
+            expected = client.get(url, {"page_size": 1, "page": 2})
+            with self.settings(
+                LEADERBOARD_INDEX_BACKEND="restaurant.leaderboard.InMemoryLeaderboardIndex"
+            ):
+                self.addCleanup(get_leaderboard_index().reset)
+                client.get(url)
+                # Only the restaurants of the page are read from the database
+                with self.assertNumQueries(1):
+                    response = client.get(url, {"page_size": 1, "page": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(response.json()["count"], 2)
+
+    def test_vote_async(self):
+        vote_buffer = VoteBuffer(autostart=False)
+        url = reverse("restaurant:vote-create")
+        with self.settings(VOTE_WRITE_MODE="async"), mock.patch(
+            "restaurant.views.get_vote_buffer", return_value=vote_buffer
+        ):
+            for i in range(settings.MAX_VOTES_PER_DAY):
+                response = self.client.post(url, {"restaurant": self.restaurant1.uuid})
+                self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            # The slots are reserved as soon as the votes are queued
+            response = self.client.post(url, {"restaurant": self.restaurant1.uuid})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertFalse(Vote.objects.exists())
+        vote_buffer.drain()
+        vote = Vote.objects.get(user=self.user, restaurant=self.restaurant1)
+        self.assertEqual(vote.total_votes, settings.MAX_VOTES_PER_DAY)
+
+    def test_export_ratings(self):
+        calculate_vote_weight(self.user, self.restaurant1.pk)
+        calculate_vote_weight(self.user, self.restaurant2.pk)
+        calculate_vote_weight(self.user, self.restaurant2.pk)
+
+        with self.settings(EXPORT_CHUNK_SIZE=1):
+            response = self.client.get(reverse("restaurant:export-ratings"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        rows = csv.DictReader(
+            io.StringIO(b"".join(response.streaming_content).decode())
+        )
+        self.assertEqual(
+            [
+                (
+                    row["rank"],
+                    row["restaurant"],
+                    row["name"],
+                    Decimal(row["total_rating"]),
+                )
+                for row in rows
+            ],
+            [
+                ("1", str(self.restaurant2.uuid), "Restaurant 2", Decimal("1.5")),
+                ("2", str(self.restaurant1.uuid), "Restaurant 1", Decimal("1")),
+            ],
+        )
+
+        # Gzipped NDJSON of a range without votes
+        yesterday = timezone.now().date() - timezone.timedelta(days=1)
+        response = self.client.get(
+            reverse("restaurant:export-ratings"),
+            {"output": "ndjson", "date_to": yesterday},
+            HTTP_ACCEPT_ENCODING="gzip, deflate",
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), b"")
+
+        response = self.client.get(
+            reverse("restaurant:export-ratings"), {"output": "xml"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_escapes_formulas(self):
+        self.restaurant1.name = '=HYPERLINK("http://example.com", "Menu")'
+        self.restaurant1.save()
+        calculate_vote_weight(self.user, self.restaurant1.pk)
+
+        response = self.client.get(reverse("restaurant:export-ratings"))
+        rows = csv.DictReader(
+            io.StringIO(b"".join(response.streaming_content).decode())
+        )
+        self.assertEqual([row["name"] for row in rows], ["'" + self.restaurant1.name])
+
+        # Only spreadsheets evaluate formulas, NDJSON keeps the name as is
+        response = self.client.get(
+            reverse("restaurant:export-ratings"), {"output": "ndjson"}
+        )
+        row = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(row["name"], self.restaurant1.name)
+
+    def test_export_votes(self):
+        calculate_vote_weight(self.user, self.restaurant1.pk)
+        calculate_vote_weight(self.user, self.restaurant1.pk)
+        url = reverse("restaurant:export-votes")
+        response = self.client.get(url, {"output": "ndjson"})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(
+            url, {"output": "ndjson"}, HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="votes.ndjson"'
+        )
+        lines = gzip.decompress(b"".join(response.streaming_content)).splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [
+                {
+                    "date": timezone.now().date().isoformat(),
+                    "restaurant": str(self.restaurant1.uuid),
+                    "user": self.user.pk,
+                    "total_votes": 2,
+                    "total_weight": "1.50",
+                }
+            ],
+        )
+
+
+class AsyncViewTests(APITransactionTestCase):
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("The async views query the database from other threads")
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.restaurant1 = Restaurant.objects.create(name="Restaurant 1")
+        self.restaurant2 = Restaurant.objects.create(name="Restaurant 2")
+        self.factory = AsyncRequestFactory()
+
+    def vote(self, restaurant_id, **extra):
+        request = self.factory.post(
+            reverse("restaurant:vote-create"),
+            {"restaurant": str(restaurant_id)},
+            content_type="application/json",
+            **extra,
+        )
+        return async_to_sync(async_views.vote)(request)
+
+    def test_vote(self):
+        for i in range(settings.MAX_VOTES_PER_DAY):
+            response = self.vote(
+                self.restaurant1.uuid, authorization=f"Token {self.token.key}"
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                json.loads(response.content), "User has successfully voted."
+            )
+
+        response = self.vote(
+            self.restaurant1.uuid, authorization=f"Token {self.token.key}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        vote = Vote.objects.get(user=self.user, restaurant=self.restaurant1)
+        self.assertEqual(vote.total_votes, settings.MAX_VOTES_PER_DAY)
+
+    def test_vote_errors(self):
+        response = self.vote(self.restaurant1.uuid)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.vote(self.restaurant1.uuid, authorization="Token invalid")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        request = self.factory.get(
+            reverse("restaurant:vote-create"), authorization=f"Token {self.token.key}"
+        )
+        response = async_to_sync(async_views.vote)(request)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        response = self.vote(
+            "00000000-0000-0000-0000-000000000000",
+            authorization=f"Token {self.token.key}",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("restaurant", json.loads(response.content))
+
+    def test_order_by_ratings_matches_sync_view(self):
+        calculate_vote_weight(self.user, self.restaurant2.pk)
+        url = reverse("restaurant:order-restaurant-list")
+        params = {"date_from": timezone.now().date()}
+
+        with self.settings(LEADERBOARD_CACHE_ENABLED=False):
+            expected = self.client.get(url, params)
+            request = self.factory.get(
+                url, params, authorization=f"Token {self.token.key}"
+            )
+            response = async_to_sync(async_views.order_by_ratings)(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response["Content-Type"], expected["Content-Type"])
+
+        request = self.factory.get(url, {"date_to": "not a date"})
+        response = async_to_sync(async_views.order_by_ratings)(request)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_metrics_under_asgi(self):
+        registry.reset()
+
+        async def get():
+            return await AsyncClient().get(
+                reverse("restaurant:order-restaurant-list"),
+                authorization=f"Token {self.token.key}",
+            )
+
+        response = async_to_sync(get)()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        metrics = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn(
+            'http_requests_total{view="RestaurantViewSet.order_by_ratings",status="200"} 1',
+            metrics,
+        )
+        # The queries ran in another thread than the middleware
+        self.assertNotIn(
+            'db_queries_sum{view="RestaurantViewSet.order_by_ratings"} 0', metrics
+        )
+
+    def test_bench_api_asgi(self):
+        Vote.objects.create(
+            user=self.user, restaurant=self.restaurant1, total_votes=1, total_weight=1
+        )
+        stdout = StringIO()
+        call_command(
+            "bench_api",
+            endpoints=["vote", "order_by_ratings"],
+            interface="asgi",
+            requests=4,
+            concurrency=2,
+            seed=1,
+            stdout=stdout,
+        )
+        report = json.loads(stdout.getvalue())
+
+        self.assertEqual(report["config"]["interface"], "asgi")
+        for endpoint in report["endpoints"].values():
+            self.assertEqual(endpoint["requests"], 4)
+            self.assertIn("p99", endpoint["latency_ms"])
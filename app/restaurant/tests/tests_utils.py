@@ -1,21 +1,80 @@
 import os
+import tempfile
+import time
+from datetime import date, timedelta
 from decimal import Decimal
-from django.test import TestCase
+from importlib import import_module
+from io import StringIO
+from threading import Thread
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import (
+    DatabaseError,
+    IntegrityError,
+    OperationalError,
+    connection,
+    connections,
+)
+from django.db.models import Sum
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
 
 from convious import settings
-from restaurant.models import Restaurant, Vote
+from convious.middleware import ReplicaPinningMiddleware
+from convious.postgresql.pool import ConnectionPool, PoolTimeout
+from convious.routers import PrimaryPin, PrimaryReplicaRouter, current_pin
+from restaurant.buffer import VoteBuffer
+from restaurant.checks import (
+    check_replica_pin_cache,
+    check_restaurant_registry_cache,
+    check_vote_counter_cache,
+    check_vote_throttle_rates,
+)
+from restaurant.counters import CacheVoteCounter, VoteCounter, get_vote_counter
+from restaurant.leaderboard import (
+    LeaderboardIndex,
+    get_leaderboard_index,
+    load_leaderboard_index,
+)
+from restaurant.models import ArchivedVoteMonth, Restaurant, RestaurantDailyRating, Vote
+from restaurant.partitions import (
+    add_months,
+    create_vote_partition,
+    get_default_partition_months,
+    get_partition_name,
+    get_vote_partitions,
+    is_vote_table_partitioned,
+    month_start,
+)
+from restaurant.seed import generate_dataset
 from restaurant.utils import (
-    check_has_user_reached_max_vote_limit,
-    calculate_vote_weight,
+    calculate_bulk_vote_weights,
     calculate_restaurant_rating,
+    calculate_vote_weight,
+    check_has_user_reached_max_vote_limit,
+    get_restaurants_ordered_by_rating,
+    rebuild_daily_ratings,
 )
-from django.contrib.auth.models import User
+from restaurant.weights import WeightPolicy, get_weight_policy
 
 
 class UtilityTests(TestCase):
     def setUp(self):
         os.environ["MAX_VOTES_PER_DAY"] = "5"
+        cache.clear()
         self.user1 = User.objects.create_user(username="user1", password="password")
         self.user2 = User.objects.create_user(username="user2", password="password")
         self.restaurant1 = Restaurant.objects.create(name="Restaurant 1")
@@ -45,22 +104,177 @@ class UtilityTests(TestCase):
         )
         self.assertFalse(check_has_user_reached_max_vote_limit(self.user2))
 
+    def test_check_has_user_reached_max_vote_limit_across_restaurants(self):
+        Vote.objects.create(
+            user=self.user1,
+            restaurant=self.restaurant1,
+            total_votes=settings.MAX_VOTES_PER_DAY - 1,
+            total_weight=1,
+        )
+        self.assertFalse(check_has_user_reached_max_vote_limit(self.user1))
+
+        Vote.objects.create(
+            user=self.user1, restaurant=self.restaurant2, total_votes=1, total_weight=1
+        )
+        self.assertTrue(check_has_user_reached_max_vote_limit(self.user1))
+
+    def test_vote_counter_reserve(self):
+        vote_counter = CacheVoteCounter()
+        Vote.objects.create(
+            user=self.user1, restaurant=self.restaurant1, total_votes=1, total_weight=1
+        )
+
+        # The first reservation seeds the counter from the database
+        self.assertTrue(vote_counter.reserve(self.user1.pk))
+        self.assertEqual(vote_counter.count(self.user1.pk), 2)
+
+        with self.assertNumQueries(0):
+            for _ in range(settings.MAX_VOTES_PER_DAY - 2):
+                self.assertTrue(vote_counter.reserve(self.user1.pk))
+            self.assertFalse(vote_counter.reserve(self.user1.pk))
+            self.assertEqual(
+                vote_counter.count(self.user1.pk), settings.MAX_VOTES_PER_DAY
+            )
+
+            vote_counter.release(self.user1.pk)
+            self.assertTrue(vote_counter.reserve(self.user1.pk))
+
+        # Rebuilding takes the database as the source of truth
+        self.assertEqual(vote_counter.rebuild(self.user1.pk), 1)
+        self.assertEqual(vote_counter.count(self.user2.pk), 0)
+
+        class IncompleteVoteCounter(VoteCounter):
+            def count(self, user_id, date=None):
+                return 0
+
+        with self.assertRaises(TypeError):
+            IncompleteVoteCounter()
+
+    def test_vote_counter_cache_check(self):
+        self.assertEqual(
+            [warning.id for warning in check_vote_counter_cache(None)],
+            ["restaurant.W001"],
+        )
+        shared_caches = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "shared": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": tempfile.mkdtemp(),
+            },
+        }
+        with override_settings(CACHES=shared_caches, VOTE_COUNTER_CACHE="shared"):
+            self.assertEqual(check_vote_counter_cache(None), [])
+
+    def test_restaurant_registry_cache_check(self):
+        self.assertEqual(
+            [warning.id for warning in check_restaurant_registry_cache(None)],
+            ["restaurant.W003"],
+        )
+        shared_caches = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "shared": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": tempfile.mkdtemp(),
+            },
+        }
+        with override_settings(CACHES=shared_caches, LEADERBOARD_CACHE="shared"):
+            self.assertEqual(check_restaurant_registry_cache(None), [])
+
+    def test_vote_throttle_rates_check(self):
+        self.assertEqual(check_vote_throttle_rates(None), [])
+        with self.settings(
+            VOTE_THROTTLE_USER_RATE="30/w", VOTE_THROTTLE_TOKEN_RATE="x"
+        ):
+            self.assertEqual(
+                [error.id for error in check_vote_throttle_rates(None)],
+                ["restaurant.E001", "restaurant.E001"],
+            )
+
     def test_calculate_vote_weight(self):
         # Test for the first vote
-        vote1 = calculate_vote_weight(self.user1, self.restaurant1)
+        vote1 = calculate_vote_weight(self.user1, self.restaurant1.pk)
         self.assertEqual(vote1.total_votes, 1)
         self.assertEqual(vote1.total_weight, Decimal("1"))
 
         # Test for the second vote
-        vote2 = calculate_vote_weight(self.user1, self.restaurant1)
+        vote2 = calculate_vote_weight(self.user1, self.restaurant1.pk)
         self.assertEqual(vote2.total_votes, 2)
         self.assertEqual(vote2.total_weight, Decimal("1.5"))
 
         # Test for the third vote
-        vote3 = calculate_vote_weight(self.user1, self.restaurant1)
+        vote3 = calculate_vote_weight(self.user1, self.restaurant1.pk)
         self.assertEqual(vote3.total_votes, 3)
         self.assertEqual(vote3.total_weight, Decimal("1.75"))
 
+    def test_weight_policy(self):
+        policy = get_weight_policy()
+        self.assertEqual(policy.version, settings.VOTE_WEIGHT_VERSION)
+        self.assertEqual(
+            policy.cumulative_weights[:4],
+            [Decimal("0"), Decimal("1"), Decimal("1.5"), Decimal("1.75")],
+        )
+        # Past the table every vote weighs like the last weight
+        self.assertEqual(
+            policy.get_total_weight(policy.table_size + 2),
+            Decimal("1.75") + Decimal("0.25") * (policy.table_size - 1),
+        )
+        self.assertEqual(policy.get_added_weight(1, 2), Decimal("0.75"))
+
+        with self.settings(VOTE_WEIGHTS=["1", "0.125"]):
+            self.assertEqual(get_weight_policy().weights, [1, Decimal("0.125")])
+            with self.assertRaises(ImproperlyConfigured):
+                get_weight_policy().cumulative_weights
+
+        with self.assertRaises(TypeError):
+            WeightPolicy(version="1", table_size=1)
+
+    def test_calculate_vote_weight_with_custom_weights(self):
+        with self.settings(VOTE_WEIGHTS=["2", "1"], VOTE_WEIGHT_VERSION="2"):
+            totals = [
+                calculate_vote_weight(self.user1, self.restaurant1.pk).total_weight
+                for _ in range(settings.MAX_VOTES_PER_DAY + 2)
+            ]
+            calculate_bulk_vote_weights({(self.user2.pk, self.restaurant1.pk): 4})
+
+        expected = [Decimal(2 + number) for number in range(len(totals))]
+        self.assertEqual(totals, expected)
+        self.assertEqual(Vote.objects.get(user=self.user2).total_weight, Decimal("5"))
+        # Votes keep the version of the policy they were written with
+        self.assertEqual(
+            set(Vote.objects.values_list("weight_version", flat=True)), {"2"}
+        )
+        daily_rating = RestaurantDailyRating.objects.get(restaurant=self.restaurant1)
+        self.assertEqual(daily_rating.total_weight, expected[-1] + Decimal("5"))
+
+    def test_reweight_votes(self):
+        yesterday = timezone.now().date() - timezone.timedelta(days=1)
+        for _ in range(3):
+            calculate_vote_weight(self.user1, self.restaurant1.pk)
+        calculate_bulk_vote_weights(
+            {(self.user2.pk, self.restaurant2.pk): 2}, date=yesterday
+        )
+
+        with self.settings(VOTE_WEIGHTS=["2", "1"], VOTE_WEIGHT_VERSION="2"):
+            call_command("reweight_votes", date_to=yesterday, stdout=StringIO())
+
+        # Only yesterday's votes are reweighted, along with their rollup
+        self.assertEqual(
+            Vote.objects.get(user=self.user1).total_weight, Decimal("1.75")
+        )
+        self.assertEqual(Vote.objects.get(user=self.user2).total_weight, Decimal("3"))
+        self.assertEqual(
+            dict(Vote.objects.values_list("user", "weight_version")),
+            {self.user1.pk: "1", self.user2.pk: "2"},
+        )
+        self.assertEqual(
+            RestaurantDailyRating.objects.get(restaurant=self.restaurant2).total_weight,
+            Decimal("3"),
+        )
+        self.assertEqual(
+            RestaurantDailyRating.objects.get(restaurant=self.restaurant1).total_weight,
+            Decimal("1.75"),
+        )
+
     def test_calculate_restaurant_rating(self):
         # Create some votes
         Vote.objects.create(
@@ -91,3 +305,687 @@ class UtilityTests(TestCase):
         self.assertEqual(rating2["total_rating"], Decimal("3.25"))
         self.assertEqual(rating2["total_votes"], 5)
         self.assertEqual(rating2["unique_voters"], 2)
+
+    def test_calculate_vote_weight_updates_daily_rating(self):
+        calculate_vote_weight(self.user1, self.restaurant1.pk)
+        calculate_vote_weight(self.user1, self.restaurant1.pk)
+        calculate_vote_weight(self.user2, self.restaurant1.pk)
+
+        daily_rating = RestaurantDailyRating.objects.get(restaurant=self.restaurant1)
+        self.assertEqual(daily_rating.date, timezone.now().date())
+        self.assertEqual(daily_rating.total_weight, Decimal("2.5"))
+        self.assertEqual(daily_rating.total_votes, 3)
+        self.assertEqual(daily_rating.voter_count, 2)
+
+    def test_rebuild_daily_ratings(self):
+        yesterday = timezone.now().date() - timezone.timedelta(days=1)
+        for user in (self.user1, self.user2):
+            Vote.objects.create(
+                user=user,
+                restaurant=self.restaurant1,
+                total_votes=3,
+                total_weight=1.75,
+            )
+        # Date is auto_now_add, so move the votes to yesterday afterwards
+        Vote.objects.update(date=yesterday)
+        calculate_vote_weight(self.user1, self.restaurant2.pk)
+
+        # Only yesterday is rebuilt, today's incrementally maintained row is kept
+        self.assertEqual(rebuild_daily_ratings(date_to=yesterday), 1)
+        self.assertEqual(RestaurantDailyRating.objects.count(), 2)
+
+        daily_rating = RestaurantDailyRating.objects.get(
+            restaurant=self.restaurant1, date=yesterday
+        )
+        self.assertEqual(daily_rating.total_weight, Decimal("3.5"))
+        self.assertEqual(daily_rating.total_votes, 6)
+        self.assertEqual(daily_rating.voter_count, 2)
+
+    def test_backfill_daily_ratings_migration(self):
+        for user in (self.user1, self.user2):
+            Vote.objects.create(
+                user=user,
+                restaurant=self.restaurant1,
+                total_votes=3,
+                total_weight=1.75,
+            )
+        migration = import_module("restaurant.migrations.0005_backfill_daily_ratings")
+        # Only the connection of the schema editor is used
+        migration.backfill_daily_ratings(apps, mock.Mock(connection=connection))
+
+        daily_rating = RestaurantDailyRating.objects.get()
+        self.assertEqual(daily_rating.total_weight, Decimal("3.5"))
+        self.assertEqual(daily_rating.total_votes, 6)
+        self.assertEqual(daily_rating.voter_count, 2)
+
+    def test_generate_dataset(self):
+        stats = generate_dataset(users=10, restaurants=5, days=3, activity=1, seed=1)
+
+        self.assertEqual(stats["users"], 10)
+        self.assertEqual(stats["restaurants"], 5)
+        self.assertEqual(stats["votes"], Vote.objects.count())
+        self.assertEqual(
+            len(set(Vote.objects.values_list("date", flat=True).distinct())), 3
+        )
+        # The votes keep their dates without turning off auto_now_add
+        self.assertTrue(Vote._meta.get_field("date").auto_now_add)
+        for vote in Vote.objects.all():
+            self.assertEqual(
+                vote.total_weight,
+                Decimal("1")
+                + Decimal("0.5") * (vote.total_votes > 1)
+                + Decimal("0.25") * max(vote.total_votes - 2, 0),
+            )
+        # Every user voted every day, within their daily limit
+        for row in Vote.objects.values("user", "date").annotate(
+            votes=Sum("total_votes")
+        ):
+            self.assertTrue(1 <= row["votes"] <= settings.MAX_VOTES_PER_DAY)
+
+
+class VoteBufferTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username="user1", password="password")
+        self.user2 = User.objects.create_user(username="user2", password="password")
+        self.restaurant1 = Restaurant.objects.create(name="Restaurant 1")
+        self.restaurant2 = Restaurant.objects.create(name="Restaurant 2")
+
+    def test_drain_folds_repeated_votes(self):
+        calculate_vote_weight(self.user1, self.restaurant1.pk)
+        vote_buffer = VoteBuffer(autostart=False)
+        for user, restaurant in [
+            (self.user1, self.restaurant1),
+            (self.user1, self.restaurant1),
+            (self.user1, self.restaurant2),
+            (self.user2, self.restaurant1),
+        ]:
+            vote_buffer.put(user.pk, restaurant.pk)
+
+        with mock.patch(
+            "restaurant.buffer.calculate_bulk_vote_weights",
+            wraps=calculate_bulk_vote_weights,
+        ) as bulk:
+            vote_buffer.drain()
+        bulk.assert_called_once()
+
+        vote = Vote.objects.get(user=self.user1, restaurant=self.restaurant1)
+        self.assertEqual(vote.total_votes, 3)
+        self.assertEqual(vote.total_weight, Decimal("1.75"))
+        self.assertEqual(Vote.objects.count(), 3)
+        daily_rating = RestaurantDailyRating.objects.get(restaurant=self.restaurant1)
+        self.assertEqual(daily_rating.total_weight, Decimal("2.75"))
+        self.assertEqual(daily_rating.voter_count, 2)
+
+    def test_spool_and_restore(self):
+        spool_path = os.path.join(tempfile.mkdtemp(), "votes.spool")
+        vote_buffer = VoteBuffer(spool_path=spool_path, autostart=False)
+        vote_buffer.put(self.user1.pk, self.restaurant1.pk)
+        vote_buffer.put(self.user1.pk, self.restaurant1.pk)
+
+        with mock.patch(
+            "restaurant.buffer.calculate_bulk_vote_weights",
+            side_effect=DatabaseError,
+        ), self.assertLogs("restaurant.buffer"):
+            vote_buffer.drain()
+        self.assertFalse(Vote.objects.exists())
+        self.assertTrue(os.path.exists(spool_path))
+
+        # The next process picks the spooled votes up
+        vote_buffer = VoteBuffer(spool_path=spool_path, autostart=False)
+        self.assertFalse(os.path.exists(spool_path))
+        vote_buffer.drain()
+        vote = Vote.objects.get(user=self.user1, restaurant=self.restaurant1)
+        self.assertEqual(vote.total_votes, 2)
+
+        # A process losing the race for the spool to another one starts empty
+        open(spool_path, "w").close()
+        with mock.patch("restaurant.buffer.os.replace", side_effect=FileNotFoundError):
+            vote_buffer = VoteBuffer(spool_path=spool_path, autostart=False)
+        self.assertTrue(vote_buffer.queue.empty())
+
+    def test_flush_drops_failing_votes(self):
+        dead_letter_path = os.path.join(tempfile.mkdtemp(), "votes.failed")
+        vote_buffer = VoteBuffer(
+            dead_letter_path=dead_letter_path, max_attempts=2, autostart=False
+        )
+        vote_counter = get_vote_counter()
+        vote_counter.reserve(self.user2.pk)
+        vote_buffer.put(self.user1.pk, self.restaurant1.pk)
+        vote_buffer.put(self.user2.pk, self.restaurant2.pk)
+
+        def write_votes(vote_counts, date=None):
+            # Like votes for a restaurant deleted after they were queued
+            if any(key[1] == self.restaurant2.pk for key in vote_counts):
+                raise IntegrityError
+            return calculate_bulk_vote_weights(vote_counts, date=date)
+
+        with mock.patch(
+            "restaurant.buffer.calculate_bulk_vote_weights", side_effect=write_votes
+        ), self.assertLogs("restaurant.buffer"):
+            # The failing vote does not hold back the other one of the day
+            self.assertFalse(vote_buffer.flush(vote_buffer.collect()))
+            self.assertTrue(Vote.objects.filter(user=self.user1).exists())
+            self.assertTrue(vote_buffer.flush(vote_buffer.collect()))
+
+        self.assertTrue(vote_buffer.queue.empty())
+        self.assertFalse(Vote.objects.filter(user=self.user2).exists())
+        self.assertEqual(vote_counter.count(self.user2.pk), 0)
+        with open(dead_letter_path) as dead_letter:
+            self.assertEqual(len(dead_letter.readlines()), 1)
+
+    def test_flush_retries_while_database_is_unavailable(self):
+        vote_buffer = VoteBuffer(max_attempts=1, autostart=False)
+        vote_buffer.put(self.user1.pk, self.restaurant1.pk)
+
+        with mock.patch(
+            "restaurant.buffer.calculate_bulk_vote_weights",
+            side_effect=OperationalError,
+        ), self.assertLogs("restaurant.buffer"):
+            for _ in range(3):
+                self.assertFalse(vote_buffer.flush(vote_buffer.collect()))
+        vote_buffer.drain()
+        self.assertTrue(Vote.objects.filter(user=self.user1).exists())
+
+
+class LeaderboardIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = timezone.now().date()
+        self.yesterday = self.today - timedelta(days=1)
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="password")
+            for i in range(3)
+        ]
+        self.restaurants = [
+            Restaurant.objects.create(name=f"Restaurant {i}") for i in range(4)
+        ]
+
+    def vote(self, date, votes):
+        with self.captureOnCommitCallbacks(execute=True):
+            calculate_bulk_vote_weights(
+                {
+                    (self.users[user].pk, self.restaurants[restaurant].pk): count
+                    for user, restaurant, count in votes
+                },
+                date=date,
+            )
+
+    def assertMatchesDatabase(self, index):
+        for date_from, date_to in [
+            (None, None),
+            (self.today, None),
+            (None, self.yesterday),
+            (self.yesterday, self.yesterday),
+            (self.today + timedelta(days=1), None),
+        ]:
+            expected = [
+                (
+                    str(restaurant.pk),
+                    restaurant.total_rating,
+                    restaurant.voter_days,
+                    restaurant.total_votes,
+                )
+                for restaurant in get_restaurants_ordered_by_rating(
+                    date_to=date_to, date_from=date_from
+                )
+            ]
+            self.assertEqual(index.count(date_from, date_to), len(expected))
+            self.assertEqual(index.rank(date_from, date_to, 0, 10), expected)
+            self.assertEqual(index.rank(date_from, date_to, 1, 2), expected[1:3])
+
+    def check_index(self, backend, url=""):
+        settings_override = self.settings(
+            LEADERBOARD_INDEX_BACKEND=backend, LEADERBOARD_INDEX_URL=url
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        index = get_leaderboard_index()
+        # Indexes live as long as the process
+        self.addCleanup(index.reset)
+        load_leaderboard_index(index)
+
+        self.vote(self.yesterday, [(0, 0, 2), (1, 1, 1), (2, 2, 1)])
+        # Restaurants 1 and 2 tie on rating and voters, restaurant 3 on rating only
+        self.vote(self.today, [(0, 1, 1), (1, 2, 1), (2, 3, 2)])
+        self.vote(self.today, [(0, 0, 1), (0, 3, 1)])
+        self.assertMatchesDatabase(index)
+
+        # Votes of past days replace the unions of the ranked ranges
+        self.vote(self.yesterday, [(1, 3, 3)])
+        self.assertMatchesDatabase(index)
+
+        # Loading from the rollup gives the same index
+        index.reset()
+        self.assertFalse(index.is_loaded())
+        load_leaderboard_index(index)
+        self.assertMatchesDatabase(index)
+
+        self.restaurants.pop(0).delete()
+        self.assertMatchesDatabase(index)
+
+    def test_in_memory_index(self):
+        self.check_index("restaurant.leaderboard.InMemoryLeaderboardIndex")
+
+    def test_redis_index(self):
+        self.check_index("restaurant.leaderboard.RedisLeaderboardIndex", "local://")
+
+    def test_increments_are_ignored_until_loaded(self):
+        with self.settings(
+            LEADERBOARD_INDEX_BACKEND="restaurant.leaderboard.InMemoryLeaderboardIndex"
+        ):
+            index = get_leaderboard_index()
+            self.addCleanup(index.reset)
+            self.vote(self.today, [(0, 0, 1)])
+            self.assertFalse(index.is_loaded())
+
+            load_leaderboard_index(index)
+            self.vote(self.today, [(1, 0, 1)])
+            self.assertMatchesDatabase(index)
+
+            rebuild_daily_ratings()
+            self.assertFalse(index.is_loaded())
+
+    def check_votes_are_counted_once(self, backend, url=""):
+        with self.settings(
+            LEADERBOARD_INDEX_BACKEND=backend, LEADERBOARD_INDEX_URL=url
+        ):
+            index = get_leaderboard_index()
+            self.addCleanup(index.reset)
+
+            # A vote committed while the rollup is read reaches the index through the read and its rows
+            token = index.start_load()
+            self.vote(self.today, [(0, 0, 2)])
+            index.load(
+                token,
+                RestaurantDailyRating.objects.values_list(
+                    "restaurant_id",
+                    "date",
+                    "total_weight",
+                    "total_votes",
+                    "voter_count",
+                ),
+            )
+            self.assertMatchesDatabase(index)
+
+            # Replayed and late rows leave the index unchanged
+            rows = list(
+                RestaurantDailyRating.objects.values_list(
+                    "restaurant_id",
+                    "date",
+                    "total_weight",
+                    "total_votes",
+                    "voter_count",
+                )
+            )
+            self.vote(self.today, [(1, 0, 1)])
+            index.add(rows)
+            self.assertMatchesDatabase(index)
+
+            # A load started before a reset is dropped
+            token = index.start_load()
+            index.reset()
+            index.load(token, rows)
+            self.assertFalse(index.is_loaded())
+
+    def test_in_memory_votes_are_counted_once(self):
+        self.check_votes_are_counted_once(
+            "restaurant.leaderboard.InMemoryLeaderboardIndex"
+        )
+
+    def test_redis_votes_are_counted_once(self):
+        self.check_votes_are_counted_once(
+            "restaurant.leaderboard.RedisLeaderboardIndex", "local://"
+        )
+
+    def test_incomplete_index(self):
+        class IncompleteIndex(LeaderboardIndex):
+            def is_loaded(self):
+                return True
+
+        with self.assertRaises(TypeError):
+            IncompleteIndex()
+
+
+class VotePartitionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="user", password="password")
+        self.restaurant = Restaurant.objects.create(name="Restaurant")
+        self.current = month_start(timezone.now().date())
+        self.last_month = add_months(self.current, -1)
+
+    def vote_last_month(self):
+        calculate_vote_weight(self.user, self.restaurant.pk)
+        Vote.objects.update(date=self.last_month)
+        rebuild_daily_ratings()
+
+    def test_add_months(self):
+        self.assertEqual(add_months(date(2024, 11, 1), 2), date(2025, 1, 1))
+        self.assertEqual(add_months(date(2025, 1, 1), -1), date(2024, 12, 1))
+        self.assertEqual(month_start(date(2024, 2, 29)), date(2024, 2, 1))
+
+    def test_rebuild_daily_ratings_keeps_archived_months(self):
+        self.vote_last_month()
+        ArchivedVoteMonth.objects.create(month=self.last_month)
+        Vote.objects.all().delete()
+
+        self.assertEqual(rebuild_daily_ratings(), 0)
+        daily_rating = RestaurantDailyRating.objects.get(restaurant=self.restaurant)
+        self.assertEqual(daily_rating.date, self.last_month)
+        self.assertEqual(daily_rating.total_votes, 1)
+
+    def test_rotate_vote_partitions_needs_partitioned_table(self):
+        if connection.vendor == "postgresql":
+            self.skipTest("The vote table is partitioned on PostgreSQL")
+        with self.assertRaises(CommandError):
+            call_command("rotate_vote_partitions")
+
+    def test_rotate_vote_partitions(self):
+        if not is_vote_table_partitioned():
+            self.skipTest("Partitioning needs PostgreSQL")
+        self.vote_last_month()
+        far_ahead = add_months(self.current, 12)
+        self.assertNotIn(far_ahead, get_vote_partitions())
+
+        call_command(
+            "rotate_vote_partitions", ahead=12, keep_months=1, stdout=StringIO()
+        )
+
+        partitions = get_vote_partitions()
+        self.assertIn(far_ahead, partitions)
+        self.assertNotIn(self.last_month, partitions)
+        self.assertFalse(Vote.objects.exists())
+        archived = ArchivedVoteMonth.objects.get()
+        self.assertEqual(archived.month, self.last_month)
+        self.assertEqual(archived.table, get_partition_name(self.last_month))
+        # The rollup still ranks the archived votes
+        self.assertEqual(
+            list(
+                get_restaurants_ordered_by_rating(
+                    date_from=self.last_month, date_to=self.current
+                )
+            ),
+            [self.restaurant],
+        )
+        # New votes still land in the partitioned table
+        calculate_vote_weight(self.user, self.restaurant.pk)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_create_vote_partition_moves_default_rows(self):
+        if not is_vote_table_partitioned():
+            self.skipTest("Partitioning needs PostgreSQL")
+        month = add_months(self.current, 24)
+        calculate_vote_weight(self.user, self.restaurant.pk)
+        Vote.objects.update(date=month)
+        self.assertEqual(get_default_partition_months(), [month])
+
+        self.assertEqual(create_vote_partition(month), get_partition_name(month))
+        self.assertIsNone(create_vote_partition(month))
+        self.assertEqual(get_default_partition_months(), [])
+        self.assertEqual(Vote.objects.get().date, month)
+
+
+class FakeConnection:
+    class info:
+        transaction_status = 0
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_reuse_connections(self):
+        pool = ConnectionPool(FakeConnection, min_size=1, max_size=2)
+        pool.fill()
+        first = pool.getconn()
+        second = pool.getconn()
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.get_stats()["in_use"], 2)
+
+        pool.putconn(second)
+        self.assertIs(pool.getconn(), second)
+        pool.putconn(second)
+        pool.putconn(first, discard=True)
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.get_stats()["size"], 1)
+
+    def test_max_size(self):
+        pool = ConnectionPool(FakeConnection, max_size=1, timeout=0.05)
+        connection = pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        self.assertEqual(pool.get_stats()["timeouts"], 1)
+
+        # A thread waiting for a connection gets the one checked in
+        Thread(target=lambda: (time.sleep(0.01), pool.putconn(connection))).start()
+        pool.timeout = 5
+        self.assertIs(pool.getconn(), connection)
+
+    def test_close_idle_connections(self):
+        pool = ConnectionPool(FakeConnection, min_size=1, max_size=3, max_idle=0)
+        connections = [pool.getconn() for _ in range(3)]
+        for connection in connections:
+            pool.putconn(connection)
+        stats = pool.get_stats()
+        self.assertEqual((stats["size"], stats["idle"]), (1, 1))
+        self.assertEqual(sum(connection.closed for connection in connections), 2)
+
+        # Connections closed while idle are replaced
+        pool.getconn().close()
+        pool.putconn(connections[2])
+        self.assertIsInstance(pool.getconn(), FakeConnection)
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+        settings_override = self.settings(
+            REPLICA_DATABASES=["replica_0", "replica_1"], REPLICA_PIN_SECONDS=5
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_router(self):
+        self.assertIn(self.router.db_for_read(Restaurant), ["replica_0", "replica_1"])
+        self.assertEqual(self.router.db_for_write(Restaurant), "default")
+        self.assertFalse(self.router.allow_migrate("replica_0", "restaurant"))
+
+        # Transactions read their own writes
+        with mock.patch.object(connections["default"], "in_atomic_block", True):
+            self.assertEqual(self.router.db_for_read(Restaurant), "default")
+
+        # A request sticks to the primary once it wrote
+        pin = PrimaryPin()
+        token = current_pin.set(pin)
+        try:
+            self.assertNotEqual(self.router.db_for_read(Restaurant), "default")
+            self.router.db_for_write(Vote)
+            self.assertEqual(self.router.db_for_read(Restaurant), "default")
+        finally:
+            current_pin.reset(token)
+        self.assertTrue(pin.written)
+
+        with self.settings(REPLICA_DATABASES=[]):
+            self.assertEqual(self.router.db_for_read(Restaurant), "default")
+
+    def test_pinning_middleware(self):
+        def view(request):
+            # Votes are written with raw SQL, which does not go through the router
+            return self.router.db_for_read(Restaurant)
+
+        middleware = ReplicaPinningMiddleware(view)
+        factory = RequestFactory()
+        credentials = {"HTTP_AUTHORIZATION": "Token 1"}
+
+        self.assertNotEqual(middleware(factory.get("/", **credentials)), "default")
+        self.assertEqual(middleware(factory.post("/", **credentials)), "default")
+        # The client reads its write from the primary for REPLICA_PIN_SECONDS, other clients do not wait for it
+        self.assertEqual(middleware(factory.get("/", **credentials)), "default")
+        self.assertNotEqual(
+            middleware(factory.get("/", HTTP_AUTHORIZATION="Token 2")), "default"
+        )
+        self.assertNotEqual(middleware(factory.get("/")), "default")
+
+    def test_replica_pin_cache_check(self):
+        self.assertEqual(
+            [warning.id for warning in check_replica_pin_cache(None)],
+            ["restaurant.W002"],
+        )
+        with self.settings(REPLICA_DATABASES=[]):
+            self.assertEqual(check_replica_pin_cache(None), [])
+
+
+# A replica defined like the ones of POSTGRES_REPLICA_HOSTS, the test runner points it at the test database of the
+# primary
+connections.databases.setdefault(
+    "replica_0", {**connections.databases["default"], "TEST": {"MIRROR": "default"}}
+)
+
+
+class ReplicaReadTests(TransactionTestCase):
+    databases = {"default", "replica_0"}
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest(
+                "In-memory SQLite databases are not shared between connections"
+            )
+        cache.clear()
+        user = User.objects.create_user(username="user", password="password")
+        self.restaurant = Restaurant.objects.create(name="Restaurant")
+        calculate_vote_weight(user, self.restaurant.pk)
+        self.client.force_login(user)
+        settings_override = self.settings(REPLICA_DATABASES=["replica_0"])
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get(self, url, data=None):
+        with CaptureQueriesContext(connections["replica_0"]) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        # The session and the user are read before the view
+        return response, [
+            query["sql"] for query in queries if "restaurant_" in query["sql"]
+        ]
+
+    def test_reads_from_replica(self):
+        response, replica_queries = self.get(
+            reverse("restaurant:restaurant-list-create")
+        )
+        self.assertTrue(replica_queries)
+        self.assertEqual(response.json()["results"][0]["name"], "Restaurant")
+
+        # Leaderboards including today are cached and validated by the votes version, they are read from the primary
+        url = reverse("restaurant:order-restaurant-list")
+        response, replica_queries = self.get(url)
+        self.assertEqual(replica_queries, [])
+        self.assertEqual(response.json()["results"][0]["rating"]["total_votes"], 1)
+        self.assertIn("ETag", response)
+
+        # Past ranges no longer change with votes
+        yesterday = timezone.now().date() - timedelta(days=1)
+        response, replica_queries = self.get(url, {"date_to": yesterday})
+        self.assertTrue(replica_queries)
+        self.assertEqual(response.json()["results"], [])
+
+
+class DatabaseBackendTests(TestCase):
+    def setUp(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("The backend extends the PostgreSQL one")
+
+    def get_wrapper(self, **overrides):
+        from convious.postgresql.base import DatabaseWrapper
+
+        wrapper = DatabaseWrapper(
+            {**connection.settings_dict, **overrides}, alias="backend-test"
+        )
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def get_backend_pid(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            return cursor.fetchone()[0]
+
+    def test_pool(self):
+        wrapper = self.get_wrapper(CONN_MAX_AGE=0, POOL={"MIN_SIZE": 1, "MAX_SIZE": 1})
+        self.addCleanup(lambda: wrapper.pool.close())
+        pid = self.get_backend_pid(wrapper)
+        wrapper.close_if_unusable_or_obsolete()
+        self.assertIsNone(wrapper.connection)
+        self.assertEqual(self.get_backend_pid(wrapper), pid)
+        self.assertEqual(wrapper.pool.get_stats()["size"], 1)
+
+    def test_health_checks(self):
+        wrapper = self.get_wrapper(CONN_MAX_AGE=60, CONN_HEALTH_CHECKS=True, POOL=None)
+        pid = self.get_backend_pid(wrapper)
+        wrapper.close_if_unusable_or_obsolete()
+        self.assertEqual(self.get_backend_pid(wrapper), pid)
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [pid])
+        # The next request reconnects instead of failing on the dead connection
+        wrapper.close_if_unusable_or_obsolete()
+        self.assertNotEqual(self.get_backend_pid(wrapper), pid)
+
+
+class VoteConcurrencyTests(TransactionTestCase):
+    threads = 8
+    votes_per_thread = 5
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("In-memory SQLite does not wait for locks between threads")
+        self.user = User.objects.create_user(username="user", password="password")
+        self.restaurant = Restaurant.objects.create(name="Restaurant")
+
+    def test_concurrent_votes_are_not_lost(self):
+        errors = []
+
+        def vote():
+            try:
+                for _ in range(self.votes_per_thread):
+                    calculate_vote_weight(self.user, self.restaurant.pk)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [Thread(target=vote) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total_votes = self.threads * self.votes_per_thread
+        vote = Vote.objects.get(user=self.user, restaurant=self.restaurant)
+        self.assertEqual(vote.total_votes, total_votes)
+        self.assertEqual(
+            vote.total_weight, Decimal("1.5") + Decimal("0.25") * (total_votes - 2)
+        )
+
+        daily_rating = RestaurantDailyRating.objects.get(restaurant=self.restaurant)
+        self.assertEqual(daily_rating.total_votes, total_votes)
+        self.assertEqual(daily_rating.total_weight, vote.total_weight)
+        self.assertEqual(daily_rating.voter_count, 1)
+
+    def test_vote_buffer_worker(self):
+        vote_buffer = VoteBuffer(batch_size=10, flush_interval_ms=20)
+        for _ in range(self.votes_per_thread):
+            vote_buffer.put(self.user.pk, self.restaurant.pk)
+        time.sleep(0.2)
+        vote_buffer.stop()
+
+        vote = Vote.objects.get(user=self.user, restaurant=self.restaurant)
+        self.assertEqual(vote.total_votes, self.votes_per_thread)
+        self.assertEqual(
+            vote.total_weight,
+            Decimal("1.5") + Decimal("0.25") * (self.votes_per_thread - 2),
+        )
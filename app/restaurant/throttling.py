@@ -0,0 +1,143 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.crypto import salted_hmac
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Parse a rate like "30/m" into the number of requests and the duration of the window in seconds.
+
+    Returns:
+        The number of requests and the window, or None if the rate is empty.
+
+    Raises:
+        ImproperlyConfigured: If the rate is malformed.
+    """
+    if not rate:
+        return None
+    try:
+        num, period = rate.split("/")
+        num, window = int(num), PERIODS[period.strip()[0]]
+    except (ValueError, KeyError, IndexError):
+        raise ImproperlyConfigured(
+            f"Invalid throttle rate {rate!r}, expected e.g. 30/m with a period of s, m, h or d."
+        )
+    if num < 0:
+        raise ImproperlyConfigured(
+            f"Invalid throttle rate {rate!r}, the number of requests is negative."
+        )
+    return num, window
+
+
+class SlidingWindowThrottle(BaseThrottle, ABC):
+    """
+    Base class of the vote throttles, limiting the requests of a client to `rate` per window with a sliding window
+    counter kept in `settings.VOTE_THROTTLE_CACHE`.
+
+    Requests are counted per fixed window with the cache's atomic `incr`. The count of the sliding window is the count
+    of the current window plus the count of the previous one, weighted by how much of it the sliding window still
+    covers. Checking a request reads two counters and increments one, whatever the rate, and throttled requests are
+    not counted. A rate of 0 refuses every request. Throttles run after authentication and before the view, so
+    throttled requests do no database work with the cached authentication classes.
+    """
+
+    scope = ""
+    timer = time.time
+
+    @abstractmethod
+    def get_rate(self) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_ident(self, request) -> Optional[str]:
+        """
+        Identify the client of a request, or return None not to throttle it.
+        """
+        raise NotImplementedError
+
+    def allow_request(self, request, view) -> bool:
+        rate = parse_rate(self.get_rate())
+        ident = self.get_ident(request)
+        self.wait_seconds = None
+        if rate is None or ident is None:
+            return True
+
+        limit, window = rate
+        cache = caches[settings.VOTE_THROTTLE_CACHE]
+        now = self.timer()
+        current = int(now // window)
+        elapsed = now - current * window
+        if limit == 0:
+            self.wait_seconds = window - elapsed
+            return False
+
+        key = f"throttle:{self.scope}:{ident}:{current}"
+        previous_key = f"throttle:{self.scope}:{ident}:{current - 1}"
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # Kept for the next window, which weighs this one
+            cache.add(key, 0, window * 2)
+            count = cache.incr(key)
+        previous = cache.get(previous_key, 0)
+
+        weight = 1 - elapsed / window
+        if previous * weight + count <= limit:
+            return True
+
+        cache.decr(key)
+        count -= 1
+        if count < limit:
+            # The previous window slides out until there is room for one more request
+            self.wait_seconds = window * (1 - (limit - count - 1) / previous) - elapsed
+        else:
+            # The current window has to become the previous one and slide out as well
+            self.wait_seconds = window - elapsed + window * (1 - (limit - 1) / count)
+        self.wait_seconds = max(self.wait_seconds, 0)
+        return False
+
+    def wait(self) -> Optional[float]:
+        return self.wait_seconds
+
+
+class VoteUserRateThrottle(SlidingWindowThrottle):
+    """
+    Limit the votes of every user to `settings.VOTE_THROTTLE_USER_RATE`.
+    """
+
+    scope = "vote-user"
+
+    def get_rate(self) -> Optional[str]:
+        return settings.VOTE_THROTTLE_USER_RATE
+
+    def get_ident(self, request) -> Optional[str]:
+        if not request.user or not request.user.is_authenticated:
+            return None
+        return str(request.user.pk)
+
+
+class VoteTokenRateThrottle(SlidingWindowThrottle):
+    """
+    Limit the votes sent with every API token to `settings.VOTE_THROTTLE_TOKEN_RATE`, e.g. to keep a kiosk voting on
+    behalf of many users with a staff token in check.
+    """
+
+    scope = "vote-token"
+
+    def get_rate(self) -> Optional[str]:
+        return settings.VOTE_THROTTLE_TOKEN_RATE
+
+    def get_ident(self, request) -> Optional[str]:
+        key = getattr(request.auth, "key", None)
+        if key is None:
+            return None
+        # Tokens are not stored in the cache keys, like the cached credentials
+        return salted_hmac("restaurant.throttling", key).hexdigest()
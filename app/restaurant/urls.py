@@ -1,6 +1,7 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 app_name = "restaurant"
 
@@ -12,9 +13,26 @@ urlpatterns = [
     ),
     path(
         "order_by_ratings/",
-        views.RestaurantViewSet.as_view({"get": "order_by_ratings"}),
+        async_views.order_by_ratings
+        if settings.ASYNC_VIEWS
+        else views.RestaurantViewSet.as_view({"get": "order_by_ratings"}),
         name="order-restaurant-list",
     ),
+    path(
+        "order_by_ratings/cache/",
+        views.RestaurantViewSet.as_view({"get": "order_by_ratings_cache_stats"}),
+        name="order-restaurant-list-cache-stats",
+    ),
+    path(
+        "export/ratings/",
+        views.ExportViewSet.as_view({"get": "ratings"}),
+        name="export-ratings",
+    ),
+    path(
+        "export/votes/",
+        views.ExportViewSet.as_view({"get": "votes"}),
+        name="export-votes",
+    ),
     path(
         "<uuid:pk>/",
         views.RestaurantViewSet.as_view(
@@ -22,5 +40,16 @@ urlpatterns = [
         ),
         name="restaurant-retrieve-update-destroy",
     ),
-    path("vote/", views.VoteViewSet.as_view({"post": "post"}), name="vote-create"),
+    path(
+        "vote/",
+        async_views.vote
+        if settings.ASYNC_VIEWS
+        else views.VoteViewSet.as_view({"post": "post"}),
+        name="vote-create",
+    ),
+    path(
+        "vote/bulk/",
+        views.VoteViewSet.as_view({"post": "bulk"}),
+        name="vote-bulk-create",
+    ),
 ]
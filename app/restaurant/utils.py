@@ -1,17 +1,55 @@
+from datetime import date as Date
 from decimal import Decimal
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Count, Sum
+from django.db import IntegrityError, connection, transaction
+from django.db.models import (
+    Count,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Q,
+    QuerySet,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Cast, Power
 from django.utils import timezone
 
-from .models import Restaurant, Vote
+from .caching import bump_leaderboard_version, bump_votes_version
+from .expressions import DaysBetween
+from .leaderboard import get_leaderboard_index, index_daily_ratings
+from .models import Restaurant, RestaurantDailyRating, Vote
+from .partitions import get_archived_months_filter
+from .weights import WeightPolicy, get_weight_policy
+
+
+def get_user_daily_vote_count(user_id: int, date=None) -> int:
+    """
+    Count the votes of a user on a given day across all restaurants.
+
+    Args:
+        user_id (int): The primary key of the user.
+        date (Optional[datetime.date]): The day to count the votes for, today by default.
+
+    Returns:
+        count (int): The number of votes the user has cast that day.
+    """
+    count = Vote.objects.filter(
+        user_id=user_id, date=date or timezone.now().date()
+    ).aggregate(count=Sum("total_votes"))["count"]
+    return count or 0
 
 
 def check_has_user_reached_max_vote_limit(user: User) -> bool:
     """
     Checks if user has reached the maximum amount of votes allowed per day.
 
+    The votes are counted across all the restaurants the user voted for today.
 
     Args:
         user (User): The user who is voting.
@@ -20,49 +58,469 @@ def check_has_user_reached_max_vote_limit(user: User) -> bool:
         True: If user has reached the maximum amount of vote allowed per day.
         False: If user has NOT reached the maximum amount of vote allowed per day.
     """
-    today_votes = Vote.objects.filter(user=user, date=timezone.now().date()).first()
-    if not today_votes:
-        return False
-    if today_votes.total_votes >= settings.MAX_VOTES_PER_DAY:
-        return True
+    return get_user_daily_vote_count(user.pk) >= settings.MAX_VOTES_PER_DAY
 
 
-def calculate_vote_weight(user: User, restaurant: Restaurant) -> Vote:
+def get_vote_weight(total_votes: int) -> Decimal:
+    """
+    Get the weight a vote adds to the rating depending on how many times the user voted for the restaurant that day.
+
+    Args:
+        total_votes (int): The number of votes of the user for the restaurant that day, including this one.
+
+    Returns:
+        weight (Decimal): The weight given by the weight policy, by default 1 for the first vote, 0.5 for the second
+            one and 0.25 for every following vote.
+    """
+    return get_weight_policy().get_weight(total_votes)
+
+
+def calculate_vote_weight(user: User, restaurant_id: UUID) -> Vote:
     """
     Calculate the vote weight for a user's vote on a given restaurant.
 
-    Developers note, currently these weights of votes are hardcoded and can not be changed from outside. In real world
-    of course depending on the need it might be wise to consider providing these from outside.
+    The vote is written with a single insert-or-increment statement, so concurrent votes of the same user neither
+    lose updates nor fail on the (user, restaurant, date) unique constraint.
+
+    The new total weight is looked up in the table of the weight policy configured by `settings.VOTE_WEIGHT_POLICY`,
+    within the same statement.
 
     Args:
         user (User): The user who is voting.
-        restaurant (Restaurant): The restaurant that the user is voting for.
+        restaurant_id (UUID): The id of the restaurant that the user is voting for, which is not loaded.
 
     Returns:
         vote (Vote): The updated or newly created Vote instance.
     """
-    # Check if the user has already voted for this restaurant today
-    vote = Vote.objects.filter(
-        user=user, restaurant=restaurant, date=timezone.now().date()
-    ).first()
-
-    if vote:
-        # If a vote exists, update the total_votes and calculate the new weight
-        vote.total_votes += 1
-        if vote.total_votes == 2:
-            vote.total_weight += Decimal("0.5")
-        elif vote.total_votes >= 3:
-            vote.total_weight += Decimal("0.25")
-        vote.save()
-    else:
-        # If it's the user's first vote for this restaurant today, create a new vote with weight 1
-        vote = Vote.objects.create(
-            user=user, restaurant=restaurant, total_votes=1, total_weight=1
+    policy = get_weight_policy()
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            vote = _upsert_vote_postgresql(user.pk, restaurant_id, policy)
+        else:
+            vote = _upsert_vote(user.pk, restaurant_id, policy)
+
+        update_daily_rating(
+            vote.restaurant_id,
+            vote.date,
+            weight=policy.get_added_weight(vote.total_votes - 1, 1),
+            new_voter=vote.total_votes == 1,
         )
 
+    bump_votes_version(vote.date)
     return vote
 
 
+def _upsert_vote_postgresql(user_id: int, restaurant_id, policy: WeightPolicy) -> Vote:
+    """
+    Insert the first vote of the day or increment the existing one in a single `INSERT ... ON CONFLICT` statement.
+
+    The new total weight is read from the policy's cumulative weights, passed as an array indexed by the number of
+    votes. Votes past the array add the policy's tail weight.
+    """
+    table = connection.ops.quote_name(Vote._meta.db_table)
+    sql = f"""
+        INSERT INTO {table} (user_id, restaurant_id, date, total_votes, total_weight, weight_version)
+        VALUES (%s, %s, %s, 1, %s, %s)
+        ON CONFLICT (user_id, restaurant_id, date) DO UPDATE SET
+            total_votes = {table}.total_votes + 1,
+            total_weight = COALESCE(
+                (%s::numeric[])[{table}.total_votes + 1], {table}.total_weight + %s
+            ),
+            weight_version = EXCLUDED.weight_version
+        RETURNING id, date, total_votes, total_weight
+    """
+    params = [
+        user_id,
+        restaurant_id,
+        timezone.now().date(),
+        policy.get_total_weight(1),
+        policy.version,
+        policy.cumulative_weights[1:],
+        policy.tail_weight,
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        pk, date, total_votes, total_weight = cursor.fetchone()
+
+    return Vote(
+        id=pk,
+        user_id=user_id,
+        restaurant_id=restaurant_id,
+        date=date,
+        total_votes=total_votes,
+        total_weight=total_weight,
+        weight_version=policy.version,
+    )
+
+
+def _upsert_vote(user_id: int, restaurant_id, policy: WeightPolicy) -> Vote:
+    """
+    Portable fallback of `_upsert_vote_postgresql` for backends without `ON CONFLICT ... RETURNING`, e.g. SQLite.
+
+    The increment is a single UPDATE with F-expressions, so the database applies it atomically. If there is no vote to
+    increment yet, the first vote is inserted and a concurrent first vote that won the race is incremented instead.
+    """
+    vote_queryset = Vote.objects.filter(
+        user_id=user_id, restaurant_id=restaurant_id, date=timezone.now().date()
+    )
+    # Both columns are computed from the row's current values, the new total weight is the one of total_votes + 1
+    increment = {
+        "total_votes": F("total_votes") + 1,
+        "total_weight": policy.get_total_weight_expression(added_votes=1),
+        "weight_version": policy.version,
+    }
+
+    if not vote_queryset.update(**increment):
+        try:
+            with transaction.atomic():
+                return Vote.objects.create(
+                    user_id=user_id,
+                    restaurant_id=restaurant_id,
+                    total_votes=1,
+                    total_weight=policy.get_total_weight(1),
+                    weight_version=policy.version,
+                )
+        except IntegrityError:
+            vote_queryset.update(**increment)
+
+    return vote_queryset.get()
+
+
+def update_daily_rating(restaurant_id, date, weight: Decimal, new_voter: bool) -> None:
+    """
+    Add a single vote to the daily rating rollup of a restaurant.
+
+    Args:
+        restaurant_id (UUID): The primary key of the voted restaurant.
+        date (datetime.date): The day of the vote.
+        weight (Decimal): The weight the vote added to the restaurant's rating.
+        new_voter (bool): Whether this is the user's first vote for the restaurant on that day.
+    """
+    update_daily_ratings([(restaurant_id, date, weight, 1, int(new_voter))])
+
+
+def update_daily_ratings(rows: List[Tuple[Any, Date, Decimal, int, int]]) -> None:
+    """
+    Add votes to the daily rating rollup, creating the missing rows.
+
+    On PostgreSQL all the rows are written with a single `INSERT ... ON CONFLICT` statement, other backends increment
+    every row with an UPDATE using F-expressions. The written rows stay locked until the transaction ends, their totals
+    are handed to the leaderboard index once it commits.
+
+    Args:
+        rows: (restaurant_id, date, weight, votes, new voters) tuples of the increments to apply.
+    """
+    if not rows:
+        return
+
+    if connection.vendor == "postgresql":
+        table = connection.ops.quote_name(RestaurantDailyRating._meta.db_table)
+        values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))
+        sql = f"""
+            INSERT INTO {table} (restaurant_id, date, total_weight, total_votes, voter_count)
+            VALUES {values}
+            ON CONFLICT (restaurant_id, date) DO UPDATE SET
+                total_weight = {table}.total_weight + EXCLUDED.total_weight,
+                total_votes = {table}.total_votes + EXCLUDED.total_votes,
+                voter_count = {table}.voter_count + EXCLUDED.voter_count
+            RETURNING restaurant_id, date, total_weight, total_votes, voter_count
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [value for row in rows for value in row])
+            totals = cursor.fetchall()
+        transaction.on_commit(lambda: index_daily_ratings(totals))
+        return
+
+    for restaurant_id, date, weight, votes, voters in rows:
+        daily_rating_queryset = RestaurantDailyRating.objects.filter(
+            restaurant_id=restaurant_id, date=date
+        )
+        increment = {
+            "total_weight": F("total_weight") + weight,
+            "total_votes": F("total_votes") + votes,
+            "voter_count": F("voter_count") + voters,
+        }
+
+        if not daily_rating_queryset.update(**increment):
+            try:
+                with transaction.atomic():
+                    RestaurantDailyRating.objects.create(
+                        restaurant_id=restaurant_id,
+                        date=date,
+                        total_weight=weight,
+                        total_votes=votes,
+                        voter_count=voters,
+                    )
+            except IntegrityError:
+                daily_rating_queryset.update(**increment)
+
+    if get_leaderboard_index():
+        totals = []
+        for restaurant_id, date, *_ in rows:
+            totals.extend(
+                RestaurantDailyRating.objects.filter(
+                    restaurant_id=restaurant_id, date=date
+                ).values_list(
+                    "restaurant_id",
+                    "date",
+                    "total_weight",
+                    "total_votes",
+                    "voter_count",
+                )
+            )
+        transaction.on_commit(lambda: index_daily_ratings(totals))
+
+
+def calculate_bulk_vote_weights(
+    vote_counts: Dict[Tuple[int, Any], int], date: Optional[Date] = None
+) -> Dict[Tuple[int, Any], Vote]:
+    """
+    Apply many votes at once, with the same weight policy as `calculate_vote_weight`.
+
+    Today's votes of the given (user, restaurant) pairs are read and locked with a single query, the new totals are
+    computed in memory and written back with one bulk upsert, all within one transaction. The daily rating rollup is
+    updated in the same transaction. Daily limits are not checked here, reserve the votes beforehand.
+
+    Args:
+        vote_counts: The number of votes to add per (user_id, restaurant_id) pair.
+        date (Optional[datetime.date]): The day the votes were cast, today by default.
+
+    Returns:
+        votes: The updated or newly created Vote instances per (user_id, restaurant_id) pair.
+    """
+    vote_counts = {key: count for key, count in vote_counts.items() if count > 0}
+    if not vote_counts:
+        return {}
+
+    date = date or timezone.now().date()
+    user_ids = {user_id for user_id, _ in vote_counts}
+    restaurant_ids = {restaurant_id for _, restaurant_id in vote_counts}
+
+    policy = get_weight_policy()
+    with transaction.atomic():
+        existing_votes = {
+            (vote.user_id, vote.restaurant_id): vote
+            for vote in Vote.objects.select_for_update().filter(
+                date=date, user_id__in=user_ids, restaurant_id__in=restaurant_ids
+            )
+        }
+
+        # (user_id, restaurant_id, added votes, added weight) of every pair
+        increments = []
+        daily_ratings: Dict[Any, List] = {}
+        for (user_id, restaurant_id), count in vote_counts.items():
+            existing_vote = existing_votes.get((user_id, restaurant_id))
+            previous_votes = existing_vote.total_votes if existing_vote else 0
+            weight = policy.get_added_weight(previous_votes, count)
+            increments.append((user_id, restaurant_id, count, weight))
+
+            daily_rating = daily_ratings.setdefault(restaurant_id, [Decimal(0), 0, 0])
+            daily_rating[0] += weight
+            daily_rating[1] += count
+            daily_rating[2] += int(previous_votes == 0)
+
+        if connection.vendor == "postgresql":
+            votes = _bulk_upsert_votes_postgresql(increments, date, policy.version)
+        else:
+            votes = _bulk_upsert_votes(increments, existing_votes, date, policy.version)
+
+        update_daily_ratings(
+            [
+                (restaurant_id, date, weight, count, voters)
+                for restaurant_id, (weight, count, voters) in daily_ratings.items()
+            ]
+        )
+
+    bump_votes_version(date)
+    return votes
+
+
+def _bulk_upsert_votes_postgresql(
+    increments: List[Tuple[int, Any, int, Decimal]], date: Date, weight_version: str
+) -> Dict[Tuple[int, Any], Vote]:
+    """
+    Add the vote increments with a single multi-row `INSERT ... ON CONFLICT` statement.
+    """
+    table = connection.ops.quote_name(Vote._meta.db_table)
+    values = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(increments))
+    sql = f"""
+        INSERT INTO {table} (user_id, restaurant_id, date, total_votes, total_weight, weight_version)
+        VALUES {values}
+        ON CONFLICT (user_id, restaurant_id, date) DO UPDATE SET
+            total_votes = {table}.total_votes + EXCLUDED.total_votes,
+            total_weight = {table}.total_weight + EXCLUDED.total_weight,
+            weight_version = EXCLUDED.weight_version
+        RETURNING id, user_id, restaurant_id, total_votes, total_weight
+    """
+    params = [
+        value
+        for user_id, restaurant_id, count, weight in increments
+        for value in (user_id, restaurant_id, date, count, weight, weight_version)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    return {
+        (user_id, restaurant_id): Vote(
+            id=pk,
+            user_id=user_id,
+            restaurant_id=restaurant_id,
+            date=date,
+            total_votes=total_votes,
+            total_weight=total_weight,
+            weight_version=weight_version,
+        )
+        for pk, user_id, restaurant_id, total_votes, total_weight in rows
+    }
+
+
+def _bulk_upsert_votes(
+    increments: List[Tuple[int, Any, int, Decimal]],
+    existing_votes: Dict[Tuple[int, Any], Vote],
+    date: Date,
+    weight_version: str,
+) -> Dict[Tuple[int, Any], Vote]:
+    """
+    Portable fallback of `_bulk_upsert_votes_postgresql`, new votes are bulk inserted and locked ones incremented.
+    """
+    new_votes = []
+    for user_id, restaurant_id, count, weight in increments:
+        existing_vote = existing_votes.get((user_id, restaurant_id))
+        if existing_vote:
+            Vote.objects.filter(pk=existing_vote.pk).update(
+                total_votes=F("total_votes") + count,
+                total_weight=F("total_weight") + weight,
+                weight_version=weight_version,
+            )
+        else:
+            new_votes.append(
+                Vote(
+                    user_id=user_id,
+                    restaurant_id=restaurant_id,
+                    date=date,
+                    total_votes=count,
+                    total_weight=weight,
+                    weight_version=weight_version,
+                )
+            )
+
+    if date == timezone.now().date():
+        Vote.objects.bulk_create(new_votes)
+    else:
+        # Raw saves skip auto_now_add, which would move the votes to today
+        for vote in new_votes:
+            vote.save_base(raw=True)
+
+    keys = {(user_id, restaurant_id) for user_id, restaurant_id, _, _ in increments}
+    votes = Vote.objects.filter(
+        date=date,
+        user_id__in={user_id for user_id, _ in keys},
+        restaurant_id__in={restaurant_id for _, restaurant_id in keys},
+    )
+    return {
+        (vote.user_id, vote.restaurant_id): vote
+        for vote in votes
+        if (vote.user_id, vote.restaurant_id) in keys
+    }
+
+
+def reweight_votes(date_to=None, date_from=None) -> int:
+    """
+    Recompute the total weight of the votes within a date range with the current weight policy, e.g. after the weights
+    changed, and rebuild the daily rating rollup of the range.
+
+    The votes are updated with a single UPDATE looking up the new total weights in a CASE over the policy's table, and
+    tagged with the version of the policy, in the same transaction as the rollup. Archived months have no votes left
+    to reweight.
+
+    Args:
+        date_to (Optional[datetime.date]): The end date of the date range to reweight.
+        date_from (Optional[datetime.date]): The start date of the date range to reweight.
+
+    Returns:
+        count (int): The number of votes updated.
+    """
+    vote_queryset = Vote.objects.all()
+    if date_from:
+        vote_queryset = vote_queryset.filter(date__gte=date_from)
+    if date_to:
+        vote_queryset = vote_queryset.filter(date__lte=date_to)
+
+    policy = get_weight_policy()
+    with transaction.atomic():
+        count = vote_queryset.update(
+            total_weight=policy.get_total_weight_expression("total_votes"),
+            weight_version=policy.version,
+        )
+        rebuild_daily_ratings(date_to=date_to, date_from=date_from)
+    return count
+
+
+def rebuild_daily_ratings(date_to=None, date_from=None, batch_size=1000) -> int:
+    """
+    Rebuild the daily rating rollup from the raw votes.
+
+    Votes are the source of truth, the rollup rows within the date range are dropped and recomputed from them. The
+    votes of archived months are detached from the vote table, their rollup rows are left untouched.
+
+    Args:
+        date_to (Optional[datetime.date]): The end date of the date range to rebuild.
+        date_from (Optional[datetime.date]): The start date of the date range to rebuild.
+        batch_size (int): The number of rollup rows inserted per query.
+
+    Returns:
+        count (int): The number of rollup rows written.
+    """
+    archived = get_archived_months_filter()
+    vote_queryset = Vote.objects.exclude(archived)
+    daily_rating_queryset = RestaurantDailyRating.objects.exclude(archived)
+
+    if date_from:
+        vote_queryset = vote_queryset.filter(date__gte=date_from)
+        daily_rating_queryset = daily_rating_queryset.filter(date__gte=date_from)
+
+    if date_to:
+        vote_queryset = vote_queryset.filter(date__lte=date_to)
+        daily_rating_queryset = daily_rating_queryset.filter(date__lte=date_to)
+
+    rows = (
+        vote_queryset.values("restaurant_id", "date")
+        .annotate(
+            sum_weight=Sum("total_weight"),
+            sum_votes=Sum("total_votes"),
+            voters=Count("user", distinct=True),
+        )
+        .order_by()
+    )
+
+    with transaction.atomic():
+        daily_rating_queryset.delete()
+        daily_ratings = (
+            RestaurantDailyRating(
+                restaurant_id=row["restaurant_id"],
+                date=row["date"],
+                total_weight=row["sum_weight"],
+                total_votes=row["sum_votes"],
+                voter_count=row["voters"],
+            )
+            for row in rows.iterator()
+        )
+        count = 0
+        while True:
+            batch = list(islice(daily_ratings, batch_size))
+            if not batch:
+                break
+            RestaurantDailyRating.objects.bulk_create(batch)
+            count += len(batch)
+
+    bump_leaderboard_version()
+    index = get_leaderboard_index()
+    if index:
+        index.reset()
+    return count
+
+
 def calculate_restaurant_rating(
     restaurant: Restaurant, date_to=None, date_from=None
 ) -> Decimal:
@@ -96,3 +554,74 @@ def calculate_restaurant_rating(
     )
 
     return rating
+
+
+def get_restaurants_ordered_by_rating(date_to=None, date_from=None) -> QuerySet:
+    """
+    Build the leaderboard queryset of restaurants ordered by their rating for a given date range.
+
+    Every restaurant is annotated with total_rating, total_votes and voter_days read from the daily rating rollup, so
+    the whole page is computed in a single grouped query whose cost depends on the number of days in the range rather
+    than the number of votes. The rollup keeps the distinct voters of every day, voter_days sums them and counts a
+    user once for every day they voted within the range, a count of distinct voters would need to scan the votes.
+    Only restaurants that received at least one vote within the date range are returned.
+
+    Args:
+        date_to (Optional[datetime.date]): The end date of the date range for which the rating is calculated.
+        date_from (Optional[datetime.date]): The start date of the date range for which the rating is calculated.
+
+    Returns:
+        queryset (QuerySet): Annotated restaurants ordered by descending rating and voter days.
+    """
+    rating_filter = Q(daily_ratings__isnull=False)
+
+    if date_from:
+        rating_filter &= Q(daily_ratings__date__gte=date_from)
+
+    if date_to:
+        rating_filter &= Q(daily_ratings__date__lte=date_to)
+
+    return (
+        Restaurant.objects.filter(rating_filter)
+        .select_related("created_by", "updated_by")
+        .annotate(
+            total_rating=Sum("daily_ratings__total_weight"),
+            total_votes=Sum("daily_ratings__total_votes"),
+            voter_days=Sum("daily_ratings__voter_count"),
+        )
+        .order_by("-total_rating", "-voter_days", "-uuid")
+    )
+
+
+def get_restaurants_ordered_by_decayed_rating(
+    half_life: float, date_to=None, date_from=None
+) -> QuerySet:
+    """
+    Build the leaderboard queryset of restaurants ordered by their exponentially decayed rating.
+
+    Every day of the daily rating rollup counts its total weight times 0.5 ^ (age / half_life), its age being the
+    number of days from it to date_to, or today, so a day of votes counts half as much every `half_life` days. The
+    decay is computed by the database in the grouped query, like `get_restaurants_ordered_by_rating`, whose
+    total_votes and voter_days annotations are kept as they are.
+
+    Args:
+        half_life (float): The number of days after which votes count half.
+        date_to (Optional[datetime.date]): The end date of the date range, and the date votes are aged from.
+        date_from (Optional[datetime.date]): The start date of the date range.
+
+    Returns:
+        queryset (QuerySet): Annotated restaurants ordered by descending decayed rating and voter days.
+    """
+    reference = date_to or timezone.now().date()
+    age = DaysBetween(Value(reference), F("daily_ratings__date"))
+    decay = Power(Value(0.5), age / Value(float(half_life)))
+    return get_restaurants_ordered_by_rating(
+        date_to=reference, date_from=date_from
+    ).annotate(
+        total_rating=Sum(
+            ExpressionWrapper(
+                Cast("daily_ratings__total_weight", FloatField()) * decay,
+                output_field=FloatField(),
+            )
+        )
+    )
@@ -1,36 +1,148 @@
-from django.db.models import Count, Sum
+import re
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 from rest_framework import status, viewsets
-from rest_framework.authentication import (
-    BasicAuthentication,
-    SessionAuthentication,
-    TokenAuthentication,
-)
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from .models import Restaurant, Vote
-from .pagination import RestaurantPagination
+from convious.routers import pin_to_primary
+
+from .authentication import CachedBasicAuthentication, CachedTokenAuthentication
+from .buffer import get_vote_buffer
+from .caching import (
+    get_cached_leaderboard,
+    get_leaderboard_cache_key,
+    get_leaderboard_cache_stats,
+    get_leaderboard_validators,
+    is_past_range,
+    set_cached_leaderboard,
+)
+from .conditional import (
+    get_not_modified_response,
+    get_restaurant_validators,
+    get_restaurants_validators,
+    get_validator_headers,
+)
+from .counters import get_vote_counter
+from .export import (
+    EXPORT_CONTENT_TYPES,
+    RATING_COLUMNS,
+    VOTE_COLUMNS,
+    get_rating_rows,
+    get_vote_rows,
+    stream_export,
+)
+from .leaderboard import IndexedLeaderboard, get_leaderboard_index
+from .models import Restaurant
+from .pagination import RestaurantCursorPagination, RestaurantPagination
+from .registry import get_restaurant_registry
 from .serializers import (
-    DateQueryParamSerializer,
+    BulkVoteSerializer,
+    ExportQueryParamSerializer,
+    LeaderboardQueryParamSerializer,
+    RestaurantIdField,
     RestaurantRatingSerializer,
     RestaurantSerializer,
     RestaurantVoteSerializer,
+    restaurant_projection,
+)
+from .snapshots import (
+    LeaderboardSnapshot,
+    SnapshotLeaderboard,
+    get_fresh_leaderboard_snapshot,
+    start_leaderboard_refresher,
+)
+from .throttling import VoteTokenRateThrottle, VoteUserRateThrottle
+from .utils import (
+    calculate_bulk_vote_weights,
+    calculate_vote_weight,
+    get_restaurants_ordered_by_decayed_rating,
+    get_restaurants_ordered_by_rating,
 )
-from .utils import calculate_vote_weight, check_has_user_reached_max_vote_limit
+
+ACCEPTS_GZIP = re.compile(r"\bgzip\b")
 
 
 class RestaurantViewSet(viewsets.ModelViewSet):
-    queryset = Restaurant.objects.all()
+    queryset = Restaurant.objects.select_related("created_by", "updated_by").order_by(
+        "created_at", "uuid"
+    )
     serializer_class = RestaurantSerializer
     authentication_classes = [
         SessionAuthentication,
-        BasicAuthentication,
-        TokenAuthentication,
+        CachedBasicAuthentication,
+        CachedTokenAuthentication,
     ]
     permission_classes = [IsAuthenticated]
     pagination_class = RestaurantPagination
 
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        """
+        List the restaurants ordered by their creation time.
+
+        Pages are read in one query, the users included, and serialized by `restaurant_projection` rather than
+        `RestaurantSerializer`, with the same output. Conditional requests are answered with 304 Not Modified
+        without reading the page when no restaurant was created, updated or deleted since.
+
+        Args:
+            request (Request): The request object that may contain pagination parameters.
+
+        Returns:
+            Response: (Response) Paginated list of restaurants.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        etag, last_modified = get_restaurants_validators(queryset)
+        not_modified = get_not_modified_response(request, etag, last_modified)
+        if not_modified:
+            return not_modified
+
+        queryset = restaurant_projection.values(queryset)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            response = self.get_paginated_response(
+                restaurant_projection.serialize(page)
+            )
+        else:
+            response = Response(restaurant_projection.serialize(queryset))
+        for name, value in get_validator_headers(etag, last_modified).items():
+            response[name] = value
+        return response
+
+    def retrieve(self, request: Request, *args, **kwargs) -> Response:
+        """
+        Retrieve a restaurant by its UUID, read and serialized like the restaurants of `list`. Conditional requests
+        are answered with 304 Not Modified when the restaurant was not updated since.
+
+        Args:
+            request (Request): The request object.
+
+        Returns:
+            Response: (Response) The restaurant.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        validators = get_restaurant_validators(queryset, pk)
+        if validators:
+            not_modified = get_not_modified_response(request, *validators)
+            if not_modified:
+                return not_modified
+
+        row = get_object_or_404(restaurant_projection.values(queryset), pk=pk)
+        self.check_object_permissions(request, row)
+        headers = get_validator_headers(*validators) if validators else {}
+        return Response(restaurant_projection.to_representation(row), headers=headers)
+
     def order_by_ratings(self, request: Request, *args, **kwargs) -> Response:
         """
         Order restaurants by their ratings with a date range if specified.
@@ -38,7 +150,17 @@ class RestaurantViewSet(viewsets.ModelViewSet):
         This view orders the restaurants based on their aggregated ratings within a
         date range if specified. The rating is calculated by summing the total_weight of
         votes within the date range. Restaurants are ordered by descending rating and
-        number of distinct voters.
+        number of voter days. The ratings of the whole page are computed in a single
+        grouped query, so the number of queries does not depend on the page size.
+
+        With `mode=decay` votes count half as much every `half_life` days, with
+        `mode=window` only the last `window` days are summed, see
+        LeaderboardQueryParamSerializer. Both are computed from the daily rating rollup.
+
+        Responses are cached per date range and page. Votes invalidate the ranges that
+        include today, restaurant changes invalidate all of them. The same versions are
+        sent as the ETag and Last-Modified date, conditional requests are answered with
+        304 Not Modified without computing the leaderboard.
 
         Args:
             request (Request): The request object that may contain query parameters for the date range.
@@ -46,56 +168,232 @@ class RestaurantViewSet(viewsets.ModelViewSet):
         Returns:
             Response: (Response) Paginated & ordered list of restaurants with their ratings and additional information.
         """
-        date_from = self.request.query_params.get("date_from")
-        date_to = self.request.query_params.get("date_to")
-
-        query_param_serializer = DateQueryParamSerializer(data=request.query_params)
+        query_param_serializer = LeaderboardQueryParamSerializer(
+            data=request.query_params
+        )
         query_param_serializer.is_valid(raise_exception=True)
+        return self.get_leaderboard_response(query_param_serializer.validated_data)
+
+    def get_leaderboard_response(self, params: Dict[str, Any]) -> Response:
+        """
+        Answer a leaderboard request, with 304 Not Modified if the client's copy is still current.
+
+        The validators are read before the leaderboard, so a vote landing in between can only make the client fetch
+        the leaderboard again. Leaderboards served from a snapshot are validated by the time it was computed.
+
+        Leaderboards that include today are read from the primary. They are cached and validated by today's votes
+        version, a replica lagging behind the vote that bumped it would store an older leaderboard under it.
+
+        Args:
+            params: The validated date range of the leaderboard.
+
+        Returns:
+            The leaderboard response.
+        """
+        start_leaderboard_refresher()
+        if not is_past_range(params):
+            pin_to_primary()
+        snapshot = None
+        if not isinstance(self.paginator, RestaurantCursorPagination):
+            snapshot = get_fresh_leaderboard_snapshot(params)
+        if snapshot:
+            etag, last_modified = snapshot.get_validators()
+        else:
+            etag, last_modified = get_leaderboard_validators(params)
+        not_modified = get_not_modified_response(self.request, etag, last_modified)
+        if not_modified:
+            return not_modified
+
+        data, headers = self.get_leaderboard(params, snapshot)
+        headers.update(get_validator_headers(etag, last_modified))
+        return Response(data, status=status.HTTP_200_OK, headers=headers)
+
+    def get_leaderboard(
+        self, params: Dict[str, Any], snapshot: Optional[LeaderboardSnapshot] = None
+    ) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """
+        Get the requested page of the leaderboard, from its snapshot or the cache if possible.
+
+        Pages of a snapshot are not cached, the cache is invalidated by votes and would keep them past the staleness
+        bound of the snapshot.
 
-        vote_queryset = Vote.objects.all()
+        Args:
+            params: The validated date range of the leaderboard.
+            snapshot: The snapshot of the leaderboard's window, if it is fresh.
 
-        if date_from:
-            date_from = query_param_serializer.validated_data.get("date_from")
-            vote_queryset = vote_queryset.filter(date__gte=date_from)
+        Returns:
+            The paginated leaderboard and the headers of the response.
+        """
+        if snapshot:
+            page = self.paginate_queryset(SnapshotLeaderboard(snapshot))
+            serializer = RestaurantRatingSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data).data, {
+                "X-Cache": "SNAPSHOT"
+            }
 
-        if date_to:
-            date_to = query_param_serializer.validated_data.get("date_to")
-            vote_queryset = vote_queryset.filter(date__lte=date_to)
+        cache_key = get_leaderboard_cache_key(params, self.get_pagination_params())
+        if cache_key:
+            data = get_cached_leaderboard(cache_key)
+            if data is not None:
+                return data, {"X-Cache": "HIT"}
 
-        restaurant_queryset = (
-            Restaurant.objects.filter(vote__in=vote_queryset)
-            .annotate(
-                rating=Sum("vote__total_weight"),
-                distinct_voters=Count("vote__user", distinct=True),
+        index = get_leaderboard_index()
+        if params.get("mode") == "decay":
+            restaurant_queryset = get_restaurants_ordered_by_decayed_rating(
+                params["half_life"],
+                date_to=params.get("date_to"),
+                date_from=params.get("date_from"),
+            )
+        elif index and not isinstance(self.paginator, RestaurantCursorPagination):
+            # Pages are ranked by the index, only their restaurants are read from the database
+            restaurant_queryset = IndexedLeaderboard(
+                index,
+                date_to=params.get("date_to"),
+                date_from=params.get("date_from"),
+            )
+        else:
+            restaurant_queryset = get_restaurants_ordered_by_rating(
+                date_to=params.get("date_to"),
+                date_from=params.get("date_from"),
             )
-            .order_by("-rating", "-distinct_voters")
-        )
 
         page = self.paginate_queryset(restaurant_queryset)
         if page is not None:
-            serializer = RestaurantRatingSerializer(
-                page,
-                many=True,
-                context={"date_from": date_from, "date_to": date_to},
-            )
-            return self.get_paginated_response(serializer.data)
+            serializer = RestaurantRatingSerializer(page, many=True)
+            data = self.get_paginated_response(serializer.data).data
+        else:
+            data = RestaurantRatingSerializer(restaurant_queryset, many=True).data
+
+        if not cache_key:
+            return data, {}
+        set_cached_leaderboard(cache_key, data, params)
+        return data, {"X-Cache": "MISS"}
+
+    def order_by_ratings_cache_stats(
+        self, request: Request, *args, **kwargs
+    ) -> Response:
+        """
+        Get the number of order_by_ratings responses served from and missed by the cache.
+
+        Args:
+            request (Request): The request object.
+
+        Returns:
+            Response: (Response) The hits and misses of the leaderboard cache.
+        """
+        return Response(get_leaderboard_cache_stats(), status=status.HTTP_200_OK)
 
-        serializer = RestaurantRatingSerializer(
-            restaurant_queryset,
-            many=True,
-            context={"date_from": date_from, "date_to": date_to},
+    @property
+    def paginator(self):
+        """
+        Use keyset pagination when the client asks for it with `?pagination=cursor`.
+        """
+        if not hasattr(self, "_paginator"):
+            request = getattr(self, "request", None)
+            if request and request.query_params.get("pagination") == "cursor":
+                self._paginator = RestaurantCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_pagination_params(self) -> Optional[Dict[str, Any]]:
+        """
+        Get the parameters selecting the requested page, used to tell cached pages apart.
+
+        Returns:
+            The host the links of the page point to and the paginator's resolved page parameters, or None if the page
+            is invalid and should not be cached.
+        """
+        page_params = self.paginator.get_page_params(self.request)
+        if page_params is None:
+            return None
+        return {
+            "host": self.request.get_host(),
+            "pagination": type(self.paginator).__name__,
+            **page_params,
+        }
+
+
+class ExportViewSet(viewsets.GenericViewSet):
+    """
+    Stream ratings and votes of a date range as CSV or NDJSON.
+
+    Rows are read through a server-side cursor and written in chunks, so memory stays constant whatever the date
+    range. Clients accepting gzip get the stream gzipped.
+    """
+
+    authentication_classes = [
+        SessionAuthentication,
+        CachedBasicAuthentication,
+        CachedTokenAuthentication,
+    ]
+    permission_classes = [IsAuthenticated]
+
+    def ratings(self, request: Request, *args, **kwargs) -> StreamingHttpResponse:
+        """
+        Export the leaderboard of a date range, ranked like order_by_ratings.
+
+        Args:
+            request (Request): The request object that may contain the date range and output format.
+
+        Returns:
+            StreamingHttpResponse: The rank, restaurant, name, total rating, total votes and voter days of every rated
+                restaurant.
+        """
+        return self.stream("ratings", RATING_COLUMNS, get_rating_rows)
+
+    def votes(self, request: Request, *args, **kwargs) -> StreamingHttpResponse:
+        """
+        Export the raw votes of a date range, ordered by date. Only available to staff users.
+
+        Args:
+            request (Request): The request object that may contain the date range and output format.
+
+        Returns:
+            StreamingHttpResponse: The date, restaurant, user, total votes and total weight of every vote.
+        """
+        return self.stream("votes", VOTE_COLUMNS, get_vote_rows)
+
+    def stream(
+        self, name: str, columns: List[str], get_rows: Callable[..., Iterator[tuple]]
+    ) -> StreamingHttpResponse:
+        serializer = ExportQueryParamSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        output = serializer.validated_data["output"]
+        rows = get_rows(
+            date_to=serializer.validated_data.get("date_to"),
+            date_from=serializer.validated_data.get("date_from"),
+            chunk_size=settings.EXPORT_CHUNK_SIZE,
+        )
+        content = stream_export(columns, rows, output, settings.EXPORT_CHUNK_SIZE)
+
+        gzipped = ACCEPTS_GZIP.search(self.request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if gzipped:
+            content = compress_sequence(content)
+        response = StreamingHttpResponse(
+            content, content_type=EXPORT_CONTENT_TYPES[output]
         )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        response["Content-Disposition"] = f'attachment; filename="{name}.{output}"'
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    def get_permissions(self):
+        if self.action == "votes":
+            return [IsAdminUser()]
+        return super().get_permissions()
 
 
 class VoteViewSet(viewsets.GenericViewSet):
     serializer_class = RestaurantVoteSerializer
     authentication_classes = [
         SessionAuthentication,
-        BasicAuthentication,
-        TokenAuthentication,
+        CachedBasicAuthentication,
+        CachedTokenAuthentication,
     ]
     permission_classes = [IsAuthenticated]
+    throttle_classes = [VoteUserRateThrottle, VoteTokenRateThrottle]
 
     def post(self, request: Request, *args, **kwargs) -> Response:
         """
@@ -108,22 +406,138 @@ class VoteViewSet(viewsets.GenericViewSet):
             response (Response): The response depending on different statuses.
         """
         user = request.user
+        vote_counter = get_vote_counter()
+        # Users who used today's votes are turned away before the restaurant is looked up
+        if vote_counter.is_exhausted(user.pk):
+            return Response(
+                "You have reached your daily voting limit.",
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         serializer = self.get_serializer(data=self.request.data)
         serializer.is_valid(raise_exception=True)
-        restaurant = serializer.validated_data.get("restaurant")
+        restaurant_id = serializer.validated_data.get("restaurant")
 
-        # Check if the user has reached the max votes per day limit
-        limit_has_reached = check_has_user_reached_max_vote_limit(user)
-        if limit_has_reached:
+        # Reserve one of the user's daily votes, this is served by the vote counter without hitting the database
+        if not vote_counter.reserve(user.pk):
             return Response(
                 "You have reached your daily voting limit.",
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        if settings.VOTE_WRITE_MODE == "async":
+            # The slot is reserved, the buffer writes the vote in the background
+            get_vote_buffer().put(user.pk, restaurant_id)
+            return Response("Vote has been queued.", status=status.HTTP_202_ACCEPTED)
+
         # Calculate the vote weight and create/update the vote instance
-        vote = calculate_vote_weight(user, restaurant)
-        if not vote:
-            return Response(
-                "Internal server error.", status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        try:
+            calculate_vote_weight(user, restaurant_id)
+        except IntegrityError:
+            vote_counter.release(user.pk)
+            if get_restaurant_registry().lookup([restaurant_id]):
+                raise
+            # The restaurant was deleted after the registry checked it
+            raise ValidationError(
+                {
+                    "restaurant": [
+                        RestaurantIdField.default_error_messages[
+                            "does_not_exist"
+                        ].format(pk_value=restaurant_id)
+                    ]
+                }
             )
+        except Exception:
+            vote_counter.release(user.pk)
+            raise
         return Response("User has successfully voted.", status=status.HTTP_200_OK)
+
+    def bulk(self, request: Request, *args, **kwargs) -> Response:
+        """
+        Create or update many votes at once, e.g. votes collected by kiosks or chat bots.
+
+        The request contains a list of votes, either single `{user, restaurant}` votes or `{user, restaurants}`
+        batches of votes of the same user. The restaurants are checked against the restaurant registry and the users
+        are resolved with one query, the daily limits are checked against the vote counters and all the accepted votes
+        are written in a single transaction.
+
+        Args:
+            request (Request): The request object containing the votes.
+
+        Returns:
+            response (Response): The outcome of every vote, in the order they were sent.
+        """
+        serializer = self.get_serializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+
+        votes = []
+        for item in serializer.validated_data["votes"]:
+            user_id = item.get("user", request.user.pk)
+            for restaurant_id in item.get("restaurants", [item.get("restaurant")]):
+                votes.append((user_id, restaurant_id))
+
+        restaurants = get_restaurant_registry().get_existing(
+            restaurant for _, restaurant in votes
+        )
+        users = {request.user.pk: request.user}
+        other_user_ids = {user_id for user_id, _ in votes} - set(users)
+        if other_user_ids and request.user.is_staff:
+            users.update(User.objects.filter(is_active=True).in_bulk(other_user_ids))
+
+        vote_counter = get_vote_counter()
+        vote_counts: Counter = Counter()
+        results = []
+        for user_id, restaurant_id in votes:
+            voted = False
+            if user_id != request.user.pk and not request.user.is_staff:
+                detail = "You can only vote on your own behalf."
+            elif user_id not in users:
+                detail = "User not found."
+            elif restaurant_id not in restaurants:
+                detail = "Restaurant not found."
+            elif not vote_counter.reserve(user_id):
+                detail = "You have reached your daily voting limit."
+            else:
+                voted = True
+                detail = "User has successfully voted."
+                vote_counts[(user_id, restaurant_id)] += 1
+            results.append(
+                {
+                    "user": user_id,
+                    "restaurant": restaurant_id,
+                    "voted": voted,
+                    "detail": detail,
+                }
+            )
+
+        try:
+            try:
+                calculate_bulk_vote_weights(vote_counts)
+            except IntegrityError:
+                # A restaurant was deleted after the registry checked it, its votes are turned away and the others
+                # written again
+                voted_restaurants = {restaurant_id for _, restaurant_id in vote_counts}
+                existing = get_restaurant_registry().lookup(voted_restaurants)
+                if existing == voted_restaurants:
+                    raise
+                for result in results:
+                    if result["voted"] and result["restaurant"] not in existing:
+                        result.update(voted=False, detail="Restaurant not found.")
+                        key = (result["user"], result["restaurant"])
+                        vote_counts[key] -= 1
+                        if not vote_counts[key]:
+                            del vote_counts[key]
+                        vote_counter.release(result["user"])
+                calculate_bulk_vote_weights(vote_counts)
+        except Exception:
+            for (user_id, _), count in vote_counts.items():
+                for _ in range(count):
+                    vote_counter.release(user_id)
+            raise
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    def get_serializer_class(self):
+        if self.action == "bulk":
+            return BulkVoteSerializer
+        return super().get_serializer_class()
@@ -0,0 +1,159 @@
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from functools import lru_cache
+from typing import List, Optional, Sequence
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Value, When
+from django.db.models.expressions import Expression
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+WEIGHT_FIELD = DecimalField(max_digits=10, decimal_places=2)
+
+
+class WeightPolicy(ABC):
+    """
+    Base class of the vote weighting policies, deciding how much the n-th vote of a user for a restaurant on a day
+    adds to its rating.
+
+    Policies precompute the cumulative weight of 0 to `table_size` votes, so writing a vote is a lookup of its new
+    total, which can also be done in SQL. Votes past the table, which the daily limit normally prevents, add the weight
+    of the first vote past it. The version identifies the weights, change it whenever they change. Votes store the
+    version they were last written or reweighted with, so the votes still weighted by older weights can be found.
+
+    Policies are built with the configured `settings.VOTE_WEIGHTS`, policies computing their weights otherwise ignore
+    them.
+    """
+
+    def __init__(
+        self, version: str, table_size: int, weights: Optional[Sequence] = None
+    ):
+        self.version = version
+        self.table_size = max(table_size, 1)
+
+    @abstractmethod
+    def get_weight(self, number: int) -> Decimal:
+        """
+        Get the weight of the n-th vote of a user for a restaurant on a day.
+
+        Args:
+            number (int): The number of the vote, starting at 1.
+
+        Returns:
+            weight (Decimal): The weight the vote adds, with at most 2 decimal places.
+        """
+        raise NotImplementedError
+
+    @cached_property
+    def cumulative_weights(self) -> List[Decimal]:
+        """
+        The total weight of 0, 1, ... `table_size` votes.
+        """
+        weights = [Decimal(0)]
+        for number in range(1, self.table_size + 1):
+            weight = self.get_weight(number)
+            if weight != weight.quantize(Decimal("0.01")):
+                raise ImproperlyConfigured(
+                    f"Vote weights can have at most 2 decimal places, got {weight}."
+                )
+            weights.append(weights[-1] + weight)
+        return weights
+
+    @cached_property
+    def tail_weight(self) -> Decimal:
+        """
+        The weight of the votes past the table.
+        """
+        return self.get_weight(self.table_size + 1)
+
+    def get_total_weight(self, total_votes: int) -> Decimal:
+        """
+        Get the total weight of a user's votes for a restaurant on a day.
+        """
+        if total_votes <= self.table_size:
+            return self.cumulative_weights[total_votes]
+        return (
+            self.cumulative_weights[-1]
+            + (total_votes - self.table_size) * self.tail_weight
+        )
+
+    def get_added_weight(self, previous_votes: int, count: int) -> Decimal:
+        """
+        Get the weight `count` new votes add on top of `previous_votes` votes.
+        """
+        return self.get_total_weight(previous_votes + count) - self.get_total_weight(
+            previous_votes
+        )
+
+    def get_total_weight_expression(
+        self, total_votes: str = "total_votes", added_votes: int = 0
+    ) -> Expression:
+        """
+        Build the SQL expression of the total weight of the number of votes in a field, plus `added_votes`, as a CASE
+        over the table.
+
+        Args:
+            total_votes (str): The field holding the number of votes.
+            added_votes (int): The number of votes to add to the field, e.g. 1 when incrementing it.
+
+        Returns:
+            The expression, usable in `update()` and annotations.
+        """
+        return Case(
+            *(
+                When(**{total_votes: number - added_votes}, then=Value(weight))
+                for number, weight in enumerate(self.cumulative_weights)
+                if number >= added_votes
+            ),
+            default=ExpressionWrapper(
+                Value(self.cumulative_weights[-1])
+                + (F(total_votes) + added_votes - self.table_size)
+                * Value(self.tail_weight),
+                output_field=WEIGHT_FIELD,
+            ),
+            output_field=WEIGHT_FIELD,
+        )
+
+
+class StepWeightPolicy(WeightPolicy):
+    """
+    Weights given as a list, the n-th vote weighs the n-th one and every vote past the list weighs the last one.
+
+    With the default `settings.VOTE_WEIGHTS` the first vote weighs 1, the second one 0.5 and every following one 0.25.
+    """
+
+    def __init__(
+        self, version: str, table_size: int, weights: Optional[Sequence] = None
+    ):
+        super().__init__(version, table_size)
+        weights = settings.VOTE_WEIGHTS if weights is None else weights
+        if not weights:
+            raise ImproperlyConfigured("StepWeightPolicy needs at least one weight.")
+        self.weights = [Decimal(str(weight).strip()) for weight in weights]
+
+    def get_weight(self, number: int) -> Decimal:
+        return self.weights[min(number, len(self.weights)) - 1]
+
+
+@lru_cache(maxsize=None)
+def _get_weight_policy(
+    policy: str, version: str, table_size: int, weights: tuple
+) -> WeightPolicy:
+    # The weights are part of the cache key so that overriding them, e.g. in tests, builds a new policy
+    return import_string(policy)(
+        version=version, table_size=table_size, weights=weights
+    )
+
+
+def get_weight_policy() -> WeightPolicy:
+    """
+    Get the weight policy configured by `settings.VOTE_WEIGHT_POLICY`, with a table up to `settings.MAX_VOTES_PER_DAY`.
+    """
+    return _get_weight_policy(
+        settings.VOTE_WEIGHT_POLICY,
+        settings.VOTE_WEIGHT_VERSION,
+        settings.MAX_VOTES_PER_DAY,
+        tuple(settings.VOTE_WEIGHTS),
+    )